@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Memory and time of subscribe/unsubscribe churn on a PusherService.
+
+Runs subscribe/unsubscribe cycles on a service connected to a protocol that discards its frames, and reports the
+gc-tracked objects and resident memory after each step. Channels leave nothing behind once unsubscribed, so both should stay flat however many cycles ran.
+Also reports the memory held per live channel.
+
+Usage: python benchmarks/bench_channels.py [cycles]
+"""
+
+from __future__ import print_function
+import gc
+import string
+import sys
+import time
+
+from twisted.internet import defer, task
+
+from twistedpusher.client import PusherService
+from twistedpusher.events import Event
+
+
+class NullProtocol(object):
+    """Connected protocol dropping every frame sent."""
+    def __init__(self):
+        self.on_connection_lost = defer.Deferred()
+        self.on_event = None
+
+    def send_event(self, event):
+        pass
+
+    def send_events(self, events):
+        pass
+
+    def disconnect(self):
+        pass
+
+
+class NullEndpoint(object):
+    def __init__(self, protocol):
+        self.protocol = protocol
+
+    def connect(self, factory):
+        return defer.succeed(self.protocol)
+
+
+def connected_service():
+    """A PusherService with an established Pusher connection, and its clock."""
+    clock = task.Clock()
+    service = PusherService('key', reactor=clock)
+    protocol = NullProtocol()
+    service.connection.transport.endpoint = NullEndpoint(protocol)
+    service.startService()
+    clock.advance(0)
+    protocol.on_event(Event(name='pusher:connection_established', data={'socket_id': '1.1', 'activity_timeout': 120}))
+    return service, clock
+
+
+def channel_name(i):
+    """Pusher channel names can't contain digits, so spell the index in letters."""
+    letters = []
+    while True:
+        i, digit = divmod(i, 26)
+        letters.append(string.ascii_lowercase[digit])
+        if not i:
+            return 'channel-' + ''.join(letters)
+
+
+def rss_kb():
+    """Current resident set size in kB, from /proc where available."""
+    try:
+        with open('/proc/self/statm') as statm:
+            import resource
+            return int(statm.read().split()[1]) * resource.getpagesize() // 1024
+    except (IOError, OSError):
+        return 0
+
+
+def churn(service, clock, start, count):
+    for i in range(start, start + count):
+        name = channel_name(i)
+        service.subscribe(name)
+        service.unsubscribe(name)
+        # write the queued frames, as the reactor would on its next turn
+        clock.advance(0)
+
+
+def run(cycles):
+    service, clock = connected_service()
+    steps = 4
+    step = cycles // steps
+
+    churn(service, clock, 0, 1000)
+    gc.collect()
+    print("{0:>8} {1:>10} {2:>9} {3:>16}".format('cycles', 'objects', 'rss (kB)', 'us per cycle'))
+    print("{0:>8} {1:>10} {2:>9} {3:>16}".format(0, len(gc.get_objects()), rss_kb(), '-'))
+    for n in range(1, steps + 1):
+        started = time.time()
+        churn(service, clock, n * step, step)
+        elapsed = time.time() - started
+        gc.collect()
+        print("{0:>8} {1:>10} {2:>9} {3:>16.2f}".format(n * step, len(gc.get_objects()), rss_kb(),
+                                                       elapsed / step * 1e6))
+
+    before_objects, before_rss = len(gc.get_objects()), rss_kb()
+    live = step
+    for i in range(live):
+        service.subscribe(channel_name(i))
+    gc.collect()
+    print("\n{0} live channels: {1:.1f} objects and {2:.0f} bytes of resident memory per channel".format(
+        live, (len(gc.get_objects()) - before_objects) / float(live), (rss_kb() - before_rss) * 1024.0 / live))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Throughput of the I/O-free protocol core, without Twisted or autobahn.
+
+"handle" is the per-message cost of the state machine for an already loaded channel event, "receive" adds loading
+the frame, and "receive filtered" is a frame for a channel filtered out after scanning its envelope.
+
+Usage: python benchmarks/bench_core.py [messages]
+"""
+
+from __future__ import print_function
+import json
+import sys
+import time
+
+from twistedpusher.core import ConnectionCore, decode_frame
+
+FRAME = json.dumps({'event': 'trade', 'channel': 'trades', 'data': json.dumps({'price': '382.01', 'amount': '1'})})
+OTHER_FRAME = FRAME.replace('"trades"', '"other"')
+
+
+def connected_core(**kwargs):
+    core = ConnectionCore(**kwargs)
+    core.connecting(0)
+    core.opened(0)
+    core.receive(json.dumps({'event': 'pusher:connection_established',
+                             'data': json.dumps({'socket_id': '1.1', 'activity_timeout': 120})}), 0)
+    core.actions.clear()
+    return core
+
+
+def handle(messages):
+    core = connected_core()
+    event = decode_frame(FRAME)
+    started = time.time()
+    for now in range(messages):
+        core.handle(event, now)
+    return time.time() - started
+
+
+def receive(messages):
+    core = connected_core()
+    started = time.time()
+    for now in range(messages):
+        core.receive(FRAME, now)
+    return time.time() - started
+
+
+def receive_filtered(messages):
+    core = connected_core(channel_filter={'trades'})
+    started = time.time()
+    for now in range(messages):
+        core.receive(OTHER_FRAME, now)
+    return time.time() - started
+
+
+def run(messages):
+    print("{0} messages".format(messages))
+    for name, bench in (('handle', handle), ('receive', receive), ('receive filtered', receive_filtered)):
+        elapsed = bench(messages)
+        print("{0:>18}: {1:8.3f} us per message, {2:10.0f} messages/s".format(name, elapsed / messages * 1e6,
+                                                                               messages / elapsed))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 500000)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Per-message CPU cost of loading a channel event with JSON-encoded data.
+
+Compares the old two-step path (load the frame, then let the channel decode ``data``)
+against loading the event with ``json_data`` set, for every installed JSON backend.
+A listener reads ``data`` so that lazily decoded events pay for decoding too.
+"scan only" is the cost of a frame for an unsubscribed channel, which is dropped after
+scanning its envelope. "accepted" and "dropped" run a frame (with ``data`` before
+``channel``, as Pusher sends it) through ``decode_frame`` with a channel filter, the way
+the client receives it.
+
+Usage: python benchmarks/bench_decode.py [iterations]
+"""
+
+from __future__ import print_function
+import json
+import sys
+import timeit
+
+from twistedpusher import core, events
+from twistedpusher.channel import ChannelEventEmitter
+
+ORDER_BOOK = {
+    'timestamp': '1412000000',
+    'bids': [['382.{0:02d}'.format(i), '0.{0:03d}'.format(i)] for i in range(50)],
+    'asks': [['383.{0:02d}'.format(i), '1.{0:03d}'.format(i)] for i in range(50)],
+}
+FRAME = json.dumps({'event': 'data', 'channel': 'order_book', 'data': json.dumps(ORDER_BOOK)})
+WIRE_FRAME = '{{"event": "data", "data": {0}, "channel": "order_book"}}'.format(json.dumps(json.dumps(ORDER_BOOK)))
+JSON_CHANNELS = {'order_book'}
+OTHER_CHANNELS = {'live_trades'}
+
+
+def two_pass(emitter):
+    emitter.emit_event(events.load_pusher_event(FRAME))
+
+
+def fused(emitter):
+    emitter.emit_event(events.load_pusher_event(FRAME, JSON_CHANNELS))
+
+
+def scan_only(_):
+    events.scan_pusher_envelope(FRAME)
+
+
+def accepted(emitter):
+    emitter.emit_event(core.decode_frame(WIRE_FRAME, channel_filter=JSON_CHANNELS, json_data_channels=JSON_CHANNELS))
+
+
+def dropped(_):
+    core.decode_frame(WIRE_FRAME, channel_filter=OTHER_CHANNELS)
+
+
+def run(iterations):
+    emitter = ChannelEventEmitter(json_data=True)
+    emitter.bind('data', lambda event: event.data)
+    for name in ('ujson',) + events.JSON_BACKENDS:
+        try:
+            events.set_json_backend(name)
+        except ImportError:
+            continue
+        for label, func in (('two pass', two_pass), ('fused', fused), ('scan only', scan_only),
+                            ('accepted', accepted), ('dropped', dropped)):
+            timer = timeit.Timer(lambda: func(emitter))
+            per_message = min(timer.repeat(3, iterations)) / iterations
+            print("{0:>10} {1:>9}: {2:8.2f} us/message".format(name, label, per_message * 1e6))
+    events.set_json_backend()
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Cost of EventEmitter.emit_event against the number of bound listeners.
+
+Compares the precomputed dispatch tables with the previous implementation, which chained
+the global listeners with a defaultdict lookup on every emit. Events nobody listens to
+specifically ("unknown") are included, since they used to leave an empty set behind, and
+are timed against the table lookup that caught KeyError for them as well.
+
+Usage: python benchmarks/bench_emitter.py [iterations]
+"""
+
+from __future__ import print_function
+import sys
+import timeit
+from collections import defaultdict
+from itertools import chain
+
+from twistedpusher.events import Event, EventEmitter
+
+
+class ChainEmitter(EventEmitter):
+    """The dispatch loop EventEmitter used before dispatch tables."""
+    def __init__(self):
+        super(ChainEmitter, self).__init__()
+        self.chain_listeners = defaultdict(set)
+
+    def bind(self, event_name, listener):
+        self.chain_listeners[event_name].add(listener)
+
+    def emit_event(self, event):
+        for cb in chain(self.global_listeners, self.chain_listeners[event.name]):
+            try:
+                cb(event)
+            except Exception:
+                pass
+
+
+class TryEmitter(EventEmitter):
+    """Dispatch tables looked up with try/except KeyError, as before dict.get."""
+    def emit_event(self, event):
+        try:
+            listeners = self._dispatch[event.name]
+        except KeyError:
+            listeners = self._unbound_dispatch(event.name)
+        for cb in listeners:
+            try:
+                cb(event)
+            except Exception:
+                pass
+
+
+def listener(_):
+    pass
+
+
+def build(cls, count):
+    emitter = cls()
+    emitter.bind_all(listener)
+    for i in range(count):
+        emitter.bind('trade', lambda _: None)
+    return emitter
+
+
+def run(iterations):
+    known, unknown = Event(name='trade'), Event(name='order_deleted')
+    print("{0:>9} {1:>8} {2:>14} {3:>14} {4:>14}".format(
+        'listeners', 'event', 'chained (us)', 'try (us)', 'tables (us)'))
+    for count in (0, 1, 4, 16, 64):
+        for event in (known, unknown):
+            timings = []
+            for cls in (ChainEmitter, TryEmitter, EventEmitter):
+                emitter = build(cls, count)
+                timer = timeit.Timer(lambda: emitter.emit_event(event))
+                timings.append(min(timer.repeat(3, iterations)) / iterations * 1e6)
+            label = 'known' if event is known else 'unknown'
+            print("{0:>9} {1:>8} {2:>14.3f} {3:>14.3f} {4:>14.3f}".format(count, label, *timings))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+Cost of resetting activity timeouts, as every received message does.
+
+Compares resetting a DelayedCall on the reactor's timer heap with resetting a Timeout on the shared timer wheel,
+for a number of connections each with its activity timeout running. The reactor's timer heap is serviced every
+few messages, as it is between reactor iterations.
+
+Usage: python benchmarks/bench_timeouts.py [connections] [messages]
+"""
+
+from __future__ import print_function
+import random
+import sys
+import time
+
+from twisted.internet import reactor
+
+from twistedpusher.utils import Timeout
+
+# messages handled per reactor iteration
+MESSAGES_PER_ITERATION = 10
+
+
+def reset_delayed_calls(connections, messages):
+    calls = [reactor.callLater(120, lambda: None) for _ in range(connections)]
+    targets = [random.randrange(connections) for _ in range(messages)]
+    started = time.time()
+    for n, i in enumerate(targets):
+        calls[i].reset(120)
+        if not n % MESSAGES_PER_ITERATION:
+            # the reactor applies the moves when it next looks for due calls
+            reactor.runUntilCurrent()
+    elapsed = time.time() - started
+    for call in calls:
+        call.cancel()
+    return elapsed
+
+
+def reset_timeouts(connections, messages):
+    timeouts = [Timeout(120, lambda: None, start_now=True, reactor=reactor) for _ in range(connections)]
+    targets = [random.randrange(connections) for _ in range(messages)]
+    started = time.time()
+    for n, i in enumerate(targets):
+        timeouts[i].reset()
+        if not n % MESSAGES_PER_ITERATION:
+            reactor.runUntilCurrent()
+    elapsed = time.time() - started
+    for timeout in timeouts:
+        timeout.stop()
+    return elapsed
+
+
+def run(connections, messages):
+    print("{0} connections, {1} messages".format(connections, messages))
+    for name, bench in (('DelayedCall.reset', reset_delayed_calls), ('Timeout.reset', reset_timeouts)):
+        elapsed = bench(connections, messages)
+        print("{0:>18}: {1:8.3f} us per message".format(name, elapsed / messages * 1e6))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 200000)
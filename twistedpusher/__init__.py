@@ -5,5 +5,9 @@ import logging
 from client import Pusher, PusherService, Client, ClientService, VERSION
 from channel import Channel, PresenceChannel, PrivateChannel
 from events import Event
+from presence import MemberStore
+from metrics import PusherMetrics, MetricsResource
+from sharding import ShardedPusherService
+from redundancy import RedundantPusherService
 
 logging.getLogger(__name__).addHandler(logging.NullHandler())
\ No newline at end of file
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- test-case-name: twistedpusher.test.test_aio -*-
+"""
+Pusher client running on an asyncio event loop.
+
+The connection, its transport, subscriptions and channels are those of the Twisted client, given an
+:class:`AsyncioClock` as their reactor and an :class:`AsyncioEndpoint` to connect with: they keep the same
+reconnect and activity timeout behaviour, and events are dispatched on the loop without any thread hop. On Python 2
+the loop comes from ``trollius``.
+"""
+
+import functools
+import logging
+
+from twisted.internet import defer, error
+from twisted.internet.interfaces import IDelayedCall, IReactorTime, IStreamClientEndpoint
+from zope.interface import implementer
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+from twistedpusher.client import PusherClientBase, VERSION
+from twistedpusher.connection import Connection
+from twistedpusher.outbound import CLIENT_EVENT_RATE
+from twistedpusher.registry import ChannelRegistry
+from twistedpusher.subscriptions import SubscriptionManager
+
+log = logging.getLogger(__name__)
+
+
+def as_future(d, loop):
+    """
+    Get an asyncio Future with the result of a Deferred.
+
+    :type d: defer.Deferred
+    :rtype: asyncio.Future
+    """
+    future = asyncio.Future(loop=loop)
+
+    def succeeded(result):
+        if not future.cancelled():
+            future.set_result(result)
+
+    def failed(failure):
+        if not future.cancelled():
+            future.set_exception(failure.value)
+
+    d.addCallbacks(succeeded, failed)
+    return future
+
+
+@implementer(IDelayedCall)
+class DelayedCall(object):
+    """A call scheduled with :meth:`AsyncioClock.callLater`."""
+    def __init__(self, clock, time, func, args, kwargs):
+        self.clock = clock
+        self.time = time
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.called = False
+        self.cancelled = False
+        self._handle = clock.loop.call_at(time, self._run)
+
+    def getTime(self):
+        return self.time
+
+    def active(self):
+        return not (self.called or self.cancelled)
+
+    def cancel(self):
+        self._check_active()
+        self.cancelled = True
+        self._handle.cancel()
+        self.clock._calls.discard(self)
+
+    def reset(self, secondsFromNow):
+        self._move(self.clock.seconds() + secondsFromNow)
+
+    def delay(self, secondsLater):
+        self._move(self.time + secondsLater)
+
+    def _move(self, time):
+        self._check_active()
+        self._handle.cancel()
+        self.time = time
+        self._handle = self.clock.loop.call_at(time, self._run)
+
+    def _check_active(self):
+        if self.cancelled:
+            raise error.AlreadyCancelled()
+        if self.called:
+            raise error.AlreadyCalled()
+
+    def _run(self):
+        self.called = True
+        self.clock._calls.discard(self)
+        self.func(*self.args, **self.kwargs)
+
+
+@implementer(IReactorTime)
+class AsyncioClock(object):
+    """
+    ``IReactorTime`` provider scheduling calls on an asyncio event loop, for the timeouts, send queues and channels
+    of the client. It also stands in for the reactor's thread pool, running listeners bound with ``threaded=True``
+    in the loop's default executor, and for ``callFromThread`` to get back on the loop from there.
+    """
+    def __init__(self, loop=None):
+        """
+        :param loop: the event loop, defaults to the current one
+        """
+        self.loop = loop or asyncio.get_event_loop()
+        self._calls = set()
+
+    def seconds(self):
+        return self.loop.time()
+
+    def callLater(self, delay, func, *args, **kwargs):
+        call = DelayedCall(self, self.loop.time() + delay, func, args, kwargs)
+        self._calls.add(call)
+        return call
+
+    def getDelayedCalls(self):
+        return list(self._calls)
+
+    def getThreadPool(self):
+        return self
+
+    def callInThread(self, func, *args, **kwargs):
+        self.loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+    def callFromThread(self, func, *args, **kwargs):
+        self.loop.call_soon_threadsafe(functools.partial(func, *args, **kwargs))
+
+
+@implementer(IStreamClientEndpoint)
+class AsyncioEndpoint(object):
+    """
+    Client endpoint connecting with the event loop's ``create_connection``, so a
+    :class:`~twistedpusher.transport.Transport` connects asyncio protocols the way it connects Twisted ones.
+    """
+    def __init__(self, host, port, ssl=None, loop=None):
+        """
+        :param host: host to connect to
+        :type host: str
+        :param port: port to connect to
+        :type port: int
+        :param ssl: True or an ``ssl.SSLContext`` for TLS, None for plain TCP
+        :param loop: the event loop, defaults to the current one
+        """
+        self.host = host
+        self.port = port
+        self.ssl = ssl
+        self.loop = loop or asyncio.get_event_loop()
+
+    def connect(self, protocolFactory):
+        """
+        Connect a protocol built by calling ``protocolFactory``.
+
+        :returns: a cancellable Deferred firing with the protocol once connected
+        :rtype: defer.Deferred
+        """
+        attempt = asyncio.ensure_future(
+            self.loop.create_connection(protocolFactory, self.host, self.port, ssl=self.ssl), loop=self.loop)
+        d = defer.Deferred(lambda _: attempt.cancel())
+        attempt.add_done_callback(functools.partial(self._done, d))
+        return d
+
+    @staticmethod
+    def _done(d, attempt):
+        if attempt.cancelled():
+            # only cancelling the Deferred cancels the attempt
+            return
+        exception = attempt.exception()
+        if d.called:
+            # cancelled as the connection was made
+            if exception is None:
+                attempt.result()[0].close()
+        elif exception is not None:
+            d.errback(exception)
+        else:
+            d.callback(attempt.result()[1])
+
+
+class AsyncioPusher(PusherClientBase):
+    """
+    Pusher client on an asyncio event loop, with the channel API of :class:`~twistedpusher.client.PusherService`.
+    It connects on creation.
+
+    ``when_subscribed`` and ``subscribe_many`` return asyncio Futures. Listeners returning Deferreds or bound
+    with ``max_in_flight`` work as with the Twisted client, and ``threaded=True`` runs listeners in the loop's
+    default executor. Migrating connections is not supported.
+    """
+    def __init__(self, key, encrypted=True, loop=None, endpoint=None, subscription_timeout=10,
+                 subscription_retries=2, backoff=None, metrics=None, send_rate=CLIENT_EVENT_RATE,
+                 send_burst=CLIENT_EVENT_RATE, max_buffered=1000, authorizer=None, **kwargs):
+        """
+        :param key: key for the Pusher application to connect to
+        :type key: str
+
+        :param encrypted: whether to use secure websockets
+        :type encrypted: bool
+
+        :param loop: the event loop to run on, defaults to the current one
+
+        :param endpoint: optional ``IStreamClientEndpoint`` provider connecting asyncio protocols, defaults to an
+            :class:`AsyncioEndpoint` for the Pusher host
+
+        :param subscription_timeout: seconds to wait for Pusher to acknowledge a subscription before trying again
+        :type subscription_timeout: int or float
+
+        :param subscription_retries: times to try a subscription again before failing it until the next reconnect
+        :type subscription_retries: int
+
+        :param backoff: optional policy for the delays between connection attempts
+        :type backoff: twistedpusher.transport.BackoffPolicy
+
+        :param metrics: optional metrics to update
+        :type metrics: twistedpusher.metrics.PusherMetrics
+
+        :param send_rate: client events sent per second, or None not to limit them. Pusher allows 10.
+        :type send_rate: int or float
+
+        :param send_burst: client events that can be sent at once after being idle
+        :type send_burst: int
+
+        :param max_buffered: most client events kept to send while reconnecting, the oldest are dropped beyond it
+        :type max_buffered: int
+
+        :param authorizer: signs subscriptions to private and presence channels. It must not need the Twisted
+            reactor, e.g. return the signatures or a Deferred fired from the loop.
+        :type authorizer: twistedpusher.interfaces.IChannelAuthorizer
+        """
+        PusherClientBase.__init__(self)
+
+        self.key = key
+        self.encrypted = encrypted
+        self.loop = loop or asyncio.get_event_loop()
+        self.reactor = AsyncioClock(self.loop)
+
+        factory = self._build_factory(key, encrypted, self.loop, **kwargs)
+        if endpoint is None:
+            endpoint = AsyncioEndpoint(self.host, 443 if encrypted else 80, ssl=encrypted or None, loop=self.loop)
+        self.factory = factory
+        self.metrics = factory.metrics = metrics
+
+        self.connection = Connection(factory, endpoint, self._on_event, reactor=self.reactor, backoff=backoff,
+                                     metrics=metrics, send_rate=send_rate, send_burst=send_burst,
+                                     max_buffered=max_buffered)
+        self.subscriptions = SubscriptionManager(self.connection, subscription_timeout, subscription_retries,
+                                                 self.reactor, authorizer)
+        self.connection.outbound.subscriptions = self.subscriptions
+
+        self.registry = ChannelRegistry(self.subscriptions, factory.json_data_channels)
+        # Subscribed channels, owned by the registry
+        self.channels = self.registry.channels
+        # frames for channels we aren't subscribed to are dropped by the protocol before they are parsed
+        factory.channel_filter = self.channels
+
+        self.connect()
+
+    def connect(self):
+        """Connect to Pusher."""
+        if not self.connection.running:
+            self.connection.startService()
+
+    def disconnect(self):
+        """Disconnect from Pusher."""
+        if self.connection.running:
+            self.connection.stopService()
+
+    def _result(self, d):
+        return as_future(d, self.loop)
+
+    @classmethod
+    def _build_factory(cls, key, encrypted, loop, **kwargs):
+        # autobahn runs on a single framework per process, importing it here leaves Twisted to twistedpusher.client
+        from twistedpusher.aiowebsocket import AsyncioPusherWebsocketFactory
+
+        return AsyncioPusherWebsocketFactory(url=cls._build_url(key, encrypted),
+                                             useragent='{0}/{1}'.format(cls.client_name, VERSION),
+                                             loop=loop,
+                                             **kwargs)
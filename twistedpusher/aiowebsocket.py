@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- test-case-name: twistedpusher.test.test_aio -*-
+
+import logging
+
+from zope.interface import implementer
+from twisted.internet import defer
+from autobahn.asyncio.websocket import WebSocketClientProtocol, WebSocketClientFactory
+
+from twistedpusher.core import decode_frame
+from twistedpusher.events import serialize_pusher_event
+from twistedpusher.interfaces import IPusherProtocol
+
+log = logging.getLogger(__name__)
+
+
+@implementer(IPusherProtocol)
+class AsyncioPusherWebsocketProtocol(WebSocketClientProtocol):
+    """
+    Pusher websocket connection on an asyncio event loop, like ``twistedpusher.websocket.PusherWebsocketProtocol``.
+
+    :ivar dropped_frames: number of frames discarded by the factory's ``channel_filter``
+    :type dropped_frames: int
+    """
+    factory = None
+
+    def __init__(self):
+        WebSocketClientProtocol.__init__(self)
+        self.on_connection_lost = defer.Deferred()
+        self.on_event = None
+        self.dropped_frames = 0
+        self._write_batch = None
+
+    def onClose(self, wasClean, code, reason):
+        """Handle Websocket connection shutdowns."""
+        self.on_connection_lost.callback({'clean': wasClean, 'code': code, 'reason': reason})
+
+    def onMessage(self, payload, isBinary):
+        """Receive websocket messages, loaded with the factory's settings by ``twistedpusher.core.decode_frame``."""
+        if isBinary:
+            raise NotImplementedError("Pusher websocket message in a binary format.")
+        factory = self.factory
+        event = decode_frame(payload, None, factory.json_data_channels, factory.channel_filter, factory.metrics)
+        if event is None:
+            self.dropped_frames += 1
+        elif self.on_event:
+            self.on_event(event)
+
+    def send_event(self, event):
+        """:type event: Event"""
+        self.sendMessage(serialize_pusher_event(event))
+        self._count_sent(1)
+
+    def send_events(self, events):
+        """
+        Send events with one write to the transport, so they share TCP segments and TLS records.
+
+        :type events: list
+        """
+        self._write_batch = []
+        try:
+            for event in events:
+                self.sendMessage(serialize_pusher_event(event))
+        finally:
+            batch, self._write_batch = self._write_batch, None
+        if batch:
+            WebSocketClientProtocol.sendData(self, b''.join(batch))
+        self._count_sent(len(events))
+
+    def _count_sent(self, frames):
+        if self.factory.metrics is not None:
+            self.factory.metrics.frames_sent.inc(frames)
+
+    def sendData(self, data, sync=False, chopsize=None):
+        """Collect frame data while in ``send_events``, otherwise write it as usual."""
+        if self._write_batch is not None and not sync and not chopsize:
+            self._write_batch.append(data)
+        else:
+            WebSocketClientProtocol.sendData(self, data, sync, chopsize)
+
+    def disconnect(self):
+        if self.state == WebSocketClientProtocol.STATE_OPEN:
+            self.sendClose(code=1000)
+
+
+class AsyncioPusherWebsocketFactory(WebSocketClientFactory):
+    """
+    Factory for Pusher websocket connections on an asyncio event loop, passed as the ``loop`` keyword argument.
+
+    :ivar json_data_channels: names of channels whose client event data is decoded as JSON while loading the event
+    :type json_data_channels: set
+
+    :ivar channel_filter: if set, channel events for channels not in this container are dropped before being parsed
+    :type channel_filter: set or dict or None
+
+    :ivar metrics: if set, counts the frames of the protocols built
+    :type metrics: twistedpusher.metrics.PusherMetrics or None
+    """
+    protocol = AsyncioPusherWebsocketProtocol
+
+    def __init__(self, *args, **kwargs):
+        WebSocketClientFactory.__init__(self, *args, **kwargs)
+        self.json_data_channels = set()
+        self.channel_filter = None
+        self.metrics = None
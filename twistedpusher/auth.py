@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- test-case-name: twistedpusher.test.test_auth -*-
+
+import hashlib
+import hmac
+import json
+import logging
+from collections import OrderedDict
+from io import BytesIO
+try:
+    from urllib import urlencode
+except ImportError:  # pragma: no cover
+    from urllib.parse import urlencode
+
+from zope.interface import implementer
+from twisted.internet import defer
+from twisted.python.failure import Failure
+from twisted.web.client import Agent, HTTPConnectionPool, FileBodyProducer, readBody
+from twisted.web.http_headers import Headers
+
+from twistedpusher.errors import AuthorizationError
+from twistedpusher.interfaces import IChannelAuthorizer
+
+log = logging.getLogger(__name__)
+
+# number of socket IDs whose signatures HTTPAuthorizer keeps
+CACHED_SOCKETS = 16
+
+
+def sign_subscription(key, secret, socket_id, channel_name, channel_data=None):
+    """
+    Sign a channel subscription as Pusher expects.
+
+    :param key: the Pusher application key
+    :param secret: the Pusher application secret
+    :param socket_id: the subscribing connection's socket ID
+    :param channel_name: the private or presence channel
+    :param channel_data: for presence channels, the JSON encoded user data
+
+    :returns: the ``auth`` field of the subscription, ``key:signature``
+    :rtype: str
+    """
+    message = u'{0}:{1}'.format(socket_id, channel_name)
+    if channel_data is not None:
+        message = u'{0}:{1}'.format(message, channel_data)
+    signature = hmac.new(secret.encode('utf8'), message.encode('utf8'), hashlib.sha256).hexdigest()
+    return '{0}:{1}'.format(key, signature)
+
+
+@implementer(IChannelAuthorizer)
+class SecretAuthorizer(object):
+    """
+    Signs subscriptions in process with the application secret. Only for trusted processes.
+    """
+    def __init__(self, key, secret, user_data=None):
+        """
+        :param key: the Pusher application key
+        :param secret: the Pusher application secret
+        :param user_data: for presence channels, the ``user_id`` and optional ``user_info`` to join as
+        :type user_data: dict
+        """
+        self.key = key
+        self.secret = secret
+        self.user_data = user_data
+
+    def authorize(self, socket_id, channel_names):
+        auths = dict()
+        for name in channel_names:
+            channel_data = None
+            if name.startswith('presence-'):
+                if self.user_data is None:
+                    # refused, there is no user to join as
+                    continue
+                channel_data = json.dumps(self.user_data)
+            auth = {'auth': sign_subscription(self.key, self.secret, socket_id, name, channel_data)}
+            if channel_data is not None:
+                auth['channel_data'] = channel_data
+            auths[name] = auth
+        return defer.succeed(auths)
+
+
+class _Batch(object):
+    """Channels of one socket waiting to be authorized together."""
+    def __init__(self, socket_id):
+        self.socket_id = socket_id
+        self.channel_names = OrderedDict()
+        # (Deferred, channel names, signatures already known) for each authorize call
+        self.requests = []
+
+
+@implementer(IChannelAuthorizer)
+class HTTPAuthorizer(object):
+    """
+    Gets subscription signatures from an authentication endpoint of the application.
+
+    Channels requested during one reactor iteration are authorized with a single POST, over connections kept
+    open by a pool, so subscribing many channels costs one round-trip and reconnecting costs no new handshake.
+    The request isn't waited for on the reactor thread: public channels subscribe as usual meanwhile.
+
+    A single channel is requested as Pusher's client libraries do, with ``socket_id`` and ``channel_name`` form
+    fields, and the endpoint answers ``{"auth": ..., "channel_data": ...}``. Several channels are requested with
+    repeated ``channel_name[]`` fields, and the endpoint answers with an object keyed by channel name whose values
+    are either such an object, or ``{"status": ..., "data": ...}`` as the batch authentication plugin of pusher-js
+    expects.
+
+    Signatures are cached for the last ``CACHED_SOCKETS`` socket IDs, since a signature is only valid for the
+    connection it was requested for. A request not answered within ``timeout`` seconds is cancelled and fails the
+    authorization, so that subscriptions don't wait forever on a hung endpoint.
+    """
+    def __init__(self, url, headers=None, params=None, reactor=None, pool=None, max_batch=100, timeout=10):
+        """
+        :param url: the endpoint's URL
+        :type url: str
+        :param headers: extra headers of the requests, e.g. for a session cookie
+        :type headers: dict
+        :param params: extra form fields of the requests
+        :type params: dict
+        :param reactor: optional Twisted reactor
+        :param pool: ``HTTPConnectionPool`` to request with, by default a persistent one
+        :param max_batch: most channels authorized in one request
+        :type max_batch: int
+        :param timeout: seconds to wait for the endpoint to connect and answer
+        :type timeout: int or float
+        """
+        if not reactor:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self.url = url if isinstance(url, bytes) else url.encode('ascii')
+        self.headers = headers or {}
+        self.params = params or {}
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.pool = pool if pool is not None else HTTPConnectionPool(reactor, persistent=True)
+        self.agent = Agent(reactor, connectTimeout=timeout, pool=self.pool)
+
+        # socket ID -> channel name -> auth, most recently used last
+        self._cache = OrderedDict()
+        # socket ID -> _Batch waiting for the end of the reactor iteration
+        self._batches = OrderedDict()
+        self._flush_call = None
+
+    def authorize(self, socket_id, channel_names):
+        cached = self._cache.pop(socket_id, None)
+        if cached is None:
+            cached = dict()
+            while len(self._cache) >= CACHED_SOCKETS:
+                self._cache.popitem(last=False)
+        self._cache[socket_id] = cached
+
+        known = dict((name, cached[name]) for name in channel_names if name in cached)
+        missing = [name for name in channel_names if name not in cached]
+        if not missing:
+            return defer.succeed(known)
+
+        batch = self._batches.get(socket_id)
+        if batch is None:
+            batch = self._batches[socket_id] = _Batch(socket_id)
+        for name in missing:
+            batch.channel_names[name] = None
+        d = defer.Deferred()
+        batch.requests.append((d, missing, known))
+        if self._flush_call is None:
+            self._flush_call = self.reactor.callLater(0, self._flush)
+        return d
+
+    def close(self):
+        """
+        Close the pooled connections.
+
+        :rtype: defer.Deferred
+        """
+        return self.pool.closeCachedConnections()
+
+    def _flush(self):
+        self._flush_call = None
+        batches, self._batches = list(self._batches.values()), OrderedDict()
+        for batch in batches:
+            names = list(batch.channel_names)
+            chunks = [names[i:i + self.max_batch] for i in range(0, len(names), self.max_batch)]
+            d = defer.gatherResults([self._request(batch.socket_id, chunk) for chunk in chunks], consumeErrors=True)
+            d.addCallbacks(self._batch_done, self._batch_failed, callbackArgs=(batch,), errbackArgs=(batch,))
+
+    def _request(self, socket_id, channel_names):
+        """POST the channels to the endpoint. Fires with the signatures of the channels that were authorized."""
+        fields = list(self.params.items()) + [('socket_id', socket_id)]
+        if len(channel_names) == 1:
+            fields.append(('channel_name', channel_names[0]))
+        else:
+            fields.extend(('channel_name[]', name) for name in channel_names)
+        body = urlencode([(k, v.encode('utf8') if not isinstance(v, bytes) else v) for k, v in fields])
+        headers = Headers({b'Content-Type': [b'application/x-www-form-urlencoded']})
+        for name, value in self.headers.items():
+            headers.addRawHeader(name, value)
+
+        d = self.agent.request(b'POST', self.url, headers, FileBodyProducer(BytesIO(body.encode('ascii'))))
+
+        def read(response):
+            d = readBody(response)
+            d.addCallback(lambda content: (response.code, content))
+            return d
+
+        d.addCallback(read)
+        deadline = self.reactor.callLater(self.timeout, d.cancel)
+
+        def done(result):
+            if deadline.active():
+                deadline.cancel()
+            elif isinstance(result, Failure) and result.check(defer.CancelledError):
+                raise AuthorizationError("Authentication endpoint didn't answer within {0} seconds".format(
+                    self.timeout))
+            return result
+
+        d.addBoth(done)
+        d.addCallback(self._parse, channel_names)
+        return d
+
+    @staticmethod
+    def _parse(result, channel_names):
+        code, content = result
+        if code != 200:
+            raise AuthorizationError("Authentication endpoint answered {0}".format(code))
+        try:
+            body = json.loads(content.decode('utf8'))
+        except ValueError:
+            raise AuthorizationError("Authentication endpoint answered with invalid JSON")
+        if len(channel_names) == 1 and 'auth' in body:
+            body = {channel_names[0]: body}
+        auths = dict()
+        for name in channel_names:
+            entry = body.get(name)
+            if isinstance(entry, dict) and 'status' in entry:
+                entry = entry.get('data') if entry['status'] == 200 else None
+            if isinstance(entry, dict) and 'auth' in entry:
+                auths[name] = entry
+        return auths
+
+    def _batch_done(self, results, batch):
+        auths = dict()
+        for result in results:
+            auths.update(result)
+        cached = self._cache.get(batch.socket_id)
+        if cached is not None:
+            cached.update(auths)
+        for d, names, known in batch.requests:
+            result = dict(known)
+            result.update((name, auths[name]) for name in names if name in auths)
+            d.callback(result)
+
+    def _batch_failed(self, failure, batch):
+        failure = failure.value.subFailure if isinstance(failure.value, defer.FirstError) else failure
+        log.warning("Channel authorization failed: {0}".format(failure.getErrorMessage()))
+        for d, _, _ in batch.requests:
+            d.errback(failure)
+
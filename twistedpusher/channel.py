@@ -3,59 +3,104 @@
 
 import logging
 import re
-import json
-from collections import Callable
 
-from twistedpusher.events import Event, EventEmitter
-from twistedpusher.errors import BadChannelNameError
+from twistedpusher import events, delivery
+from twistedpusher.events import Event, EventEmitter, is_pusher_event
+from twistedpusher.errors import BadChannelNameError, BadEventNameError
+from twistedpusher.latency import ChannelLatency
+from twistedpusher.presence import MemberStore
+from twistedpusher.utils import monotonic_ns
 
 log = logging.getLogger(__name__)
 
-# todo add support for private and presence channels
-# features: trigger client events, channel member data (presence), authentication (incl. subscription failure)
-
 VALID_CHANNEL_NAME = re.compile('^[a-zA-Z_\-=@,.;]+$')
 
 
-class ListenerWrapper(Callable):
-    """
-    This class is a doppelganger.
-    It would be good to redo this in a simpler way, but I
-    don't know how. functools.wrap doesn't work.
-    """
-    def __init__(self, target, ignore_pusher_events=True):
-        self.listener = target
-        self.ignore_pusher_events = ignore_pusher_events
-    def __repr__(self):
-        return self.listener.__repr__()
-    def __str__(self):
-        return self.listener.__str__()
-    def __call__(self, event):
-        if self.ignore_pusher_events:
-            if not event.name.startswith(('pusher_internal:', 'pusher:')):
-                self.listener(event)
-        else:
-            self.listener(event)
-    def __hash__(self):
-        return self.listener.__hash__()
-    def __eq__(self, other):
-        return self.listener == other
-
-    def __getattr__(self, item):
-        return getattr(self.listener, item)
-
-
 class ChannelEventEmitter(EventEmitter):
     """
     Overrides EventEmitter to add a few features to Channels.
     1. an init flag to enable parsing client event data as JSON
     2. a bind_all flag to enable filtering of pusher events
+    3. bind flags to call listeners off the reactor thread, see :class:`~twistedpusher.delivery.PooledListener`
+    4. a limit on unfinished calls of listeners returning Deferreds, see :class:`~twistedpusher.delivery.AsyncListener`
+    5. an init flag to conflate client events by key
+    6. batched delivery with ``bind_batch``
+    7. latency histograms of the events dispatched, see :class:`~twistedpusher.latency.ChannelLatency`
+
+    Global listeners that ignore pusher events are left out of the dispatch tables of pusher event names,
+    so filtering costs nothing per event.
+
+    With conflation, client events are queued and dispatched once per reactor iteration, and an event replaces the
+    queued event with the same key in place. Listeners bound off the reactor thread or with an in-flight limit also
+    conflate their waiting events by that key, so a slow listener always gets the latest state.
+
+    :ivar user_listeners: the global listeners that only receive client events
+    :type user_listeners: set
+
+    :ivar conflated: events waiting to be dispatched if conflation is enabled, else None
+    :type conflated: twistedpusher.delivery.EventQueue
+
+    :ivar latency: latency histograms, or None if disabled
+    :type latency: twistedpusher.latency.ChannelLatency
     """
-    def __init__(self, json_data=False):
+    def __init__(self, json_data=False, reactor=None, max_in_flight=None, conflate=None, max_conflated=10000,
+                 track_latency=True, timestamp_field=None):
+        self.user_listeners = set()
+        self._pusher_global_dispatch = ()
         super(ChannelEventEmitter, self).__init__()
         self.parse_json_data = json_data
+        if conflate is not None and not reactor:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self.max_in_flight = max_in_flight
+        # (event name, or None for global listeners, listener) -> wrapper bound in the listener's place
+        self._wrappers = dict()
+
+        self.conflate_key = conflate
+        self.conflated = delivery.EventQueue(max_conflated, conflate) if conflate is not None else None
+        self._flush_call = None
+
+        self.latency = ChannelLatency(timestamp_field) if track_latency else None
+
+    def bind(self, event_name, listener, threaded=False, **delivery_options):
+        """
+        Bind a listener to a specific event.
+
+        :param event_name: name of the event to bind to
+        :type event_name: str or unicode
+
+        :param listener: function that will receive those events
+
+        :param threaded: call the listener from the reactor's thread pool instead of on the reactor thread
+        :type threaded: bool
+
+        :param delivery_options: ``threadpool`` or ``process_pool`` to also run the listener off the reactor thread,
+            tuned with ``max_pending``, ``overflow`` and ``conflate_key``, see
+            :class:`~twistedpusher.delivery.PooledListener`. Otherwise ``max_in_flight`` (defaulting to the
+            channel's) limits unfinished calls of a listener returning Deferreds, with waiting events tuned by
+            ``max_pending`` and ``conflate_key``, see :class:`~twistedpusher.delivery.AsyncListener`.
+
+        :raises ValueError: if listener is not callable
+        :raises TypeError: if delivery options are given that don't apply
+        """
+        wrapped = self._wrap_listener((event_name, listener), threaded, delivery_options)
+        return super(ChannelEventEmitter, self).bind(event_name, wrapped)
+
+    def unbind(self, event_name, listener):
+        """
+        Unbind a listener from a specific event.
+
+        :param event_name: name of the event that the listener was bound to
+        :type event_name: str or unicode
+
+        :param listener: function that will no longer receive events
 
-    def bind_all(self, listener, ignore_pusher_events=True):
+        :warns: if listener to be removed is not found
+        """
+        wrapped = self._pop_wrapper((event_name, listener))
+        return super(ChannelEventEmitter, self).unbind(event_name, wrapped)
+
+    def bind_all(self, listener, ignore_pusher_events=True, threaded=False, **delivery_options):
         """
         Bind a listener to all events produced.
 
@@ -63,19 +108,133 @@ class ChannelEventEmitter(EventEmitter):
         :param ignore_pusher_events: allows ignoring pusher events (those starting pusher: and pusher_internal:)
         :type ignore_pusher_events: bool
 
+        :param threaded: call the listener from the reactor's thread pool, see ``bind``
+        :param delivery_options: see ``bind``
+
         :raises ValueError: if listener is not callable
         """
-        # todo make a test to check whether a warning for a listener exception provides original function's info
-        # todo another method of suppressing pusher_internal events
-        # and not the doppelganger
-        if ignore_pusher_events:
-            if not callable(listener):
-                raise ValueError("Global listener to be bound must be a callable.")
-            wrapped = ListenerWrapper(listener)
-            maybe_wrapped = wrapped
+        wrapped = self._wrap_listener((None, listener), threaded, delivery_options)
+        if callable(wrapped):
+            if ignore_pusher_events:
+                self.user_listeners.add(wrapped)
+            else:
+                self.user_listeners.discard(wrapped)
+        return super(ChannelEventEmitter, self).bind_all(wrapped)
+
+    def unbind_all(self, listener):
+        """
+        Unbind a global listener.
+
+        :param listener: function that will no longer be called with all events
+
+        :warns: if specified global listener to be removed is not found
+        """
+        wrapped = self._pop_wrapper((None, listener))
+        self.user_listeners.discard(wrapped)
+        return super(ChannelEventEmitter, self).unbind_all(wrapped)
+
+    def bind_batch(self, listener, max_size=None, max_delay=0, event_name=None):
+        """
+        Bind a listener to receive events in lists rather than one call per event.
+
+        Events are collected and delivered once per reactor iteration, ``max_delay`` seconds after the first event
+        of a batch, or when a batch holds ``max_size`` events, see :class:`~twistedpusher.delivery.BatchListener`.
+        Unbind with ``unbind_all``, or ``unbind`` if bound to a single event.
+
+        :param listener: callable that will receive lists of events
+        :param max_size: most events in one batch, None for no limit
+        :type max_size: int or None
+        :param max_delay: longest time in seconds an event waits for its batch to be delivered
+        :type max_delay: float
+        :param event_name: only batch events of this name. By default all client events are batched.
+        :type event_name: str or unicode or None
+
+        :raises ValueError: if listener is not callable
+        """
+        key = (event_name, listener)
+        wrapped = delivery.BatchListener(listener, max_size, max_delay, self.reactor, emitter=self)
+        self._discard_wrapper(key)
+        self._wrappers[key] = wrapped
+        if event_name is None:
+            self.user_listeners.add(wrapped)
+            return super(ChannelEventEmitter, self).bind_all(wrapped)
+        return super(ChannelEventEmitter, self).bind(event_name, wrapped)
+
+    def _wrap_listener(self, key, threaded, delivery_options):
+        """
+        Get what to bind in place of a listener, replacing any wrapper bound earlier for the same key.
+
+        :param key: tuple of event name (None for global listeners) and listener
+        :returns: the listener, or a wrapper that delivers events to it
+        """
+        listener = key[1]
+        self._discard_wrapper(key)
+
+        max_in_flight = delivery_options.pop('max_in_flight', self.max_in_flight)
+        threaded = threaded or 'threadpool' in delivery_options or 'process_pool' in delivery_options
+        if self.conflate_key is not None and (threaded or max_in_flight):
+            delivery_options.setdefault('conflate_key', self.conflate_key)
+            if threaded:
+                delivery_options.setdefault('overflow', 'conflate')
+        if threaded:
+            wrapped = delivery.PooledListener(listener, reactor=self.reactor, emitter=self, **delivery_options)
+        elif max_in_flight:
+            wrapped = delivery.AsyncListener(listener, max_in_flight, reactor=self.reactor, emitter=self,
+                                             **delivery_options)
+        elif delivery_options:
+            raise TypeError("Delivery options {0} need threaded or max_in_flight".format(sorted(delivery_options)))
         else:
-            maybe_wrapped = listener
-        return super(ChannelEventEmitter, self).bind_all(maybe_wrapped)
+            return listener
+        self._wrappers[key] = wrapped
+        return wrapped
+
+    def _pop_wrapper(self, key):
+        """
+        Forget the wrapper bound for a key and get it. The key's listener may be the wrapper itself, as when an
+        error policy unbinds a failing wrapper.
+
+        :returns: the wrapper, or the listener if it was bound as is
+        """
+        event_name, listener = key
+        wrapped = self._wrappers.pop(key, None)
+        if wrapped is not None:
+            return wrapped
+        wrapped_key = (event_name, getattr(listener, 'listener', None))
+        if self._wrappers.get(wrapped_key) is listener:
+            del self._wrappers[wrapped_key]
+        return listener
+
+    def _discard_wrapper(self, key):
+        """Unbind the wrapper bound earlier for a key, if any."""
+        event_name = key[0]
+        old = self._wrappers.pop(key, None)
+        if old is not None:
+            if event_name is None:
+                self.user_listeners.discard(old)
+                super(ChannelEventEmitter, self).unbind_all(old)
+            else:
+                super(ChannelEventEmitter, self).unbind(event_name, old)
+
+    def listener_stats(self):
+        """
+        Get delivery statistics of listeners bound to run off the reactor thread, with an in-flight limit or in
+        batches.
+
+        :returns: ``stats()`` of each such listener, keyed by ``(event_name, listener)``. The event name is None
+            for listeners bound with ``bind_all``.
+        :rtype: dict
+        """
+        return dict((key, wrapped.stats()) for key, wrapped in self._wrappers.items())
+
+    def _unbound_dispatch(self, event_name):
+        if is_pusher_event(event_name):
+            return self._pusher_global_dispatch
+        return self._global_dispatch
+
+    def _rebuild_global_dispatch(self):
+        super(ChannelEventEmitter, self)._rebuild_global_dispatch()
+        self._pusher_global_dispatch = tuple(listener for listener in self._global_dispatch
+                                             if listener not in self.user_listeners)
 
     def emit_event(self, event):
         """
@@ -84,13 +243,49 @@ class ChannelEventEmitter(EventEmitter):
         :param event: event object guaranteed to have fields 'name', 'channel', and 'data'
         :type event: Event
         """
-        if self.parse_json_data and isinstance(event.data, (str, unicode)):
-            event.data = json.loads(event.data)
-        return super(ChannelEventEmitter, self).emit_event(event)
+        if self.parse_json_data:
+            if isinstance(event, Event):
+                # decoded only once a listener reads it
+                event.decode_data_lazily()
+            elif isinstance(event.data, (str, unicode)):
+                event.data = events.json_backend.loads(event.data)
+        if self.conflated is not None and not is_pusher_event(event.name):
+            self.conflated.put(event)
+            if self._flush_call is None:
+                self._flush_call = self.reactor.callLater(0, self._flush_conflated)
+            return
+        self._dispatch_event(event)
+
+    def _flush_conflated(self):
+        """Dispatch the conflated events queued during the last reactor iteration."""
+        self._flush_call = None
+        for event in self.conflated.get_all():
+            self._dispatch_event(event)
+
+    def _dispatch_event(self, event):
+        if self.latency is None:
+            return super(ChannelEventEmitter, self).emit_event(event)
+        start = monotonic_ns()
+        super(ChannelEventEmitter, self).emit_event(event)
+        self.latency.record(event, start, monotonic_ns())
+
+    def latency_stats(self):
+        """
+        Get the latency histograms of the channel. Safe to call at any time, the histograms keep recording.
+
+        :returns: ``parse``, ``queue``, ``dispatch`` and ``exchange`` summaries in nanoseconds, see
+            :meth:`twistedpusher.latency.ChannelLatency.snapshot`, or None if latency tracking is disabled
+        :rtype: dict or None
+        """
+        return self.latency.snapshot() if self.latency is not None else None
 
 
 class Channel(ChannelEventEmitter):
-    def __init__(self, channel_name, connection, json_data=False, **kwargs):
+    # whether subscribing needs a signature from an IChannelAuthorizer
+    requires_auth = False
+
+    def __init__(self, channel_name, connection, json_data=False, reactor=None, max_in_flight=None, conflate=None,
+                 max_conflated=10000, track_latency=True, timestamp_field=None, **kwargs):
         """
         Represents a Pusher channel.
 
@@ -100,9 +295,27 @@ class Channel(ChannelEventEmitter):
 
         :param json_data: optional flag to enable parsing user event data as JSON
 
+        :param reactor: optional Twisted reactor, used by listeners bound to run off the reactor thread
+
+        :param max_in_flight: optional default limit on unfinished calls for every listener bound to the channel,
+            for listeners returning Deferreds
+        :type max_in_flight: int
+
+        :param conflate: optional key to conflate client events by: ``'name'`` for the event name, the name of a
+            field of the event data, or a callable taking an event, see ChannelEventEmitter
+        :param max_conflated: maximum number of distinct keys waiting, the oldest is dropped beyond it
+        :type max_conflated: int
+
+        :param track_latency: flag to keep latency histograms of the events dispatched
+        :type track_latency: bool
+        :param timestamp_field: optional name of a field of the event data holding when the exchange sent the event,
+            to also track exchange to receipt latency
+        :type timestamp_field: str
+
         :raises BadChannelNameError: if connection is not a ConnectionManager or the Pusher channel name is invalid
         """
-        super(Channel, self).__init__(json_data)
+        super(Channel, self).__init__(json_data, reactor, max_in_flight, conflate, max_conflated, track_latency,
+                                      timestamp_field)
 
         self.connection = connection
 
@@ -110,8 +323,7 @@ class Channel(ChannelEventEmitter):
             raise BadChannelNameError("Invalid channel name '{0}'".format(channel_name.encode('utf8')))
         self.name = channel_name
 
-        self.bind('pusher_internal:subscription_succeeded', self._on_subscription_success)
-        self.connection.bind('connected', self._on_pusher_connect)
+        EventEmitter.bind(self, 'pusher_internal:subscription_succeeded', self._on_subscription_success)
 
     def _on_subscription_success(self, event):
         """Handle pusher subscribe messages."""
@@ -119,17 +331,27 @@ class Channel(ChannelEventEmitter):
         event.name = 'pusher:subscription_succeeded'
         self.emit_event(event)
 
-    def _on_pusher_connect(self, _):
-        self.subscribe()
+    def subscription_event(self, auth=None):
+        """
+        Get the event subscribing to the channel.
+
+        :param auth: the ``auth`` and ``channel_data`` fields for a private or presence channel
+        :type auth: dict
+
+        :rtype: Event
+        """
+        data = {'channel': self.name}
+        if auth:
+            data.update((field, auth[field]) for field in ('auth', 'channel_data') if field in auth)
+        return Event(name='pusher:subscribe', data=data)
 
     def subscribe(self):
         """
         Subscribe to the Pusher channel.
 
-        Users should not call this. Use ``Pusher.subscribe()`` instead.
+        Users should not call this. Use ``Pusher.subscribe()`` instead, which also subscribes again on reconnect.
         """
-        event = Event(name='pusher:subscribe', data={'channel': self.name})
-        self.connection.send_event(event)
+        self.connection.send_event(self.subscription_event())
 
     def unsubscribe(self):
         """Unsubscribe from the Pusher channel."""
@@ -138,15 +360,100 @@ class Channel(ChannelEventEmitter):
 
 
 class PrivateChannel(Channel):
-    def __init__(self, channel_name, connection, **kwargs):
-        super(PrivateChannel, self).__init__(channel_name, connection, **kwargs)
-        raise NotImplementedError('Private channels are not supported')
+    """
+    Channel whose subscriptions are signed by the client's ``authorizer``, and on which client events can be
+    triggered. If the subscription is refused, ``pusher:subscription_error`` is emitted.
+    """
+    requires_auth = True
+
+    def trigger(self, event_name, data=None):
+        """
+        Send a client event to the other subscribers of the channel.
+
+        Pusher limits client events to 10 per second per connection, see the connection's ``send_rate``.
+
+        :param event_name: the event's name, starting with ``client-``
+        :type event_name: str or unicode
+        :param data: the event data, JSON serializable
+
+        :raises BadEventNameError: if the name doesn't start with ``client-``
+        :raises ConnectionError: if the connection isn't started
+        """
+        if not event_name.startswith('client-'):
+            raise BadEventNameError("Client event names must start with 'client-': '{0}'".format(event_name))
+        self.connection.send_event(Event(name=event_name, channel=self.name, data=data or {}))
 
 
-class PresenceChannel(Channel):
-    def __init__(self, channel_name, connection, **kwargs):
+class PresenceChannel(PrivateChannel):
+    """
+    Private channel tracking the users subscribed to it.
+
+    ``pusher:member_added`` and ``pusher:member_removed`` events are emitted as users join and leave, with the
+    member's ``user_id`` and ``user_info`` as data. Only changes are emitted: when subscribing again after a
+    reconnect, members that joined or left meanwhile get these events too, while ``pusher:subscription_succeeded``
+    carries the whole list.
+
+    :ivar members: ``user_info`` of each member, keyed by user ID
+    :type members: twistedpusher.presence.MemberStore
+    :ivar me: ``user_id`` and ``user_info`` this connection joined as, once subscribed
+    :type me: dict or None
+    """
+    def __init__(self, channel_name, connection, max_members=None, store_member_info=True, **kwargs):
+        """
+        :param max_members: most members stored, beyond it members are only counted, see MemberStore
+        :type max_members: int or None
+        :param store_member_info: whether to keep the members' ``user_info``, or only their IDs
+        :type store_member_info: bool
+        """
         super(PresenceChannel, self).__init__(channel_name, connection, **kwargs)
-        raise NotImplementedError('Presence channels are not supported')
+        self.members = MemberStore(max_members, store_member_info)
+        self.me = None
+        self._loaded = False
+        # the channel data of the last subscription, sent by the authorizer
+        self._channel_data = None
+        EventEmitter.bind(self, 'pusher_internal:member_added', self._on_member_added)
+        EventEmitter.bind(self, 'pusher_internal:member_removed', self._on_member_removed)
+
+    def subscription_event(self, auth=None):
+        if auth and 'channel_data' in auth:
+            self._channel_data = auth['channel_data']
+        return super(PresenceChannel, self).subscription_event(auth)
+
+    def _on_subscription_success(self, event):
+        presence = event.data.get('presence', {}) if isinstance(event.data, dict) else {}
+        added, removed = self.members.load(presence)
+        if self._channel_data:
+            try:
+                self.me = events.json_backend.loads(self._channel_data)
+            except ValueError:
+                log.warning("Could not read the channel data {0} joined with.".format(self.name))
+        super(PresenceChannel, self)._on_subscription_success(event)
+        if self._loaded:
+            # changes missed while resubscribing
+            for user_id in removed:
+                self._emit_member('pusher:member_removed', {'user_id': user_id})
+            for user_id, user_info in added.items():
+                self._emit_member('pusher:member_added', {'user_id': user_id, 'user_info': user_info})
+        self._loaded = True
+
+    def unsubscribe(self):
+        super(PresenceChannel, self).unsubscribe()
+        # a later subscription starts afresh rather than with changes from a stale list
+        self.members.clear()
+        self._loaded = False
+
+    def _emit_member(self, name, data):
+        self.emit_event(Event(name=name, channel=self.name, data=data))
+
+    def _on_member_added(self, event):
+        if self.members.add(event.data['user_id'], event.data.get('user_info')):
+            event.name = 'pusher:member_added'
+            self.emit_event(event)
+
+    def _on_member_removed(self, event):
+        if self.members.remove(event.data['user_id']):
+            event.name = 'pusher:member_removed'
+            self.emit_event(event)
 
 
 def buildChannel(channel_name, connection, **kwargs):
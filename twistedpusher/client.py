@@ -3,13 +3,18 @@
 import logging
 import warnings
 from twisted.application.service import MultiService
+from twisted.internet import defer
 from twisted.internet.endpoints import clientFromString
 from zope.interface import implementer
 
 from twistedpusher.connection import Connection
-from twistedpusher import channel, websocket
+from twistedpusher import channel
+from twistedpusher.dedup import DeduplicationWindow, event_fingerprint
 from twistedpusher.events import EventEmitter
 from twistedpusher.interfaces import IPusherClientService, IPusherClient
+from twistedpusher.outbound import CLIENT_EVENT_RATE
+from twistedpusher.registry import ChannelRegistry, SUBSCRIPTION_SUCCEEDED
+from twistedpusher.subscriptions import SubscriptionManager
 
 log = logging.getLogger(__name__)
 
@@ -21,51 +26,17 @@ log = logging.getLogger(__name__)
 VERSION = '1.3.1'
 
 
-@implementer(IPusherClientService)
-class PusherService(MultiService, EventEmitter):
+class PusherClientBase(EventEmitter):
+    """
+    Channel API of the Pusher clients, whichever event loop they run on.
+
+    Subclasses set up ``connection``, ``subscriptions`` (a SubscriptionManager), ``registry`` (a ChannelRegistry)
+    with its ``channels``, and ``reactor``, the ``IReactorTime`` provider given to channels.
+    """
     protocol_version = 7
     host = 'ws.pusherapp.com'
     client_name = 'twistedpusher'
 
-    def __init__(self, key, encrypted=True, endpoint_string=None, reactor=None, **kwargs):
-        """
-        Pusher client service. Start it with ``startService`` and stop it with ``stopService``.
-
-        :param key: key for the Pusher application to connect to
-        :type key: str
-
-        :param encrypted: whether to use secure websockets
-        :type encrypted: bool
-
-        :param endpoint_string: a string to build the endpoint with, using clientFromString
-        :type endpoint_string: str
-
-        :param reactor: optional Twisted reactor
-        """
-        # Must do it this way so both constructors execute.
-        # (Multi)Service constructor is not equipped for multiple inheritance.
-        MultiService.__init__(self)
-        EventEmitter.__init__(self)
-
-        self.key = key
-        self.encrypted = encrypted
-
-        if not reactor:
-            from twisted.internet import reactor
-
-        # todo add support for other factory classes
-        factory = websocket.PusherWebsocketFactory(
-            url=PusherService._build_url(key, encrypted),
-            useragent='{0}/{1}'.format(PusherService.client_name, VERSION),
-            **kwargs)
-        endpoint = self.__class__._build_endpoint(endpoint_string, encrypted, reactor=reactor)
-
-        self.connection = Connection(factory, endpoint, self._on_event, reactor=reactor)
-        self.addService(self.connection)
-
-        # List of subscribed channels
-        self.channels = dict()
-
     ####################
     ##### Channels #####
     ####################
@@ -85,12 +56,11 @@ class PusherService(MultiService, EventEmitter):
         :raises BadChannelNameError: if channel_name is not a valid Pusher channel name
         """
         if channel_name not in self.channels:
+            kwargs.setdefault('reactor', self.reactor)
             chan = channel.buildChannel(channel_name, self.connection, **kwargs)
-
-            # only subscribe if connected, it'll get automatically triggered on connect if we aren't
-            if self.connection.state == 'connected':
-                chan.subscribe()
-            self.channels[channel_name] = chan
+            # with json_data, data is decoded while loading events instead of a second time in the channel.
+            # The subscription is sent with the others of this reactor iteration, or on connect if not connected.
+            self.registry.add(chan, kwargs.get('json_data'))
         else:
             warnings.warn("Already subscribed to channel {0}".format(channel_name))
 
@@ -105,7 +75,7 @@ class PusherService(MultiService, EventEmitter):
         """
         if channel_name in self.channels:
             self.channels[channel_name].unsubscribe()
-            self.channels.pop(channel_name)
+            self.registry.remove(channel_name)
         else:
             warnings.warn("Attempted to unsubscribe from channel {0} when not subscribed".format(channel_name))
 
@@ -125,6 +95,55 @@ class PusherService(MultiService, EventEmitter):
         except KeyError:
             raise ValueError("Channel not found: '{0}'.".format(channel_name))
 
+    def subscribe_many(self, channel_names, **kwargs):
+        """
+        Subscribe to several channels, sending all the subscriptions in one write.
+
+        :param channel_names: the channels' names
+        :type channel_names: list
+
+        :param kwargs: passed to ``subscribe`` for every channel
+
+        :returns: Deferred firing with the list of channels once all are subscribed, or failing with the first
+            :class:`~twistedpusher.errors.SubscriptionTimeoutError`
+        :rtype: defer.Deferred
+        """
+        for channel_name in channel_names:
+            self.subscribe(channel_name, **kwargs)
+        d = defer.gatherResults([self._when_subscribed(channel_name) for channel_name in channel_names],
+                                consumeErrors=True).addErrback(lambda failure: failure.value.subFailure)
+        return self._result(d)
+
+    def when_subscribed(self, channel_name):
+        """
+        Get a Deferred firing with a channel once Pusher acknowledged its subscription.
+
+        :type channel_name: str or unicode
+        :rtype: defer.Deferred
+
+        :raises ValueError: if the channel is not found (i.e. subscribed to)
+        """
+        return self._result(self._when_subscribed(channel_name))
+
+    def _when_subscribed(self, channel_name):
+        try:
+            return self.subscriptions.when_subscribed(channel_name)
+        except KeyError:
+            raise ValueError("Channel not found: '{0}'.".format(channel_name))
+
+    def _result(self, d):
+        """Return a Deferred of the channel API as the event loop's kind of asynchronous result."""
+        return d
+
+    def latency_stats(self):
+        """
+        Get the latency histograms of every subscribed channel, see ``Channel.latency_stats``.
+
+        :returns: each channel's latency summaries, keyed by channel name
+        :rtype: dict
+        """
+        return dict((name, chan.latency_stats()) for name, chan in self.channels.items())
+
     ####################
     ##### Handlers #####
     ####################
@@ -133,13 +152,8 @@ class PusherService(MultiService, EventEmitter):
         """
         :type event: events.Event
         """
-        try:
-            chan = self.channels[event['channel']]
-        except (KeyError, AttributeError) as e:
-            # not subscribed to the channel, or this isn't a channel event.
-            pass
-        else:
-            chan.emit_event(event)
+        # None if not subscribed to the channel, or this isn't a channel event
+        if self.registry.dispatch(event) is not None:
             self.emit_event(event)
 
     #####################
@@ -170,6 +184,227 @@ class PusherService(MultiService, EventEmitter):
             443 if encrypted else 80,
             path)
 
+
+@implementer(IPusherClientService)
+class PusherService(MultiService, PusherClientBase):
+    def __init__(self, key, encrypted=True, endpoint_string=None, reactor=None, subscription_timeout=10,
+                 subscription_retries=2, backoff=None, migrate=False, migration_timeout=30, handover_period=5,
+                 metrics=None, send_rate=CLIENT_EVENT_RATE, send_burst=CLIENT_EVENT_RATE, max_buffered=1000,
+                 authorizer=None, **kwargs):
+        """
+        Pusher client service. Start it with ``startService`` and stop it with ``stopService``.
+
+        :param key: key for the Pusher application to connect to
+        :type key: str
+
+        :param encrypted: whether to use secure websockets
+        :type encrypted: bool
+
+        :param endpoint_string: a string to build the endpoint with, using clientFromString
+        :type endpoint_string: str
+
+        :param reactor: optional Twisted reactor
+
+        :param subscription_timeout: seconds to wait for Pusher to acknowledge a subscription before trying again
+        :type subscription_timeout: int or float
+
+        :param subscription_retries: times to try a subscription again before failing it until the next reconnect
+        :type subscription_retries: int
+
+        :param backoff: optional policy for the delays between connection attempts
+        :type backoff: twistedpusher.transport.BackoffPolicy
+
+        :param migrate: make before break: when Pusher asks to reconnect or a pong is missed, open a new connection
+            and subscribe every channel on it before closing the old one
+        :type migrate: bool
+
+        :param migration_timeout: seconds to wait for the new connection to be subscribed before giving up on it
+        :type migration_timeout: int or float
+
+        :param handover_period: seconds events are checked for duplicates after switching to the new connection
+        :type handover_period: int or float
+
+        :param metrics: optional metrics to update, e.g. to serve with a ``twistedpusher.metrics.MetricsResource``
+        :type metrics: twistedpusher.metrics.PusherMetrics
+
+        :param send_rate: client events sent per second, or None not to limit them. Pusher allows 10.
+        :type send_rate: int or float
+
+        :param send_burst: client events that can be sent at once after being idle
+        :type send_burst: int
+
+        :param max_buffered: most client events kept to send while reconnecting, the oldest are dropped beyond it
+        :type max_buffered: int
+
+        :param authorizer: signs subscriptions to private and presence channels, e.g. a
+            :class:`twistedpusher.auth.HTTPAuthorizer` for the application's authentication endpoint
+        :type authorizer: twistedpusher.interfaces.IChannelAuthorizer
+        """
+        # Must do it this way so both constructors execute.
+        # (Multi)Service constructor is not equipped for multiple inheritance.
+        MultiService.__init__(self)
+        PusherClientBase.__init__(self)
+
+        self.key = key
+        self.encrypted = encrypted
+
+        if not reactor:
+            from twisted.internet import reactor
+        self.reactor = reactor
+
+        # autobahn runs on a single framework per process, importing it here leaves asyncio to twistedpusher.aio
+        from twistedpusher import websocket
+
+        # todo add support for other factory classes
+        factory = websocket.PusherWebsocketFactory(
+            url=PusherService._build_url(key, encrypted),
+            useragent='{0}/{1}'.format(PusherService.client_name, VERSION),
+            **kwargs)
+        endpoint = self.__class__._build_endpoint(endpoint_string, encrypted, reactor=reactor)
+        self.factory = factory
+        self.metrics = factory.metrics = metrics
+
+        # settings of the connections made, the first and those migrated to
+        self._connection_kwargs = {'metrics': metrics,
+                                   'send_rate': send_rate,
+                                   'send_burst': send_burst,
+                                   'max_buffered': max_buffered}
+        self.connection = Connection(factory, endpoint, self._on_event, reactor=reactor, backoff=backoff,
+                                     make_before_break=migrate, **self._connection_kwargs)
+        self.addService(self.connection)
+        self.subscriptions = SubscriptionManager(self.connection, subscription_timeout, subscription_retries, reactor,
+                                                 authorizer)
+        # client events wait for their channel to be subscribed again after a reconnect
+        self.connection.outbound.subscriptions = self.subscriptions
+
+        self.migration_timeout = migration_timeout
+        self.handover_period = handover_period
+        # number of completed migrations, and how long the last one took in seconds
+        self.migrations = 0
+        self.last_migration_duration = None
+        # state of the migration in progress, if any
+        self._migration = None
+        # recognizes events delivered by both connections around a migration
+        self._handover = None
+        self._handover_end = None
+        if migrate:
+            self.connection.bind('reconnect_requested', self._migrate)
+
+        self.registry = ChannelRegistry(self.subscriptions, factory.json_data_channels)
+        # Subscribed channels, owned by the registry
+        self.channels = self.registry.channels
+        # frames for channels we aren't subscribed to are dropped by the protocol before they are parsed
+        factory.channel_filter = self.channels
+
+    #####################
+    ##### Migration #####
+    #####################
+
+    def _migrate(self, event):
+        """
+        Replace the connection with a new one once every channel is subscribed on it.
+
+        :param event: the connection's ``reconnect_requested`` event
+        """
+        if self._migration is not None or not self.running:
+            return
+        log.info("Migrating to a new Pusher connection ({0}).".format(event.reason))
+        old = self.connection
+        new = Connection(self.factory, old.transport.endpoint, lambda e: self._on_handover_event(e, 1),
+                         reactor=self.reactor, backoff=old.transport.backoff.copy(), make_before_break=True,
+                         **self._connection_kwargs)
+        subscriptions = SubscriptionManager(new, self.subscriptions.timeout, self.subscriptions.retries, self.reactor,
+                                            self.subscriptions.authorizer)
+        new.outbound.subscriptions = subscriptions
+        for chan in self.channels.values():
+            subscriptions.add(chan)
+
+        connected = defer.Deferred()
+        new.bind('connected', lambda _: not connected.called and connected.callback(None))
+        connected.addCallback(lambda _: defer.gatherResults(
+            [subscriptions.when_subscribed(name) for name in self.channels], consumeErrors=True))
+        connected.addCallbacks(self._complete_migration, self._abort_migration)
+
+        self._migration = {'connection': new,
+                           'subscriptions': subscriptions,
+                           'reason': event.reason,
+                           'started': self.reactor.seconds(),
+                           'deferred': connected,
+                           'timeout': self.reactor.callLater(self.migration_timeout, connected.cancel)}
+        self._start_handover()
+        old.on_channel_event = lambda e: self._on_handover_event(e, 0)
+        # Pusher closes the socket after a 4200-class error, connecting is left to the migration
+        old.transport.auto_reconnect = False
+        self.addService(new)
+
+    def stopService(self):
+        if self._migration is not None:
+            self._migration['deferred'].cancel()
+        if self._handover_end is not None and self._handover_end.active():
+            self._handover_end.cancel()
+            self._end_handover()
+        return MultiService.stopService(self)
+
+    def _complete_migration(self, _):
+        migration, self._migration = self._migration, None
+        if migration['timeout'].active():
+            migration['timeout'].cancel()
+        old, new = self.connection, migration['connection']
+
+        self.connection = new
+        self.subscriptions = self.registry.subscriptions = migration['subscriptions']
+        for chan in self.channels.values():
+            chan.connection = new
+        new.bind('reconnect_requested', self._migrate)
+        self.removeService(old)
+
+        self.migrations += 1
+        self.last_migration_duration = self.reactor.seconds() - migration['started']
+        log.info("Migrated to a new Pusher connection in {0:.3f}s.".format(self.last_migration_duration))
+        self._handover_end = self.reactor.callLater(self.handover_period, self._end_handover)
+
+    def _abort_migration(self, failure):
+        migration, self._migration = self._migration, None
+        if migration['timeout'].active():
+            migration['timeout'].cancel()
+        log.warning("Migrating to a new Pusher connection failed: {0}".format(failure.getErrorMessage()))
+        self.removeService(migration['connection'])
+        self._end_handover()
+        transport = self.connection.transport
+        transport.resume_reconnecting()
+        if migration['reason'] == 'pong_timeout' and self.running and transport.state == 'connected':
+            # the old connection was left as it was for the migration
+            transport.reconnect()
+
+    def _start_handover(self):
+        if self._handover_end is not None and self._handover_end.active():
+            self._handover_end.cancel()
+        self._handover_end = None
+        self._handover = DeduplicationWindow(2)
+
+    def _end_handover(self):
+        """Stop checking events for duplicates, the connection in use is the only one left."""
+        self._handover_end = None
+        self._handover = None
+        self.connection.on_channel_event = self._on_event
+
+    def _on_handover_event(self, event, index):
+        """
+        Handle channel events while two connections may deliver them.
+
+        :param index: 0 for the connection in use when the migration started, 1 for the new one
+        """
+        migration = self._migration
+        if migration is not None and index == 1 and event.name == SUBSCRIPTION_SUCCEEDED:
+            # the channels were subscribed all along, only the new connection's subscriptions are acknowledged
+            migration['subscriptions'].acknowledge(event.channel)
+        elif self._handover is None or self._handover.is_new(event_fingerprint(event), index):
+            self._on_event(event)
+
+    #####################
+    ##### Utilities #####
+    #####################
+
     @classmethod
     def _build_endpoint(cls, endpoint_string=None, encrypted=True, timeout=5, host=None, reactor=None):
         if not reactor:
@@ -2,66 +2,34 @@
 # -*- test-case-name: twistedpusher.test.test_connection -*-
 
 import logging
-import warnings
 
 from twisted.application import service
 from zope.interface import implementer
 
+from twistedpusher.core import ConnectionCore, CONNECTION_STATES, ERROR_CODES, TIME_BEFORE_UNAVAILABLE_STATE
 from twistedpusher.events import Event, EventEmitter
 from twistedpusher.utils import Timeout
 from twistedpusher.interfaces import IPusherConnection
 from twistedpusher.errors import ConnectionError
+from twistedpusher.outbound import SendQueue, CLIENT_EVENT_RATE
 from twistedpusher.transport import Transport
 
 log = logging.getLogger(__name__)
 
 
-### Constants ###
-
-# pusher connection events
-CONNECTION_ESTABLISHED = 'pusher:connection_established'
-PING = 'pusher:ping'
-PONG = 'pusher:pong'
-ERROR = 'pusher:error'
-
-# missing 'failed' intentionally
-CONNECTION_STATES = set(['initialized', 'connecting', 'connected', 'unavailable', 'disconnected'])
 # not used, just for documentation
-EMITTED_EVENTS = set(['error', 'connecting_in', 'state_change']).union(CONNECTION_STATES)
-
-# complete list of possible error codes
-ERROR_CODES = {
-    4000: 'application only accepts SSL connections',
-    4001: 'application does not exist',
-    4003: 'application disabled',
-    4004: 'application is over connection quota',
-    4005: 'path not found',
-    4006: 'invalid version string format',
-    4007: 'unsupported protocol version',
-    4008: 'no protocol version supplied',
-
-    4100: 'over capacity',
-
-    4200: 'generic reconnect signal',
-    4201: 'ping/pong reply not received by server',
-    4202: 'connection closed after inactivity',
-
-    4301: 'client event rejected due to rate limit'
-}
-
-# how long to attempt to connect before setting state to 'unavailable'
-TIME_BEFORE_UNAVAILABLE_STATE = 30
-
-### End constants ###
-
-
-# todo make these state machines nicer?
-# maybe something from here https://stackoverflow.com/questions/2101961/python-state-machine-design
+EMITTED_EVENTS = set(['error', 'connecting_in', 'state_change', 'reconnect_requested']).union(CONNECTION_STATES)
 
 
 @implementer(IPusherConnection)
 class Connection(EventEmitter, service.MultiService):
     """
+    Twisted adapter of a :class:`~twistedpusher.core.ConnectionCore`: feeds it the transport's events, the events
+    received and the reactor's time, sends what it queues and carries out its actions.
+
+    :ivar core: the protocol state machine
+    :type core: twistedpusher.core.ConnectionCore
+
     :ivar state: current connection state, all possibilities enumerated in ``CONNECTION_STATES``
     :type state: str
     :ivar socket_id: Pusher socket ID of currently established connection
@@ -81,22 +49,33 @@ class Connection(EventEmitter, service.MultiService):
     disconnected    on intentionally disconnecting
     ==============  =======================================
 
-    ==============  =======================================
+    ===================  =======================================
     Emits the following events:
-    -------------------------------------------------------
-    Event               Explanation
-    ==============  =======================================
-    States          Listed above. They have an attribute 'previous' with the previous state
-    state_change    duplicate of the states, with attributes 'current' and 'previous'.
-    connecting_in   if attempting to connect, how long the delay is until next attempt. Has attribute 'delay'.
-    error           Pusher errors, data includes fields 'code' and maybe 'message'.
-    ==============  =======================================
+    ------------------------------------------------------------
+    Event                Explanation
+    ===================  =======================================
+    States               Listed above. They have an attribute 'previous' with the previous state
+    state_change         duplicate of the states, with attributes 'current' and 'previous'.
+    connecting_in        if attempting to connect, how long the delay is until next attempt. Has attribute 'delay'.
+    error                Pusher errors, data includes fields 'code' and maybe 'message'.
+    reconnect_requested  a 4200-class Pusher error or a missed pong calls for a new connection. Has attribute
+                         'reason', the error code or 'pong_timeout'.
+    ===================  =======================================
     """
-    def __init__(self, factory, endpoint, on_channel_event, reactor=None, **kwargs):
+    def __init__(self, factory, endpoint, on_channel_event, reactor=None, backoff=None, make_before_break=False,
+                 metrics=None, send_rate=CLIENT_EVENT_RATE, send_burst=CLIENT_EVENT_RATE, max_buffered=1000,
+                 **kwargs):
         """
         :param clock:
         :param transport: ``IPusherTransport`` provider
         :param on_channel_event: callback to send channel events
+        :param backoff: optional ``twistedpusher.transport.BackoffPolicy`` for reconnecting
+        :param make_before_break: leave reconnecting after a missed pong to the ``reconnect_requested`` listener,
+            which replaces the connection once a new one is ready
+        :param metrics: optional ``twistedpusher.metrics.PusherMetrics`` to count Pusher errors and connections with
+        :param send_rate: client events sent per second, or None not to limit them
+        :param send_burst: client events that can be sent at once after being idle
+        :param max_buffered: most client events kept while reconnecting, see ``twistedpusher.outbound.SendQueue``
 
         """
         EventEmitter.__init__(self)
@@ -105,41 +84,23 @@ class Connection(EventEmitter, service.MultiService):
         assert callable(on_channel_event)
 
         self.on_channel_event = on_channel_event
+        self.metrics = metrics
 
         if not reactor:
             from twisted.internet import reactor
 
-        self.transport = Transport(factory, endpoint, self._on_event, reactor)
+        self.transport = Transport(factory, endpoint, self._on_event, reactor, backoff, metrics)
         self.transport.bind_all(self._on_transport_event)
         self.addService(self.transport)
 
-        # socket_id is returned by Pusher on connection
-        self.socket_id = ''
-
-        # Sends a ping if the connection has been dead for a while.
-        def keepalive():
-            self.pong_timeout.start()
-            self.send_event(Event(name='pusher:ping'))
-        self.activity_timeout = Timeout(120,
-                                        keepalive,
-                                        reactor=reactor)
-
-        # Started if we sent a ping and expect a pong.
-        self.pong_timeout = Timeout(30,
-                                    self.transport.reconnect,
-                                    reactor=reactor)
-
-        def go_unavailable():
-            self.state = 'unavailable'
-        # Changes the state to unavailable if we're having trouble connecting.
-        self.unavailable_timeout = Timeout(TIME_BEFORE_UNAVAILABLE_STATE,
-                                           go_unavailable,
-                                           start_now=False, reactor=reactor)
-
-        self.handlers = {CONNECTION_ESTABLISHED: self._connected,
-                         ERROR: self._error,
-                         PING: self._ping,
-                         PONG: self._pong}
+        # frames go out through here, rate limited and buffered while reconnecting
+        self.outbound = SendQueue(self, self.transport, send_rate, send_burst, max_buffered, reactor=reactor)
+
+        self.reactor = reactor
+        self.core = ConnectionCore(unavailable_after=TIME_BEFORE_UNAVAILABLE_STATE,
+                                   make_before_break=make_before_break, metrics=metrics)
+        # fires at the core's next deadline
+        self.wakeup = Timeout(0, self._tick, reactor=reactor)
 
         # Publicly accessible state info (changes also accessed via bind)
         self._state = 'initialized'
@@ -151,16 +112,29 @@ class Connection(EventEmitter, service.MultiService):
 
     def send_event(self, event):
         """
+        Send an event now if possible, otherwise once the rate limit or the connection allows.
+
         :param event: the event to send
         :type event: Event
 
-        :raises ConnectionError: if attempting to send an event while not connected.
+        :raises ConnectionError: if attempting to send an event before the connection is started or after it
+            was stopped.
         """
-        if self.state == 'connected':
-            return self.transport.send_event(event)
-        else:
+        try:
+            self.outbound.send([event], batch=False)
+        except ConnectionError:
             raise ConnectionError("Attempted to send an event while disconnected: {0}".format(event))
 
+    def send_events(self, events):
+        """
+        :param events: the events to send, in one write if possible
+        :type events: list
+
+        :raises ConnectionError: if attempting to send events before the connection is started or after it
+            was stopped.
+        """
+        self.outbound.send(events)
+
     ############################
     ##### Connection State #####
     ############################
@@ -180,104 +154,59 @@ class Connection(EventEmitter, service.MultiService):
             self.emit_event(Event(name=new_state, previous=self.prev_state))
             self.emit_event(Event(name='state_change', current=new_state, previous=self.prev_state))
 
+    @property
+    def socket_id(self):
+        """Pusher socket ID of the established connection, returned by Pusher on connection."""
+        return self.core.socket_id
+
     def _on_transport_event(self, event):
+        now = self.reactor.seconds()
         if event.name == 'started_connecting':
-            self.state = 'connecting'
-            self.unavailable_timeout.start()
+            self.core.connecting(now)
         elif event.name == 'connected':
-            self.activity_timeout.start()
+            self.core.opened(now)
         elif event.name == 'disconnected':
-            if self.activity_timeout.active:
-                self.activity_timeout.stop()
-            if self.pong_timeout.active:
-                self.pong_timeout.stop()
-
-            if self.running:
-                self.state = 'connecting'
-            else:
-                self.state = 'disconnected'
+            self.core.closed(now, reconnecting=self.running)
         elif event.name == 'connecting_in':
             self.emit_event(event)
+            return
         else:  # pragma: no cover
             log.critical("Unrecognized transport event '{}'".format(event.name))
             assert False
+        self._process()
 
     def _on_event(self, event):
         """Called whenever an event is received from Pusher."""
-        if hasattr(event, 'channel'):
+        if self.core.handle(event, self.reactor.seconds()) is not None:
             self.on_channel_event(event)
-        elif event.name in self.handlers:
-            self.handlers[event.name](event)
-        else:  # pragma: no cover
-            log.warning("Unrecognized Pusher event '{}'".format(event.name))
-        self.activity_timeout.reset()
-
-    def _connected(self, event):
-        """
-        Handle pusher:connection_established events.
-
-        :type event: Event
-        """
-        self.unavailable_timeout.stop()
-        self.socket_id = str(event.data['socket_id'])
-        try:
-            activity_timeout = int(event.data['activity_timeout'])
-        except KeyError:  # pragma: no cover
-            log.warning("Error reading activity timeout after establishing connection with Pusher...",
-                        exc_info=True)
         else:
-            self.activity_timeout.reset(activity_timeout)
-        finally:
-            log.info("Pusher connection socket_id is {0}.".format(self.socket_id))
-            self.state = 'connected'
-
-    def _error(self, event):
-        """
-        Handle pusher:error events.
-
-        :type event: Event
-        """
-
-        event.name = 'error'
-        self.emit_event(event)
-
-        try:
-            if event.data['code']:
-                err = int(event.data['code'])
-                err_str = "Pusher error {0}: ".format(err)
-
-                try:
-                    err_str += ERROR_CODES[err]
-                except KeyError:
-                    log.warning(err_str + event.data['message'])
-                else:
-                    err_str += '.'
-                    log.warning(err_str)
-
-                if (err >= 4000) and (err < 4100):
-                    # Indicates an error resulting in the connection being closed by Pusher,
-                    # and that attempting to reconnect using the same parameters will not succeed.
-                    warnings.warn("It is impossible to connect to Pusher with the current connection parameters.")
-                    self.stopService()
-                #elif (err >= 4100) and (err < 4200):
-                    # Indicates an error resulting in the connection being closed by Pusher,
-                    # and that the client may reconnect after 1s or more.
-
-                    # these two cases don't need special treatment since the transport will automatically reconnect
-                #    pass
-                #elif (err >= 4200) and (err < 4300):
-                    # Indicates an error resulting in the connection being closed by Pusher,
-                    # and that the client may reconnect immediately.
-                #    pass
-        except KeyError:
-            log.warning("Problem processing pusher error: {0}".format(event.data), exc_info=True)
-
-    def _ping(self, _):
-        """Handle received pusher:ping events."""
-        log.debug("An unexpected pusher:ping event was received from the Pusher server.")
-        self.send_event(Event(name='pusher:pong'))
-
-    def _pong(self, _):
-        """Handle received pusher:pong events."""
-        self.pong_timeout.stop()
-        self.activity_timeout.start()
\ No newline at end of file
+            self._process()
+
+    def _tick(self):
+        self.core.tick(self.reactor.seconds())
+        self._process()
+
+    def _process(self):
+        """Send what the core queued, carry out its actions, and wake up at its next deadline."""
+        core = self.core
+        while core.outgoing:
+            self.send_event(core.outgoing.popleft())
+        # listeners may feed the core again, taking its later actions in order
+        while core.actions:
+            action = core.actions.popleft()
+            if action.name == 'state_change':
+                self.state = action.current
+            elif action.name in ('error', 'reconnect_requested'):
+                self.emit_event(action)
+            elif action.name == 'fast_retry':
+                self.transport.backoff.fast_retry()
+            elif action.name == 'reconnect':
+                self.transport.reconnect()
+            elif action.name == 'stop':
+                self.stopService()
+
+        deadline = core.next_deadline()
+        if deadline is not None:
+            self.wakeup.start_at(deadline)
+        elif self.wakeup.active:
+            self.wakeup.stop()
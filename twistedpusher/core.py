@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+# -*- test-case-name: twistedpusher.test.test_core -*-
+
+import logging
+import warnings
+from collections import deque
+
+from twistedpusher.events import Event, load_pusher_event, peek_channel, scan_pusher_envelope, serialize_pusher_event
+from twistedpusher.utils import monotonic_ns
+
+log = logging.getLogger(__name__)
+
+
+### Constants ###
+
+# pusher connection events
+CONNECTION_ESTABLISHED = 'pusher:connection_established'
+PING = 'pusher:ping'
+PONG = 'pusher:pong'
+ERROR = 'pusher:error'
+
+# missing 'failed' intentionally
+CONNECTION_STATES = set(['initialized', 'connecting', 'connected', 'unavailable', 'disconnected'])
+
+# complete list of possible error codes
+ERROR_CODES = {
+    4000: 'application only accepts SSL connections',
+    4001: 'application does not exist',
+    4003: 'application disabled',
+    4004: 'application is over connection quota',
+    4005: 'path not found',
+    4006: 'invalid version string format',
+    4007: 'unsupported protocol version',
+    4008: 'no protocol version supplied',
+
+    4100: 'over capacity',
+
+    4200: 'generic reconnect signal',
+    4201: 'ping/pong reply not received by server',
+    4202: 'connection closed after inactivity',
+
+    4301: 'client event rejected due to rate limit'
+}
+
+# how long to attempt to connect before setting state to 'unavailable'
+TIME_BEFORE_UNAVAILABLE_STATE = 30
+# seconds without receiving anything before pinging, until Pusher sends its own value
+ACTIVITY_TIMEOUT = 120
+# seconds to wait for the pong before giving up on the connection
+PONG_TIMEOUT = 30
+
+### End constants ###
+
+
+def decode_frame(payload, received=None, json_data_channels=None, channel_filter=None, metrics=None):
+    """
+    Load the Pusher event of a websocket text frame.
+
+    With a channel filter, the channel name is first looked up with string searches. Frames for channels in the
+    filter are loaded straight away, the others have their envelope scanned to confirm the channel before being
+    dropped without being fully parsed.
+
+    :param payload: the frame's payload
+    :type payload: str or bytes
+    :param received: when the frame was received, in ``monotonic_ns`` nanoseconds, by default now
+    :param json_data_channels: names of channels whose client event data is decoded as JSON
+    :type json_data_channels: set
+    :param channel_filter: if set, channel events for channels not in this container are dropped
+    :param metrics: optional ``twistedpusher.metrics.PusherMetrics`` to count the frame with
+
+    :returns: the event, stamped with when its frame was received and loaded, or None if it was filtered out
+    :rtype: Event or None
+
+    :raises ValueError: if the payload is not a Pusher event
+    """
+    if received is None:
+        received = monotonic_ns()
+    if channel_filter is not None:
+        channel = peek_channel(payload)
+        if channel is None or channel not in channel_filter:
+            envelope = scan_pusher_envelope(payload)
+            if envelope and envelope[1] is not None and envelope[1] not in channel_filter:
+                if metrics is not None:
+                    metrics.frame_received(len(payload))
+                    metrics.frames_dropped.inc()
+                return None
+    # loading checks the event's channel against the container
+    json_data = json_data_channels or False
+    try:
+        event = load_pusher_event(payload, json_data)
+    except ValueError:
+        if metrics is not None:
+            metrics.frame_received(len(payload))
+            metrics.parse_errors.inc()
+        raise
+    event.stamp(received, monotonic_ns())
+    if metrics is not None:
+        metrics.frame_received(len(payload), event.get('channel'))
+    return event
+
+
+class ConnectionCore(object):
+    """
+    The Pusher connection protocol without any I/O: the connection state machine, keepalive pings, and the
+    handling of Pusher's connection events and error codes.
+
+    It is told what happened, with the time it happened in seconds of whichever clock the caller uses, and says
+    what to do through two queues for the caller to drain in order:
+
+    - ``outgoing``, the Pusher events to send, see also :meth:`frames_to_send`
+    - ``actions``, the events listed below
+
+    Channel events are returned by :meth:`receive` and :meth:`handle` instead of being queued, as they are most of
+    the traffic and only cost an attribute store here. Timers are deadlines: call :meth:`tick` once
+    :meth:`next_deadline` has come. Receiving only pushes the activity deadline later, so a caller can let its
+    timer fire at the earlier deadline and schedule the next one then.
+
+    ===================  =======================================
+    Actions:
+    ------------------------------------------------------------
+    Action               Meaning
+    ===================  =======================================
+    state_change         the state changed, has attributes 'current' and 'previous'
+    error                a Pusher error was received, data includes fields 'code' and maybe 'message'
+    fast_retry           the next connection attempt shouldn't back off
+    reconnect_requested  a new connection is needed, has attribute 'reason', the error code or 'pong_timeout'
+    reconnect            close the socket and connect again
+    stop                 close the socket for good, the connection parameters are refused. Has attribute 'code'.
+    ===================  =======================================
+
+    :ivar state: current connection state, one of ``CONNECTION_STATES``
+    :type state: str
+    :ivar socket_id: Pusher socket ID of the established connection
+    :type socket_id: str
+    :ivar pong_deadline: when to give up waiting for a pong, or None
+    :ivar unavailable_deadline: when to become unavailable if still not connected, or None
+    :ivar dropped_frames: number of frames given to :meth:`receive` and dropped by ``channel_filter``
+    :type dropped_frames: int
+    """
+    def __init__(self, activity_timeout=ACTIVITY_TIMEOUT, pong_timeout=PONG_TIMEOUT,
+                 unavailable_after=TIME_BEFORE_UNAVAILABLE_STATE, make_before_break=False, metrics=None,
+                 json_data_channels=None, channel_filter=None):
+        """
+        :param activity_timeout: seconds without receiving anything before pinging, replaced by Pusher's value
+        :param pong_timeout: seconds to wait for the pong
+        :param unavailable_after: seconds of trying to connect before becoming unavailable
+        :param make_before_break: leave replacing the connection after a missed pong to whoever handles
+            ``reconnect_requested``, instead of asking to ``reconnect``
+        :type make_before_break: bool
+        :param metrics: optional ``twistedpusher.metrics.PusherMetrics`` to count frames and Pusher errors with
+        :param json_data_channels: for :meth:`receive`, see :func:`decode_frame`
+        :param channel_filter: for :meth:`receive`, see :func:`decode_frame`
+        """
+        self.activity_timeout = activity_timeout
+        self.pong_timeout = pong_timeout
+        self.unavailable_after = unavailable_after
+        self.make_before_break = make_before_break
+        self.metrics = metrics
+        self.json_data_channels = json_data_channels
+        self.channel_filter = channel_filter
+
+        self.state = 'initialized'
+        self.prev_state = self.state
+        self.socket_id = ''
+        self.dropped_frames = 0
+
+        self.outgoing = deque()
+        self.actions = deque()
+
+        # when something was last received, None while the activity timer isn't running
+        self._last_activity = None
+        self.pong_deadline = None
+        self.unavailable_deadline = None
+
+        self._handlers = {CONNECTION_ESTABLISHED: self._connected,
+                          ERROR: self._error,
+                          PING: self._ping,
+                          PONG: self._pong}
+
+    ##################
+    ##### Inputs #####
+    ##################
+
+    def connecting(self, now):
+        """The transport started trying to connect."""
+        self._set_state('connecting')
+        if self.unavailable_deadline is None:
+            self.unavailable_deadline = now + self.unavailable_after
+
+    def opened(self, now):
+        """The socket is open, Pusher will send ``connection_established``."""
+        if self._last_activity is None:
+            self._last_activity = now
+
+    def closed(self, now, reconnecting=True):
+        """
+        The socket was closed.
+
+        :param reconnecting: whether another connection will be attempted
+        :type reconnecting: bool
+        """
+        self._last_activity = None
+        self.pong_deadline = None
+        self._set_state('connecting' if reconnecting else 'disconnected')
+
+    def receive(self, payload, now, received=None):
+        """
+        Handle a websocket text frame.
+
+        :param payload: the frame's payload
+        :param now: the current time
+        :param received: when the frame was received, in ``monotonic_ns`` nanoseconds, by default now
+
+        :returns: the event if it is a channel event, for the caller to dispatch
+        :rtype: Event or None
+
+        :raises ValueError: if the payload is not a Pusher event
+        """
+        event = decode_frame(payload, received, self.json_data_channels, self.channel_filter, self.metrics)
+        if event is None:
+            self.dropped_frames += 1
+            return None
+        return self.handle(event, now)
+
+    def handle(self, event, now):
+        """
+        Handle a Pusher event loaded by the caller.
+
+        :type event: Event
+        :param now: the current time
+
+        :returns: the event if it is a channel event, for the caller to dispatch
+        :rtype: Event or None
+        """
+        if self._last_activity is not None:
+            self._last_activity = now
+        # the channel is a slot of Event, missing unless set
+        if hasattr(event, 'channel'):
+            return event
+        handler = self._handlers.get(event.name)
+        if handler is not None:
+            handler(event, now)
+        else:  # pragma: no cover
+            log.warning("Unrecognized Pusher event '{}'".format(event.name))
+        return None
+
+    def tick(self, now):
+        """Act on the deadlines that have come."""
+        if self.unavailable_deadline is not None and now >= self.unavailable_deadline:
+            self.unavailable_deadline = None
+            self._set_state('unavailable')
+        activity_deadline = self.activity_deadline
+        if activity_deadline is not None and now >= activity_deadline:
+            # ping, the connection may be dead
+            self._last_activity = None
+            self.pong_deadline = now + self.pong_timeout
+            self.outgoing.append(Event(name=PING))
+        if self.pong_deadline is not None and now >= self.pong_deadline:
+            self.pong_deadline = None
+            self._request_reconnect('pong_timeout')
+
+    ###################
+    ##### Outputs #####
+    ###################
+
+    @property
+    def activity_deadline(self):
+        """When to ping if nothing is received until then, or None."""
+        if self._last_activity is None:
+            return None
+        return self._last_activity + self.activity_timeout
+
+    def next_deadline(self):
+        """
+        Get when :meth:`tick` should be called next.
+
+        :returns: the earliest deadline, or None if there is none
+        :rtype: float or None
+        """
+        deadlines = [deadline for deadline in (self.unavailable_deadline, self.activity_deadline,
+                                               self.pong_deadline) if deadline is not None]
+        return min(deadlines) if deadlines else None
+
+    def frames_to_send(self):
+        """
+        Take the outgoing events as websocket text frame payloads.
+
+        :rtype: list
+        """
+        frames = [serialize_pusher_event(event) for event in self.outgoing]
+        self.outgoing.clear()
+        return frames
+
+    ####################
+    ##### Handlers #####
+    ####################
+
+    def _set_state(self, new_state):
+        assert new_state in CONNECTION_STATES
+        if new_state != self.state:
+            self.prev_state = self.state
+            self.state = new_state
+            self.actions.append(Event(name='state_change', current=new_state, previous=self.prev_state))
+
+    def _connected(self, event, now):
+        """Handle pusher:connection_established events."""
+        self.unavailable_deadline = None
+        self.socket_id = str(event.data['socket_id'])
+        try:
+            activity_timeout = int(event.data['activity_timeout'])
+        except KeyError:  # pragma: no cover
+            log.warning("Error reading activity timeout after establishing connection with Pusher...",
+                        exc_info=True)
+        else:
+            self.activity_timeout = activity_timeout
+        finally:
+            log.info("Pusher connection socket_id is {0}.".format(self.socket_id))
+            self._set_state('connected')
+
+    def _error(self, event, now):
+        """Handle pusher:error events."""
+        event.name = 'error'
+        self.actions.append(event)
+
+        try:
+            if event.data['code']:
+                err = int(event.data['code'])
+                if self.metrics is not None:
+                    self.metrics.errors.inc(1, (err,))
+                err_str = "Pusher error {0}: ".format(err)
+
+                try:
+                    err_str += ERROR_CODES[err]
+                except KeyError:
+                    log.warning(err_str + event.data['message'])
+                else:
+                    err_str += '.'
+                    log.warning(err_str)
+
+                if (err >= 4000) and (err < 4100):
+                    # Indicates an error resulting in the connection being closed by Pusher,
+                    # and that attempting to reconnect using the same parameters will not succeed.
+                    warnings.warn("It is impossible to connect to Pusher with the current connection parameters.")
+                    self.actions.append(Event(name='stop', code=err))
+                #elif (err >= 4100) and (err < 4200):
+                    # Indicates an error resulting in the connection being closed by Pusher,
+                    # and that the client may reconnect after 1s or more.
+
+                    # doesn't need special treatment since the transport will automatically reconnect
+                #    pass
+                elif (err >= 4200) and (err < 4300):
+                    # Indicates an error resulting in the connection being closed by Pusher,
+                    # and that the client may reconnect immediately.
+                    self.actions.append(Event(name='fast_retry'))
+                    self._request_reconnect(err)
+        except KeyError:
+            log.warning("Problem processing pusher error: {0}".format(event.data), exc_info=True)
+
+    def _request_reconnect(self, reason):
+        """
+        Announce that a new connection is needed, and reconnect unless making before breaking.
+
+        Pusher closes the connection itself after 4200-class errors.
+        """
+        self.actions.append(Event(name='reconnect_requested', reason=reason))
+        if reason == 'pong_timeout' and not self.make_before_break:
+            self.actions.append(Event(name='reconnect'))
+
+    def _ping(self, event, now):
+        """Handle received pusher:ping events."""
+        log.debug("An unexpected pusher:ping event was received from the Pusher server.")
+        self.outgoing.append(Event(name=PONG))
+
+    def _pong(self, event, now):
+        """Handle received pusher:pong events."""
+        self.pong_deadline = None
+        if self._last_activity is None:
+            self._last_activity = now
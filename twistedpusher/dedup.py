@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- test-case-name: twistedpusher.test.test_redundancy -*-
+
+from collections import OrderedDict
+
+
+def event_fingerprint(event):
+    """
+    Get a fingerprint identifying an event's content across connections.
+
+    :type event: twistedpusher.events.Event
+    :rtype: int
+    """
+    data = event.get('data')
+    if not isinstance(data, (str, unicode)):
+        data = repr(data)
+    return hash((event.get('channel'), event.get('name'), data))
+
+
+class DeduplicationWindow(object):
+    """
+    Remembers how many times each replica delivered each recent fingerprint.
+
+    The n-th copy of a fingerprint from any replica is new if no replica delivered n copies yet, so identical events
+    sent twice by Pusher are both kept while their copies from the other replicas are dropped.
+    Only the last ``max_size`` fingerprints are remembered.
+
+    :ivar duplicates: number of events found to be duplicates
+    """
+    def __init__(self, replicas, max_size=10000):
+        """
+        :param replicas: number of replicas delivering events
+        :type replicas: int
+        :param max_size: number of fingerprints to remember
+        :type max_size: int
+        """
+        self.replicas = replicas
+        self.max_size = max_size
+        self.duplicates = 0
+        # fingerprint -> copies delivered by each replica
+        self._seen = OrderedDict()
+
+    def __len__(self):
+        return len(self._seen)
+
+    def is_new(self, fingerprint, replica):
+        """
+        Record a fingerprint delivered by a replica.
+
+        :param replica: index of the replica
+        :type replica: int
+
+        :returns: whether it is the first delivery of this copy
+        :rtype: bool
+        """
+        try:
+            counts = self._seen[fingerprint]
+        except KeyError:
+            if len(self._seen) >= self.max_size:
+                self._seen.popitem(last=False)
+            counts = self._seen[fingerprint] = [0] * self.replicas
+        counts[replica] += 1
+        copy = counts[replica]
+        for other, count in enumerate(counts):
+            if count >= copy and other != replica:
+                self.duplicates += 1
+                return False
+        return True
@@ -0,0 +1,477 @@
+#!/usr/bin/env python
+# -*- test-case-name: twistedpusher.test.test_delivery -*-
+
+import inspect
+import logging
+import threading
+from collections import deque, OrderedDict
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+from twistedpusher.events import listener_name
+
+log = logging.getLogger(__name__)
+
+# what a PooledListener does when its queue of pending events is full
+OVERFLOW_POLICIES = ('block', 'drop-oldest', 'conflate')
+
+# coroutine listeners are only supported where Twisted can wrap them in Deferreds
+_iscoroutine = getattr(inspect, 'iscoroutine', None) if hasattr(defer, 'ensureDeferred') else None
+
+
+def make_conflation_key(key):
+    """
+    Build a function returning the conflation key of an event.
+
+    :param key: a callable taking an event, ``'name'`` to conflate by event name,
+        or the name of a field of the event's data to conflate by event name and that field. Events whose data
+        isn't a dict, e.g. on channels without ``json_data``, are conflated by event name.
+    :type key: callable or str
+
+    :rtype: callable
+    """
+    if callable(key):
+        return key
+    elif key == 'name':
+        return lambda event: event.name
+
+    def field_key(event):
+        data = event.data
+        return event.name, data.get(key) if isinstance(data, dict) else None
+    return field_key
+
+
+def report_failure(emitter, wrapper, event, failure):
+    """
+    Hand a failure of a wrapped listener to the error policy of the emitter it is bound to, with the exception
+    raised again so the policy sees it as if the emitter had called the listener.
+
+    :param wrapper: the wrapper bound to the emitter in place of the listener
+    :type failure: twisted.python.failure.Failure
+    """
+    try:
+        failure.raiseException()
+    except Exception:
+        emitter.error_policy.listener_failed(emitter, wrapper, event)
+
+
+class EventQueue(object):
+    """
+    Bounded FIFO of events waiting to be delivered.
+
+    Without a conflation key the oldest event is dropped to make room. With one, an event replaces the queued event
+    with the same key in place, so the queue holds at most one event per key.
+
+    :ivar dropped: number of events dropped or replaced
+    :type dropped: int
+    """
+    def __init__(self, max_size=None, conflate_key=None):
+        """
+        :param max_size: maximum number of queued events, or None for no limit
+        :type max_size: int or None
+        :param conflate_key: optional conflation key, see :func:`make_conflation_key`
+        """
+        self.max_size = max_size
+        self.conflate_key = make_conflation_key(conflate_key) if conflate_key is not None else None
+        self._events = OrderedDict() if self.conflate_key else deque()
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._events)
+
+    def full(self):
+        return self.max_size is not None and len(self._events) >= self.max_size
+
+    def put(self, event):
+        """Queue an event, dropping or replacing another one if needed."""
+        if self.conflate_key is None:
+            if self.full():
+                self._events.popleft()
+                self.dropped += 1
+            self._events.append(event)
+        else:
+            key = self.conflate_key(event)
+            if key in self._events:
+                self._events[key] = event
+                self.dropped += 1
+            else:
+                if self.full():
+                    self._events.popitem(last=False)
+                    self.dropped += 1
+                self._events[key] = event
+
+    def get(self):
+        """
+        Remove and return the oldest queued event.
+
+        :raises IndexError: if the queue is empty
+        """
+        if self.conflate_key is None:
+            return self._events.popleft()
+        try:
+            return self._events.popitem(last=False)[1]
+        except KeyError:
+            raise IndexError("get from an empty EventQueue")
+
+    def get_all(self):
+        """Remove and return all queued events, oldest first."""
+        if self.conflate_key is None:
+            events = list(self._events)
+        else:
+            events = list(self._events.values())
+        self._events.clear()
+        return events
+
+
+class PooledListener(object):
+    """
+    Calls a listener from a thread pool, or through a process pool, instead of on the reactor thread.
+
+    Events are queued and delivered one at a time in the order they arrived, so a listener bound to a channel sees
+    that channel's events in order. Only one pool thread is used per PooledListener at any time.
+
+    ===========  ===============================================================
+    Overflow     When ``max_pending`` events are already waiting
+    ===========  ===============================================================
+    block        the emitting thread waits until the listener catches up
+    drop-oldest  the oldest waiting event is dropped
+    conflate     waiting events are conflated by ``conflate_key`` and the oldest
+                 is dropped if there are more keys than ``max_pending``
+    ===========  ===============================================================
+
+    Channels emit on the reactor thread, so with ``block`` a full queue stops the reactor: no frames are read or
+    written and no timers run until the listener makes room, which can get the connection dropped for inactivity.
+    The listener must not wait on the reactor either (e.g. with ``blockingCallFromThread``), or both deadlock.
+    Only use it for listeners that must not lose events and keep up on average.
+
+    Failures are handed to the error policy of ``emitter`` on the reactor thread, or logged without one.
+
+    :ivar delivered: number of events delivered
+    :ivar failures: number of events the listener raised an exception for
+    """
+    def __init__(self, listener, threadpool=None, process_pool=None, max_pending=1000, overflow='drop-oldest',
+                 conflate_key='name', reactor=None, emitter=None):
+        """
+        :param listener: the listener to call with events
+        :param threadpool: Twisted ThreadPool to run in, defaults to the reactor's
+        :param process_pool: optional ``multiprocessing.Pool`` to call the listener in. Listeners run in a process
+            pool must be picklable and receive events as plain dicts.
+        :param max_pending: maximum number of events waiting for the listener
+        :type max_pending: int
+        :param overflow: one of ``OVERFLOW_POLICIES``, ``block`` blocks the reactor thread when the queue is full
+        :type overflow: str
+        :param conflate_key: conflation key used with the ``conflate`` policy, see :func:`make_conflation_key`
+        :param reactor: reactor providing the default thread pool and running error policies, defaults to
+            :class:`twisted.internet.reactor`
+        :param emitter: optional ``IEventEmitter`` this is bound to, whose ``error_policy`` handles failures
+
+        :raises ValueError: if the listener is not callable or the overflow policy is unknown
+        """
+        if not callable(listener):
+            raise ValueError("Listener must be callable.")
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy '{0}'".format(overflow))
+
+        if not reactor:
+            from twisted.internet import reactor
+        if threadpool is None:
+            threadpool = reactor.getThreadPool()
+
+        self.listener = listener
+        self.threadpool = threadpool
+        self.reactor = reactor
+        self.emitter = emitter
+        self.process_pool = process_pool
+        self.overflow = overflow
+        self.pending = EventQueue(max_pending, conflate_key if overflow == 'conflate' else None)
+
+        self.delivered = 0
+        self.failures = 0
+
+        self._condition = threading.Condition()
+        self._draining = False
+
+    def __repr__(self):
+        return '<PooledListener {0}>'.format(listener_name(self.listener))
+
+    def __call__(self, event):
+        with self._condition:
+            if self.overflow == 'block':
+                while self.pending.full():
+                    self._condition.wait()
+            self.pending.put(event)
+            if self._draining:
+                return
+            self._draining = True
+        self.threadpool.callInThread(self._drain)
+
+    @property
+    def dropped(self):
+        """Number of events dropped or conflated before reaching the listener."""
+        return self.pending.dropped
+
+    def stats(self):
+        """
+        Get delivery statistics.
+
+        :returns: ``queue_depth``, ``delivered``, ``failures`` and ``dropped``
+        :rtype: dict
+        """
+        return {'queue_depth': len(self.pending),
+                'delivered': self.delivered,
+                'failures': self.failures,
+                'dropped': self.dropped}
+
+    def _drain(self):
+        """Deliver queued events until there are none left. Runs in a pool thread."""
+        while True:
+            with self._condition:
+                if not len(self.pending):
+                    self._draining = False
+                    return
+                event = self.pending.get()
+                self._condition.notify()
+            try:
+                if self.process_pool is not None:
+                    # dict(event) decodes lazily decoded data
+                    self.process_pool.apply(self.listener, (dict(event),))
+                else:
+                    self.listener(event)
+            except Exception:
+                self.failures += 1
+                if self.emitter is not None:
+                    # error policies may unbind listeners, which is only safe on the reactor thread
+                    self.reactor.callFromThread(report_failure, self.emitter, self, event, Failure())
+                else:
+                    log.error("Error in pooled listener {0} called with event '{1}'".format(
+                        listener_name(self.listener), event.name), exc_info=True)
+            else:
+                self.delivered += 1
+
+
+def _call_async(listener, event):
+    """
+    Call a listener and get a Deferred for its result.
+
+    Coroutines are wrapped with ``defer.ensureDeferred`` where Twisted and Python support them.
+
+    :rtype: defer.Deferred
+    """
+    try:
+        result = listener(event)
+    except Exception:
+        return defer.fail()
+    if isinstance(result, defer.Deferred):
+        return result
+    if _iscoroutine is not None and _iscoroutine(result):
+        return defer.ensureDeferred(result)
+    return defer.succeed(result)
+
+
+class AsyncListener(object):
+    """
+    Calls a listener that returns Deferreds (or coroutines), with at most ``max_in_flight`` calls unfinished.
+
+    Events arriving while the limit is reached wait in a queue and are delivered in order as calls complete.
+    Failed calls are counted, and handed to the error policy of ``emitter`` or logged without one.
+
+    :ivar in_flight: number of unfinished calls
+    :ivar completed: number of calls that succeeded
+    :ivar failures: number of calls that failed
+    :ivar max_queue_depth: the most events that were waiting at once
+    """
+    def __init__(self, listener, max_in_flight=1, max_pending=None, conflate_key=None, reactor=None, emitter=None):
+        """
+        :param listener: the listener to call with events
+        :param max_in_flight: maximum number of unfinished calls
+        :type max_in_flight: int
+        :param max_pending: maximum number of waiting events, the oldest is dropped beyond it. None for no limit.
+        :type max_pending: int or None
+        :param conflate_key: optional key to conflate waiting events by, see :func:`make_conflation_key`
+        :param reactor: :class:`IReactorTime` provider used to time calls, defaults to
+            :class:`twisted.internet.reactor`
+        :param emitter: optional ``IEventEmitter`` this is bound to, whose ``error_policy`` handles failures
+
+        :raises ValueError: if the listener is not callable or max_in_flight is less than 1
+        """
+        if not callable(listener):
+            raise ValueError("Listener must be callable.")
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        if not reactor:
+            from twisted.internet import reactor
+
+        self.listener = listener
+        self.max_in_flight = max_in_flight
+        self.pending = EventQueue(max_pending, conflate_key)
+        self.reactor = reactor
+        self.emitter = emitter
+
+        self.in_flight = 0
+        self.completed = 0
+        self.failures = 0
+        self.max_queue_depth = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+        self._draining = False
+
+    def __repr__(self):
+        return '<AsyncListener {0}>'.format(listener_name(self.listener))
+
+    def __call__(self, event):
+        self.pending.put(event)
+        if len(self.pending) > self.max_queue_depth:
+            self.max_queue_depth = len(self.pending)
+        self._drain()
+
+    def _drain(self):
+        """Start calls for waiting events while below the in-flight limit."""
+        # calls that complete synchronously come back here, the outer loop carries on for them
+        if self._draining:
+            return
+        self._draining = True
+        try:
+            while len(self.pending) and self.in_flight < self.max_in_flight:
+                self._start(self.pending.get())
+        finally:
+            self._draining = False
+
+    def _start(self, event):
+        self.in_flight += 1
+        started = self.reactor.seconds()
+        d = _call_async(self.listener, event)
+        d.addCallbacks(self._succeeded, self._failed, errbackArgs=(event,))
+        d.addBoth(self._finished, started)
+
+    def _succeeded(self, _):
+        self.completed += 1
+
+    def _failed(self, failure, event):
+        self.failures += 1
+        if self.emitter is not None:
+            report_failure(self.emitter, self, event, failure)
+            return
+        log.error("Error in async listener {0} called with event '{1}': {2}".format(
+            listener_name(self.listener), event.name, failure.getTraceback()))
+
+    def _finished(self, _, started):
+        latency = self.reactor.seconds() - started
+        self.latency_total += latency
+        if latency > self.latency_max:
+            self.latency_max = latency
+        self.in_flight -= 1
+        self._drain()
+
+    @property
+    def dropped(self):
+        """Number of waiting events dropped or conflated before reaching the listener."""
+        return self.pending.dropped
+
+    def stats(self):
+        """
+        Get delivery statistics. Latencies are the time from calling the listener until its Deferred fired.
+
+        :returns: ``queue_depth``, ``max_queue_depth``, ``in_flight``, ``completed``, ``failures``, ``dropped``,
+            ``latency_mean`` and ``latency_max`` (in seconds)
+        :rtype: dict
+        """
+        finished = self.completed + self.failures
+        return {'queue_depth': len(self.pending),
+                'max_queue_depth': self.max_queue_depth,
+                'in_flight': self.in_flight,
+                'completed': self.completed,
+                'failures': self.failures,
+                'dropped': self.dropped,
+                'latency_mean': self.latency_total / finished if finished else 0.0,
+                'latency_max': self.latency_max}
+
+
+class BatchListener(object):
+    """
+    Collects events and calls a listener with lists of them.
+
+    A batch is delivered ``max_delay`` seconds after its first event, which with the default of 0 means once per
+    reactor iteration, or as soon as it holds ``max_size`` events. Listener errors are counted, and handed to the
+    error policy of ``emitter`` with the batch's last event, or logged without one.
+
+    :ivar batches: number of batches delivered
+    :ivar delivered: number of events delivered
+    :ivar failures: number of batches the listener raised an exception for
+    """
+    def __init__(self, listener, max_size=None, max_delay=0, reactor=None, emitter=None):
+        """
+        :param listener: the listener to call with lists of events
+        :param max_size: deliver a batch once it holds this many events, None for no limit
+        :type max_size: int or None
+        :param max_delay: longest time in seconds an event waits for its batch to be delivered
+        :type max_delay: float
+        :param reactor: :class:`IReactorTime` provider to schedule deliveries with, defaults to
+            :class:`twisted.internet.reactor`
+        :param emitter: optional ``IEventEmitter`` this is bound to, whose ``error_policy`` handles failures
+
+        :raises ValueError: if the listener is not callable or max_size is less than 1
+        """
+        if not callable(listener):
+            raise ValueError("Listener must be callable.")
+        if max_size is not None and max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        if not reactor:
+            from twisted.internet import reactor
+
+        self.listener = listener
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.reactor = reactor
+        self.emitter = emitter
+
+        self.batches = 0
+        self.delivered = 0
+        self.failures = 0
+
+        self._batch = []
+        self._flush_call = None
+
+    def __repr__(self):
+        return '<BatchListener {0}>'.format(listener_name(self.listener))
+
+    def __call__(self, event):
+        self._batch.append(event)
+        if self.max_size is not None and len(self._batch) >= self.max_size:
+            self.flush()
+        elif self._flush_call is None:
+            self._flush_call = self.reactor.callLater(self.max_delay, self.flush)
+
+    def flush(self):
+        """Deliver the events collected so far, if any."""
+        if self._flush_call is not None:
+            if self._flush_call.active():
+                self._flush_call.cancel()
+            self._flush_call = None
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        try:
+            self.listener(batch)
+        except Exception:
+            self.failures += 1
+            if self.emitter is not None:
+                self.emitter.error_policy.listener_failed(self.emitter, self, batch[-1])
+                return
+            log.error("Error in batch listener {0} called with {1} events".format(
+                listener_name(self.listener), len(batch)), exc_info=True)
+        else:
+            self.batches += 1
+            self.delivered += len(batch)
+
+    def stats(self):
+        """
+        Get delivery statistics.
+
+        :returns: ``queue_depth``, ``batches``, ``delivered`` and ``failures``
+        :rtype: dict
+        """
+        return {'queue_depth': len(self._batch),
+                'batches': self.batches,
+                'delivered': self.delivered,
+                'failures': self.failures}
@@ -13,3 +13,11 @@ class BadChannelNameError(ValueError):
 
 class ConnectionError(Exception):
     """Could not perform an action due to connection state."""
+
+
+class SubscriptionTimeoutError(Exception):
+    """A channel subscription was not acknowledged by Pusher in time."""
+
+
+class AuthorizationError(Exception):
+    """A private or presence channel subscription could not be authorized."""
@@ -3,34 +3,307 @@
 # -*- test-case-name: twistedpusher.test.test_eventemitter -*-
 
 import logging
+import re
+import types
 import warnings
 import traceback
-from collections import defaultdict
-from itertools import chain
+import importlib
 import json
+from collections import Counter
 from zope.interface import implementer
 
-from twistedpusher.interfaces import IEventEmitter
+from twistedpusher.interfaces import IEventEmitter, IListenerErrorPolicy
 from twistedpusher.errors import BadEventNameError
 
 log = logging.getLogger(__name__)
 
+# JSON codecs tried in order when picking the default backend.
+# ujson is faster still but only used if selected explicitly, since older releases round floats.
+JSON_BACKENDS = ('simplejson', 'json')
 
-class Event(dict):
+# Prefixes of events used by the Pusher protocol itself, as opposed to client events.
+PUSHER_EVENT_PREFIXES = ('pusher:', 'pusher_internal:')
+
+# Upper bound on the number of distinct names kept by intern_string and is_pusher_event.
+MAX_INTERNED_STRINGS = 10000
+_interned_strings = dict()
+_pusher_event_names = dict()
+
+# One top-level member of a serialized event whose value is a string or a scalar, followed by its separator.
+_ENVELOPE_START = re.compile(r'\s*\{\s*')
+_ENVELOPE_MEMBER = re.compile(r'"([^"\\]*(?:\\.[^"\\]*)*)"\s*:\s*'
+                              r'(?:"([^"\\]*(?:\\.[^"\\]*)*)"|[^\s",{}\[\]]+)\s*([,}])\s*')
+
+# Decoding states of an Event's data field.
+_DATA_RAW, _DATA_PENDING, _DATA_DECODED = range(3)
+# Fields of an Event kept in slots of their own, and the value of its data slot when it has no data field.
+_SLOT_FIELDS = ('name', 'channel')
+_MISSING = object()
+
+# Module (or any object) providing ``loads`` and ``dumps``, used for all event (de)serialization.
+json_backend = json
+
+
+def set_json_backend(backend=None):
+    """
+    Select the JSON codec used to decode and encode Pusher events.
+
+    :param backend: an object providing ``loads`` and ``dumps`` (e.g. a module), the name of a module to import,
+        or None to use the first installed codec listed in ``JSON_BACKENDS``
+
+    :returns: the backend now in use
+
+    :raises ImportError: if a backend given by name is not installed
+    """
+    global json_backend
+    if backend is None:
+        for name in JSON_BACKENDS:
+            try:
+                backend = importlib.import_module(name)
+            except ImportError:
+                continue
+            else:
+                break
+    elif isinstance(backend, basestring):
+        backend = importlib.import_module(backend)
+    json_backend = backend
+    log.debug("Using JSON backend {0}".format(getattr(backend, '__name__', backend)))
+    return json_backend
+
+set_json_backend()
+
+
+def intern_string(value):
+    """
+    Get a canonical copy of an event or channel name, so that every event shares one copy of each name.
+
+    Only the first ``MAX_INTERNED_STRINGS`` distinct names are kept.
+
+    :type value: str or unicode
+    :rtype: str or unicode
+    """
+    try:
+        return _interned_strings[value]
+    except KeyError:
+        if len(_interned_strings) < MAX_INTERNED_STRINGS:
+            _interned_strings[value] = value
+        return value
+
+
+class Event(object):
     """
     Encapsulates events.
 
+    Fields can be accessed as attributes or by key, and the usual mapping methods are available. Events are not
+    dicts, but compare equal to a dict of the same fields and ``dict(event)`` builds one. ``name`` and ``channel``
+    are kept in slots, ``data`` in a slot of its own, and any other field in a dict made only for the events that
+    have one.
+
+    A JSON-encoded ``data`` field can be marked with :meth:`decode_data_lazily`, in which case it is decoded the
+    first time it is read, whether by attribute, key, mapping method, comparison, copy or pickling.
+
     :ivar name: the event's name
     :type name: str or unicode
-    """
-    def __init__(self, **kwargs):
-        super(Event, self).__init__(kwargs)
 
-    def __setattr__(self, key, value):
-        self[key] = value
+    :ivar received_ns: ``monotonic_ns()`` when the frame carrying the event was received, or None
+    :ivar parsed_ns: ``monotonic_ns()`` when the event was loaded from that frame, or None
+    """
+    __slots__ = ('name', 'channel', '_data', '_data_state', '_extra', 'received_ns', 'parsed_ns')
+    # unhashable, like the dicts events compare equal to
+    __hash__ = None
+
+    def __init__(self, **fields):
+        setattr_ = object.__setattr__
+        for key in _SLOT_FIELDS:
+            if key in fields:
+                setattr_(self, key, fields.pop(key))
+        setattr_(self, '_data', fields.pop('data', _MISSING))
+        setattr_(self, '_data_state', _DATA_RAW)
+        # fields is a new dict, it can be kept
+        setattr_(self, '_extra', fields or None)
+        setattr_(self, 'received_ns', None)
+        setattr_(self, 'parsed_ns', None)
+
+    def __setitem__(self, key, value):
+        if key in _SLOT_FIELDS:
+            object.__setattr__(self, key, value)
+        elif key == 'data':
+            object.__setattr__(self, '_data', value)
+            object.__setattr__(self, '_data_state', _DATA_RAW)
+        else:
+            if self._extra is None:
+                object.__setattr__(self, '_extra', {})
+            self._extra[key] = value
+
+    __setattr__ = __setitem__
+
+    def __getitem__(self, key):
+        if key == 'data':
+            if self._data_state == _DATA_PENDING:
+                self._decode_data()
+            if self._data is _MISSING:
+                raise KeyError(key)
+            return self._data
+        try:
+            return getattr(self, key) if key in _SLOT_FIELDS else self._extra[key]
+        except (AttributeError, TypeError):
+            raise KeyError(key)
 
     def __getattr__(self, item):
-        return self[item]
+        # only called for fields missing from the slots
+        if item == 'data' and self._data is not _MISSING:
+            return self['data']
+        if self._extra is not None and item in self._extra:
+            return self._extra[item]
+        raise AttributeError(item)
+
+    def __delitem__(self, key):
+        if key == 'data':
+            if self._data is _MISSING:
+                raise KeyError(key)
+            object.__setattr__(self, '_data', _MISSING)
+            object.__setattr__(self, '_data_state', _DATA_RAW)
+        elif key in _SLOT_FIELDS:
+            try:
+                object.__delattr__(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        else:
+            if self._extra is None:
+                raise KeyError(key)
+            del self._extra[key]
+
+    def __contains__(self, key):
+        if key == 'data':
+            return self._data is not _MISSING
+        if key in _SLOT_FIELDS:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def keys(self):
+        keys = [key for key in _SLOT_FIELDS if hasattr(self, key)]
+        if self._data is not _MISSING:
+            keys.append('data')
+        if self._extra:
+            keys.extend(self._extra)
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def itervalues(self):
+        return iter(self.values())
+
+    iterkeys = __iter__
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[key]
+        return value
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def copy(self):
+        """Get the fields as a dict, with the data decoded."""
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, Event):
+            other = other.copy()
+        elif not isinstance(other, dict):
+            return NotImplemented
+        return self.copy() == other
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __repr__(self):
+        return repr(self.copy())
+
+    def __reduce__(self):
+        return _rebuild_event, (self.copy(), self.received_ns, self.parsed_ns)
+
+    def __copy__(self):
+        return _rebuild_event(self.copy(), self.received_ns, self.parsed_ns)
+
+    def decode_data_lazily(self):
+        """
+        Mark the data field to be decoded as JSON on first access.
+
+        Does nothing if the data field is not a string or has already been decoded.
+        """
+        if self._data_state == _DATA_RAW and isinstance(self._data, (str, unicode)):
+            object.__setattr__(self, '_data_state', _DATA_PENDING)
+
+    def stamp(self, received_ns, parsed_ns):
+        """
+        Record when the event was received and loaded, as ``twistedpusher.utils.monotonic_ns()`` values.
+
+        Stamps are not fields, attribute assignment can't set them.
+        """
+        object.__setattr__(self, 'received_ns', received_ns)
+        object.__setattr__(self, 'parsed_ns', parsed_ns)
+
+    @property
+    def data_pending(self):
+        """Whether the data field is still waiting to be decoded."""
+        return self._data_state == _DATA_PENDING
+
+    def _decode_data(self):
+        object.__setattr__(self, '_data', json_backend.loads(self._data))
+        object.__setattr__(self, '_data_state', _DATA_DECODED)
+
+
+def _rebuild_event(fields, received_ns, parsed_ns):
+    """Make an event from its fields and stamps, for copying and unpickling."""
+    event = Event()
+    event.update(fields)
+    event.stamp(received_ns, parsed_ns)
+    return event
+
+
+def is_pusher_event(event_name):
+    """
+    Check whether an event name belongs to the Pusher protocol rather than to a client event.
+
+    Results are cached for the first ``MAX_INTERNED_STRINGS`` distinct names.
+
+    :type event_name: str or unicode
+    :rtype: bool
+    """
+    try:
+        return _pusher_event_names[event_name]
+    except KeyError:
+        result = event_name.startswith(PUSHER_EVENT_PREFIXES)
+        if len(_pusher_event_names) < MAX_INTERNED_STRINGS:
+            _pusher_event_names[event_name] = result
+        return result
 
 
 def serialize_pusher_event(event):
@@ -57,34 +330,239 @@ def serialize_pusher_event(event):
     if event.get('channel'):
         tmp_event['channel'] = event.channel
 
-    serialized_event = json.dumps(tmp_event)
+    serialized_event = json_backend.dumps(tmp_event)
     return serialized_event
 
 
-def load_pusher_event(raw_event):
+def scan_pusher_envelope(raw_event):
+    """
+    Find the event name and channel of a serialized event without decoding the rest of it.
+
+    Only top-level members with string or scalar values are scanned, which covers the usual frame with a doubly
+    encoded data field. When a nested object or array comes before both fields are found, the scan gives up.
+
+    :param raw_event: a serialized JSON event
+    :type raw_event: str or unicode
+
+    :returns: ``(event_name, channel_name)``, either being None if the event has no such field,
+        or None if the envelope could not be scanned and the event must be loaded to find out
+    :rtype: tuple or None
+    """
+    match = _ENVELOPE_START.match(raw_event)
+    if not match:
+        return None
+    name = channel = None
+    pos = match.end()
+    while True:
+        match = _ENVELOPE_MEMBER.match(raw_event, pos)
+        if not match:
+            return None
+        key, value, separator = match.groups()
+        if key == 'event':
+            name = _unescape(value)
+        elif key == 'channel':
+            channel = _unescape(value)
+        if separator == '}' or (name is not None and channel is not None):
+            return name, channel
+        pos = match.end()
+
+
+def peek_channel(raw_event):
+    """
+    Find the channel name of a serialized event with plain string searches.
+
+    The first ``"channel"`` key is read, which can't be inside a string value since quotes are escaped there, but
+    can be a nested object's key. Callers must check with :func:`scan_pusher_envelope` before relying on a name
+    found this way to drop an event.
+
+    :param raw_event: a serialized JSON event
+    :type raw_event: str or unicode
+
+    :returns: the channel name, or None if there is no channel key or its value isn't a plain string
+    :rtype: str or unicode or None
+    """
+    key = raw_event.find('"channel"')
+    if key < 0:
+        return None
+    colon = raw_event.find(':', key + 9)
+    start = raw_event.find('"', colon + 1)
+    end = raw_event.find('"', start + 1)
+    if colon < 0 or start < 0 or end < 0 or raw_event[key + 9:colon].strip() or raw_event[colon + 1:start].strip():
+        return None
+    value = raw_event[start + 1:end]
+    if '\\' in value:
+        return None
+    return value
+
+
+def _unescape(value):
+    """Decode the contents of a JSON string as found by scan_pusher_envelope."""
+    if value is not None and '\\' in value:
+        return json_backend.loads('"' + value + '"')
+    return value
+
+
+def load_pusher_event(raw_event, json_data=False):
     """
     Load an event from serialized JSON.
 
+    The data field of pusher events is always decoded if it is doubly encoded. The data field of client events is
+    marked for decoding if requested with ``json_data``, and is then decoded the first time a listener reads it.
+
     :param raw_event: a serialized JSON event
     :type raw_event: str or unicode
 
+    :param json_data: True to also decode client event data as JSON, or a container of channel names to do so for
+    :type json_data: bool or set
+
     :returns: the parsed event
     :rtype: Event
 
     :raise BadEventNameError: if raw_event had no event name field
     """
-    event = Event(**json.loads(raw_event))
+    fields = json_backend.loads(raw_event)
     try:
-        event.name = event.pop('event')
+        name = fields['name'] = intern_string(fields.pop('event'))
     except KeyError:
         raise BadEventNameError("No event name")
-    if (event.name.startswith(('pusher:', 'pusher_internal:'))
-            and 'data' in event
-            and isinstance(event.data, (str, unicode))):
-        event.data = json.loads(event.data)
-    elif 'data' not in event:
-        event.data = dict()
-    return event
+    channel = fields.get('channel')
+    if channel is not None:
+        channel = fields['channel'] = intern_string(channel)
+    data = fields.get('data')
+    if data is None and 'data' not in fields:
+        fields['data'] = dict()
+    elif isinstance(data, (str, unicode)):
+        if is_pusher_event(name):
+            fields['data'] = json_backend.loads(data)
+        elif json_data is True or (json_data and channel in json_data):
+            event = Event(**fields)
+            event.decode_data_lazily()
+            return event
+    return Event(**fields)
+
+
+def listener_name(listener):
+    """
+    Get a readable name for a listener.
+
+    :rtype: str
+    """
+    name = getattr(listener, '__name__', None)
+    if name is None:
+        return repr(listener)
+    owner = getattr(listener, '__self__', None)
+    if owner is not None and not isinstance(owner, types.ModuleType):
+        name = '{0}.{1}'.format(type(owner).__name__, name)
+    module = getattr(listener, '__module__', None)
+    if module:
+        name = '{0}.{1}'.format(module, name)
+    return name
+
+
+@implementer(IListenerErrorPolicy)
+class ListenerErrorPolicy(object):
+    """
+    Counts the failures of each listener and otherwise ignores them.
+    Base class of the other listener error policies, which override ``handle``.
+
+    :ivar failures: number of failures per listener
+    :type failures: collections.Counter
+    """
+    def __init__(self):
+        self.failures = Counter()
+
+    def listener_failed(self, emitter, listener, event):
+        self.failures[listener] += 1
+        self.handle(emitter, listener, event, self.failures[listener])
+
+    def handle(self, emitter, listener, event, count):
+        """
+        Act on a listener failure, from inside the except block.
+
+        :param count: how many times this listener has failed so far
+        :type count: int
+        """
+
+    def reset(self, listener=None):
+        """Forget the failures of one listener, or of all listeners."""
+        if listener is None:
+            self.failures.clear()
+        else:
+            self.failures.pop(listener, None)
+
+
+class WarnOnListenerError(ListenerErrorPolicy):
+    """Issue a warning with the traceback for every failure. This is the default policy."""
+    def handle(self, emitter, listener, event, count):
+        warnings.warn("Error in listener {0} called with event '{1}': \n{2}".format(listener_name(listener),
+                                                                                   event.name,
+                                                                                   traceback.format_exc()))
+
+
+class SampleListenerErrors(ListenerErrorPolicy):
+    """Log the first failure of each listener, and then one failure in every ``rate``."""
+    def __init__(self, rate=100):
+        super(SampleListenerErrors, self).__init__()
+        self.rate = rate
+
+    def handle(self, emitter, listener, event, count):
+        if count % self.rate == 1 or self.rate == 1:
+            log.error("Error in listener {0} called with event '{1}' (failure {2})".format(
+                listener_name(listener), event.name, count), exc_info=True)
+
+
+class RateLimitListenerErrors(ListenerErrorPolicy):
+    """
+    Log at most ``max_logs`` failures, across all listeners, every ``period`` seconds.
+    The number of failures left out is logged with the next logged failure.
+    """
+    def __init__(self, max_logs=10, period=60, reactor=None):
+        """
+        :param reactor: :class:`IReactorTime` provider, defaults to :class:`twisted.internet.reactor`
+        """
+        super(RateLimitListenerErrors, self).__init__()
+        self.max_logs = max_logs
+        self.period = period
+        if not reactor:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self._period_start = None
+        self._logged = 0
+        self.suppressed = 0
+
+    def handle(self, emitter, listener, event, count):
+        now = self.reactor.seconds()
+        if self._period_start is None or now - self._period_start >= self.period:
+            self._period_start = now
+            self._logged = 0
+        if self._logged < self.max_logs:
+            self._logged += 1
+            suppressed = ''
+            if self.suppressed:
+                suppressed = ' ({0} failures not logged)'.format(self.suppressed)
+                self.suppressed = 0
+            log.error("Error in listener {0} called with event '{1}'{2}".format(
+                listener_name(listener), event.name, suppressed), exc_info=True)
+        else:
+            self.suppressed += 1
+
+
+class DisableFailingListeners(ListenerErrorPolicy):
+    """Unbind a listener from the emitter once it has failed ``max_failures`` times, logging why."""
+    def __init__(self, max_failures=10):
+        super(DisableFailingListeners, self).__init__()
+        self.max_failures = max_failures
+
+    def handle(self, emitter, listener, event, count):
+        if count < self.max_failures:
+            return
+        log.error("Unbinding listener {0} after {1} failures, the last with event '{2}'".format(
+            listener_name(listener), count, event.name), exc_info=True)
+        for event_name, listeners in list(emitter.listeners.items()):
+            if listener in listeners:
+                emitter.unbind(event_name, listener)
+        if listener in emitter.global_listeners:
+            emitter.unbind_all(listener)
 
 
 @implementer(IEventEmitter)
@@ -97,15 +575,35 @@ class EventEmitter(object):
     >>> x = EventEmitter()
     >>> x.bind_all(lambda event: log.debug(event))
     >>> x.emit_event(Event(name='this_is_an_event'))
+
+    :ivar error_policy: ``IListenerErrorPolicy`` provider handling listener exceptions. Each emitter gets its own,
+        built by ``error_policy_factory``, so failures are counted per emitter and forgotten with it.
+
+    :ivar error_policy_factory: callable building the default ``error_policy``. Set it on the class to change the
+        policy of every emitter created afterwards.
+
+    :ivar profiler: ``IListenerProfiler`` provider timing listener calls, or None. Set it on the class to profile
+        every emitter, e.g. with a :class:`twistedpusher.profiling.ListenerProfiler`.
     """
+    error_policy_factory = WarnOnListenerError
+    profiler = None
+
     def __init__(self):
         """
         Simple event dispatching.
         Listeners receive Event objects.
+
+        The listeners to call for each bound event name are kept in a precomputed tuple, rebuilt only when
+        binding or unbinding, so emitting does no per-event bookkeeping and unknown names cost nothing.
         """
         super(EventEmitter, self).__init__()
-        self.listeners = defaultdict(set)
+        self.error_policy = self.error_policy_factory()
+        self.listeners = dict()
         self.global_listeners = set()
+        # event name -> tuple of global and specific listeners to call
+        self._dispatch = dict()
+        # listeners to call for event names without specific listeners
+        self._global_dispatch = ()
 
     def bind(self, event_name, listener):
         """
@@ -119,7 +617,8 @@ class EventEmitter(object):
         :raises ValueError: if listener is not callable
         """
         if callable(listener):
-            self.listeners[event_name].add(listener)
+            self.listeners.setdefault(event_name, set()).add(listener)
+            self._rebuild_dispatch(event_name)
         else:
             raise ValueError("Listener must be callable.")
 
@@ -137,7 +636,12 @@ class EventEmitter(object):
         try:
             self.listeners[event_name].remove(listener)
         except KeyError:
-            warnings.warn("Could not unbind listener {0} from event '{0}': listener not found.".format(event_name))
+            warnings.warn("Could not unbind listener {0} from event '{1}': listener not found.".format(listener,
+                                                                                                       event_name))
+        else:
+            if not self.listeners[event_name]:
+                del self.listeners[event_name]
+            self._rebuild_dispatch(event_name)
 
     def bind_all(self, listener):
         """
@@ -149,6 +653,7 @@ class EventEmitter(object):
         """
         if callable(listener):
             self.global_listeners.add(listener)
+            self._rebuild_all_dispatch()
         else:
             raise ValueError("Global listener must be a callable.", listener)
 
@@ -164,6 +669,30 @@ class EventEmitter(object):
             self.global_listeners.remove(listener)
         except KeyError:
             warnings.warn("Could not unbind global listener '{0}': listener not found.".format(listener))
+        else:
+            self._rebuild_all_dispatch()
+
+    def _unbound_dispatch(self, event_name):
+        """Get the listeners to call for an event name that has no listeners of its own."""
+        return self._global_dispatch
+
+    def _rebuild_dispatch(self, event_name):
+        """Recompute the listeners to call for one event name."""
+        listeners = self.listeners.get(event_name)
+        if listeners:
+            self._dispatch[event_name] = self._unbound_dispatch(event_name) + tuple(listeners)
+        else:
+            self._dispatch.pop(event_name, None)
+
+    def _rebuild_global_dispatch(self):
+        """Recompute the global listener tuples."""
+        self._global_dispatch = tuple(self.global_listeners)
+
+    def _rebuild_all_dispatch(self):
+        """Recompute the listeners to call for every event name, after global listeners changed."""
+        self._rebuild_global_dispatch()
+        for event_name in self.listeners:
+            self._rebuild_dispatch(event_name)
 
     def emit_event(self, event):
         """
@@ -172,13 +701,27 @@ class EventEmitter(object):
         :param event: event object
         :type event: Event
         """
-        for cb in chain(self.global_listeners, self.listeners[event.name]):
+        listeners = self._dispatch.get(event.name)
+        if listeners is None:
+            listeners = self._unbound_dispatch(event.name)
+        if self.profiler is not None:
+            return self._emit_profiled(listeners, event)
+        for cb in listeners:
             try:
                 cb(event)
             except AssertionError:
                 raise
             except Exception:
-                # todo find a better method than this to avoid a listener error killing the transport connection
-                warnings.warn("Error in listener {} called with event '{}': \n{}".format(cb.__name__,
-                                                                                         event.name,
-                                                                                         traceback.format_exc()))
\ No newline at end of file
+                # a listener error must not kill the transport connection
+                self.error_policy.listener_failed(self, cb, event)
+
+    def _emit_profiled(self, listeners, event):
+        """Dispatch an event through the profiler."""
+        profiler = self.profiler
+        for cb in listeners:
+            try:
+                profiler.call(self, cb, event)
+            except AssertionError:
+                raise
+            except Exception:
+                self.error_policy.listener_failed(self, cb, event)
\ No newline at end of file
@@ -45,6 +45,48 @@ class IEventEmitter(Interface):
         """
 
 
+class IListenerErrorPolicy(Interface):
+    """Decides what happens when a listener raises an exception while an event is emitted."""
+    failures = Attribute('failures', 'Mapping of listener to the number of times it failed.')
+
+    def listener_failed(emitter, listener, event):
+        """
+        Handle a listener failure. Called from the except block, so the exception is available.
+
+        :param emitter: the IEventEmitter that was emitting the event
+        :param listener: the listener that raised
+        :param event: the event the listener was called with
+        """
+
+
+class IChannelAuthorizer(Interface):
+    """Authorizes subscriptions to private and presence channels."""
+    def authorize(socket_id, channel_names):
+        """
+        Get the subscription signatures of channels for a connection.
+
+        :param socket_id: the socket ID of the connection subscribing
+        :param channel_names: list of private or presence channel names
+
+        :returns: a Deferred firing with the ``auth`` and, for presence channels, ``channel_data`` fields of each
+            authorized channel, keyed by name. Channels left out were refused. Fails if the channels could not be
+            authorized at all.
+        :rtype: defer.Deferred
+        """
+
+
+class IListenerProfiler(Interface):
+    """Times listener calls while events are emitted."""
+    def call(emitter, listener, event):
+        """
+        Call a listener with an event, letting its exceptions propagate.
+
+        :param emitter: the IEventEmitter emitting the event
+        :param listener: the listener to call
+        :param event: the event to call it with
+        """
+
+
 class IPusherClientService(IEventEmitter, IService):
     """"""
     key = Attribute('key', 'The Pusher application key that is being connected to. Changing this after creating the'
@@ -88,12 +130,19 @@ class IPusherConnection(IEventEmitter, IService):
         :type event: Event
         """
 
+    def send_events(events):
+        """
+        Send several events to Pusher in a single write.
+        :type events: list
+        """
+
 
 # This interface isn't really needed, and is just provided for document of
 # what public methods Transport has.
 class IPusherTransport(IEventEmitter, IService):
     state = Attribute('state', 'Current transport state. Not 1:1 with emitted events.')
     prev_state = Attribute('prev_state', 'Previous transport state.')
+    auto_reconnect = Attribute('auto_reconnect', 'bool indicating whether to connect again after a connection loss.')
 
     def send_event(event):
         """
@@ -101,9 +150,18 @@ class IPusherTransport(IEventEmitter, IService):
         :type event: Event
         """
 
+    def send_events(events):
+        """
+        Send several events to Pusher in a single write.
+        :type events: list
+        """
+
     def reconnect():
         """"""
 
+    def resume_reconnecting():
+        """Set ``auto_reconnect`` again, connecting if the connection was lost meanwhile."""
+
 
 class IPusherProtocol(Interface):
     """
@@ -123,5 +181,11 @@ class IPusherProtocol(Interface):
         :type event: Event
         """
 
+    def send_events(events):
+        """
+        Send several events to Pusher in a single write.
+        :type events: list
+        """
+
     def disconnect():
         """Close the connection immediately."""
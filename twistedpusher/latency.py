@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- test-case-name: twistedpusher.test.test_latency -*-
+
+import time
+
+from twistedpusher.events import Event
+from twistedpusher.utils import monotonic_ns
+
+# values below 2 ** SIGNIFICANT_BITS are recorded exactly,
+# larger ones with a relative error below 2 ** -(SIGNIFICANT_BITS - 1)
+SIGNIFICANT_BITS = 7
+
+# percentiles reported by LatencyHistogram.snapshot
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LatencyHistogram(object):
+    """
+    Sparse histogram of nanosecond durations with HDR-style log-linear buckets.
+
+    Each power of two range is split into ``2 ** SIGNIFICANT_BITS`` buckets, so the error is bounded relative to
+    the value recorded while memory only grows with the number of distinct buckets used.
+
+    :ivar count: number of values recorded
+    :ivar total: sum of the values recorded
+    :ivar min: smallest value recorded, or None
+    :ivar max: largest value recorded, or None
+    """
+    def __init__(self):
+        self.counts = dict()
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        """
+        Record a duration. Negative values, e.g. from clock skew, are recorded as 0.
+
+        :type value: int
+        """
+        value = int(value) if value > 0 else 0
+        shift = value.bit_length() - SIGNIFICANT_BITS
+        bucket = (value >> shift) << shift if shift > 0 else value
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """
+        Get the value below which the given percentage of recorded values fall.
+
+        :param percent: between 0 and 100
+        :type percent: float
+
+        :returns: the lower bound of the bucket holding that value, or None if nothing was recorded
+        :rtype: int or None
+        """
+        if not self.count:
+            return None
+        rank = max(1, self.count * percent / 100.0)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return bucket
+        return self.max
+
+    def reset(self):
+        self.__init__()
+
+    def snapshot(self):
+        """
+        Summarize the histogram.
+
+        :returns: ``count``, ``min``, ``max``, ``mean`` and a ``pNN`` entry for each of ``PERCENTILES``, in ns
+        :rtype: dict
+        """
+        summary = {'count': self.count,
+                   'min': self.min,
+                   'max': self.max,
+                   'mean': self.total / float(self.count) if self.count else None}
+        for percent in PERCENTILES:
+            summary['p{0:g}'.format(percent)] = self.percentile(percent)
+        return summary
+
+
+def timestamp_to_seconds(timestamp):
+    """
+    Convert an exchange timestamp to seconds since the epoch, guessing its unit from its magnitude.
+
+    :param timestamp: seconds, milliseconds, microseconds or nanoseconds since the epoch, as a number or string
+    :rtype: float
+
+    :raises ValueError: if the timestamp is not a number
+    """
+    timestamp = float(timestamp)
+    for scale in (1, 1e3, 1e6, 1e9):
+        # 1e11 seconds is in the year 5138
+        if timestamp < 1e11 * scale:
+            return timestamp / scale
+    return timestamp / 1e9
+
+
+class ChannelLatency(object):
+    """
+    Latency histograms of a channel, in nanoseconds.
+
+    - ``parse``: from receiving a frame to having loaded its event
+    - ``queue``: from loading an event to the channel dispatching it, including any conflation delay
+    - ``dispatch``: calling the channel's listeners with an event
+    - ``exchange``: from the timestamp in the event data to receiving the frame, only if ``timestamp_field`` is set
+
+    Events that weren't stamped on receipt, see :meth:`twistedpusher.events.Event.stamp`, only count towards
+    ``dispatch``.
+    """
+    def __init__(self, timestamp_field=None):
+        """
+        :param timestamp_field: name of a field of the event data holding the time the exchange sent the event
+        :type timestamp_field: str or None
+        """
+        self.timestamp_field = timestamp_field
+        self.parse = LatencyHistogram()
+        self.queue = LatencyHistogram()
+        self.dispatch = LatencyHistogram()
+        self.exchange = LatencyHistogram()
+
+    def record(self, event, dispatch_start, dispatch_end):
+        """
+        Record the timings of a dispatched event.
+
+        :type event: twistedpusher.events.Event
+        :param dispatch_start: ``monotonic_ns()`` before calling the listeners
+        :param dispatch_end: ``monotonic_ns()`` after calling the listeners
+        """
+        self.dispatch.record(dispatch_end - dispatch_start)
+        if not isinstance(event, Event) or event.received_ns is None:
+            return
+        received = event.received_ns
+        self.parse.record(event.parsed_ns - received)
+        self.queue.record(dispatch_start - event.parsed_ns)
+        if self.timestamp_field is not None:
+            data = event.get('data')
+            try:
+                sent = timestamp_to_seconds(data[self.timestamp_field])
+            except (KeyError, TypeError, ValueError):
+                return
+            # wall clock time of receipt, since received_ns is on the monotonic clock
+            received_at = time.time() - (monotonic_ns() - received) / 1e9
+            self.exchange.record((received_at - sent) * 1e9)
+
+    def reset(self):
+        for histogram in (self.parse, self.queue, self.dispatch, self.exchange):
+            histogram.reset()
+
+    def snapshot(self):
+        """
+        :returns: ``parse``, ``queue``, ``dispatch`` and ``exchange`` histogram snapshots
+        :rtype: dict
+        """
+        return {'parse': self.parse.snapshot(),
+                'queue': self.queue.snapshot(),
+                'dispatch': self.dispatch.snapshot(),
+                'exchange': self.exchange.snapshot()}
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- test-case-name: twistedpusher.test.test_metrics -*-
+
+import logging
+from twisted.web.resource import Resource
+
+log = logging.getLogger(__name__)
+
+# Content-Type of the Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if value == float('-inf'):
+        return '-Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Metric(object):
+    """
+    A named metric, with one value per combination of label values.
+
+    :ivar values: value of each series, keyed by the tuple of its label values
+    :type values: dict
+    """
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labels=()):
+        """
+        :param name: the metric's name, e.g. ``pusher_frames_received_total``
+        :type name: str
+        :param documentation: the help line
+        :type documentation: str
+        :param labels: names of the labels
+        :type labels: tuple
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = dict()
+
+    def value(self, labels=()):
+        """Get the value of a series, 0 if never set."""
+        return self.values.get(labels, 0)
+
+    def render(self):
+        """
+        Get the metric in the Prometheus text format.
+
+        :rtype: list
+        :returns: lines
+        """
+        lines = ['# HELP {0} {1}'.format(self.name, self.documentation.replace('\\', '\\\\').replace('\n', '\\n')),
+                 '# TYPE {0} {1}'.format(self.name, self.type)]
+        for label_values, value in sorted(self.values.items()):
+            if label_values:
+                labels = ','.join('{0}="{1}"'.format(name, _escape_label(u'{0}'.format(label_value)))
+                                  for name, label_value in zip(self.labels, label_values))
+                lines.append(u'{0}{{{1}}} {2}'.format(self.name, labels, _format_value(value)))
+            else:
+                lines.append('{0} {1}'.format(self.name, _format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+    """Metric that only goes up."""
+    type = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        """
+        :param amount: non-negative amount to add
+        :param labels: the series' label values
+        :type labels: tuple
+        """
+        values = self.values
+        values[labels] = values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """Metric that can go up and down."""
+    type = 'gauge'
+
+    def set(self, value, labels=()):
+        self.values[labels] = value
+
+    def inc(self, amount=1, labels=()):
+        values = self.values
+        values[labels] = values.get(labels, 0) + amount
+
+    def dec(self, amount=1, labels=()):
+        self.inc(-amount, labels)
+
+
+class PusherMetrics(object):
+    """
+    Counters and gauges of Pusher connections, exported in the Prometheus text format.
+
+    Updated by the websocket protocol for every frame, by transports on state changes and by connections on
+    Pusher errors. An update is a dict increment, cheap enough to leave on at full message rate. One instance can
+    be shared by several services, e.g. the shards of a ShardedPusherService, to report their totals.
+
+    Counters and gauges are the attributes named as the metrics without the prefix, e.g. ``frames_received``.
+    """
+    def __init__(self, prefix='pusher'):
+        """
+        :param prefix: prefix of the metric names
+        :type prefix: str
+        """
+        def name(suffix):
+            return '{0}_{1}'.format(prefix, suffix)
+
+        self.frames_received = Counter(name('frames_received_total'), 'Websocket frames received.')
+        self.bytes_received = Counter(name('received_bytes_total'), 'Websocket payload bytes received.')
+        self.frames_dropped = Counter(name('frames_dropped_total'),
+                                      'Frames dropped unparsed because their channel is not subscribed.')
+        self.parse_errors = Counter(name('parse_errors_total'), 'Frames that could not be loaded as Pusher events.')
+        self.frames_sent = Counter(name('frames_sent_total'), 'Websocket frames sent.')
+        self.channel_events = Counter(name('channel_events_total'), 'Channel events received, by channel.',
+                                      ('channel',))
+        self.errors = Counter(name('errors_total'), 'pusher:error events received, by error code.', ('code',))
+        self.connection_attempts = Counter(name('connection_attempts_total'), 'Connection attempts.')
+        self.connection_failures = Counter(name('connection_failures_total'), 'Failed connection attempts.')
+        self.connections = Counter(name('connections_total'), 'Connections established.')
+        self.reconnects = Counter(name('reconnects_total'), 'Connections re-established after the first.')
+        self.disconnections = Counter(name('disconnections_total'), 'Established connections lost or closed.')
+        self.transports = Gauge(name('transports'), 'Transports in each state.', ('state',))
+        self.state_seconds = Counter(name('transport_state_seconds_total'),
+                                     'Seconds transports spent in each state they left.', ('state',))
+
+        self.metrics = [self.frames_received, self.bytes_received, self.frames_dropped, self.parse_errors,
+                        self.frames_sent, self.channel_events, self.errors, self.connection_attempts,
+                        self.connection_failures, self.connections, self.reconnects, self.disconnections,
+                        self.transports, self.state_seconds]
+
+    def frame_received(self, size, channel=None):
+        """
+        Count a received frame, in one call as this runs for every frame.
+
+        :param size: payload length
+        :type size: int
+        :param channel: the channel of a channel event that was loaded
+        """
+        values = self.frames_received.values
+        values[()] = values.get((), 0) + 1
+        values = self.bytes_received.values
+        values[()] = values.get((), 0) + size
+        if channel is not None:
+            values = self.channel_events.values
+            key = (channel,)
+            values[key] = values.get(key, 0) + 1
+
+    def transport_state_changed(self, old_state, new_state, duration):
+        """
+        Record a transport leaving a state.
+
+        :param old_state: the state left, or None for a new transport
+        :param new_state: the state entered, or None for a transport going away
+        :param duration: seconds spent in the state left
+        :type duration: float
+        """
+        if old_state is not None:
+            self.transports.dec(1, (old_state,))
+            self.state_seconds.inc(duration, (old_state,))
+        if new_state is not None:
+            self.transports.inc(1, (new_state,))
+
+    def render(self):
+        """
+        Get every metric in the Prometheus text format.
+
+        :rtype: unicode
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        lines.append(u'')
+        return u'\n'.join(lines)
+
+
+class MetricsResource(Resource):
+    """
+    ``twisted.web`` resource serving metrics to Prometheus.
+
+    For example::
+
+        metrics = PusherMetrics()
+        client = PusherService('key', metrics=metrics)
+        reactor.listenTCP(9100, Site(MetricsResource(metrics)))
+    """
+    isLeaf = True
+
+    def __init__(self, metrics):
+        """
+        :type metrics: PusherMetrics
+        """
+        Resource.__init__(self)
+        self.metrics = metrics
+
+    def render_GET(self, request):
+        request.setHeader(b'Content-Type', CONTENT_TYPE.encode('ascii'))
+        return self.metrics.render().encode('utf8')
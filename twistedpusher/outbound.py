@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# -*- test-case-name: twistedpusher.test.test_outbound -*-
+
+import logging
+from collections import deque, OrderedDict
+
+from twistedpusher.errors import ConnectionError
+
+log = logging.getLogger(__name__)
+
+# Pusher closes connections sending more than 10 client events per second with error 4301
+CLIENT_EVENT_RATE = 10
+# most frames written in one reactor turn
+FRAMES_PER_TURN = 100
+# control frames meaningful only on the connection they were meant for
+CONNECTION_FRAMES = ('pusher:ping', 'pusher:pong')
+SUBSCRIPTION_FRAMES = ('pusher:subscribe', 'pusher:unsubscribe')
+
+
+class TokenBucket(object):
+    """
+    Token bucket refilled at ``rate`` tokens per second, holding up to ``burst`` tokens. It starts full.
+    """
+    def __init__(self, rate, burst, reactor=None):
+        """
+        :param rate: tokens added per second
+        :type rate: int or float
+        :param burst: capacity of the bucket
+        :type burst: int
+        :param reactor: :class:`IReactorTime` provider, defaults to :class:`twisted.internet.reactor`
+
+        :raises ValueError: if rate is not positive or burst is below 1
+        """
+        if rate <= 0 or burst < 1:
+            raise ValueError("Token bucket needs a positive rate and a burst of at least 1")
+        if not reactor:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = reactor.seconds()
+
+    def _refill(self):
+        now = self.reactor.seconds()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def tokens(self):
+        """Number of whole tokens available."""
+        self._refill()
+        return int(self._tokens)
+
+    def consume(self, count=1):
+        """
+        Take tokens if there are enough.
+
+        :rtype: bool
+        :returns: whether they were taken
+        """
+        self._refill()
+        if self._tokens >= count:
+            self._tokens -= count
+            return True
+        return False
+
+    def delay(self, count=1):
+        """Get the seconds until ``count`` tokens are available."""
+        self._refill()
+        return max(0.0, (count - self._tokens) / self.rate)
+
+
+class SendQueue(object):
+    """
+    Outbound frames of a connection, rate limited and buffered while reconnecting.
+
+    Client events, those named ``client-*``, take a token from a :class:`TokenBucket` each, so bursts are spread
+    out below Pusher's client event limit instead of getting the connection closed. Other frames are never
+    delayed by the bucket. Frames are sent straight away while connected and nothing is waiting, otherwise they
+    are queued and written in batches of up to ``frames_per_turn`` frames, one batch per reactor turn.
+
+    While the connection is connecting or unavailable, up to ``max_buffered`` client events, counting those held for
+    a subscription, are kept for when it is connected again, the oldest being dropped beyond that. Queued control frames are coalesced: only the
+    latest subscribe or unsubscribe of a channel is kept, and pings and pongs are dropped when the connection is
+    lost since they only make sense on the connection they were meant for.
+
+    With ``subscriptions`` set, client events for a channel whose subscription is not acknowledged yet, e.g.
+    private channels being authorized again after a reconnect, are held until it is, and dropped if it fails.
+
+    :ivar dropped: number of client events dropped because the buffer was full or their subscription failed
+    :type dropped: int
+
+    :ivar subscriptions: the connection's ``SubscriptionManager``, or None not to wait for subscriptions
+    :type subscriptions: twistedpusher.subscriptions.SubscriptionManager
+    """
+    def __init__(self, connection, transport, rate=CLIENT_EVENT_RATE, burst=CLIENT_EVENT_RATE, max_buffered=1000,
+                 frames_per_turn=FRAMES_PER_TURN, reactor=None):
+        """
+        :param connection: the IPusherConnection whose state decides whether to send, buffer or refuse frames
+        :param transport: the IPusherTransport to send with
+        :param rate: client events per second, or None not to limit them
+        :type rate: int or float or None
+        :param burst: client events that can be sent at once after being idle
+        :type burst: int
+        :param max_buffered: most client events kept waiting
+        :type max_buffered: int
+        :param frames_per_turn: most frames written in one reactor turn
+        :type frames_per_turn: int
+        :param reactor: :class:`IReactorTime` provider, defaults to :class:`twisted.internet.reactor`
+        """
+        if not reactor:
+            from twisted.internet import reactor
+        self.connection = connection
+        self.transport = transport
+        self.reactor = reactor
+        self.bucket = TokenBucket(rate, burst, reactor) if rate else None
+        self.max_buffered = max_buffered
+        self.frames_per_turn = frames_per_turn
+        self.dropped = 0
+        self.subscriptions = None
+
+        # coalescing key -> control frame
+        self._control = OrderedDict()
+        self._client = deque()
+        # channel name -> client events waiting for the channel's subscription, in order
+        self._held = OrderedDict()
+        self._held_count = 0
+        self._flush_call = None
+
+        connection.bind('connected', self._on_connected)
+        for state in ('connecting', 'unavailable'):
+            connection.bind(state, self._on_interrupted)
+        connection.bind('disconnected', self._on_disconnected)
+
+    def __len__(self):
+        return len(self._control) + len(self._client) + self._held_count
+
+    def send(self, events, batch=True):
+        """
+        Send events, or queue them to be sent.
+
+        :param events: the events to send, in order
+        :type events: list
+        :param batch: write with the transport's ``send_events`` even a single event sent straight away
+        :type batch: bool
+
+        :raises ConnectionError: if the connection was never started or was stopped
+        """
+        state = self.connection.state
+        if state in ('initialized', 'disconnected'):
+            raise ConnectionError("Attempted to send {0} events while disconnected".format(len(events)))
+        if state == 'connected' and not self:
+            events = self._send_now(events, batch)
+            if not events:
+                return
+        for event in events:
+            self._queue(event, state == 'connected')
+        if state == 'connected':
+            self._schedule_flush()
+
+    def _is_client_event(self, event):
+        return event.name.startswith('client-')
+
+    def _must_hold(self, event):
+        """Whether a client event has to wait for its channel's subscription."""
+        if self.subscriptions is None:
+            return False
+        channel = getattr(event, 'channel', None)
+        return channel in self._held or self.subscriptions.is_pending(channel)
+
+    def _hold(self, event):
+        channel = event.channel
+        if channel not in self._held:
+            self._held[channel] = []
+            d = self.subscriptions.when_subscribed(channel)
+            d.addCallbacks(self._release, self._discard_held, callbackArgs=(channel,), errbackArgs=(channel,))
+        self._held[channel].append(event)
+        self._held_count += 1
+
+    def _release(self, _, channel):
+        """Put the events held for a subscribed channel back in front of the queue."""
+        events = self._held.pop(channel, None)
+        if events:
+            self._held_count -= len(events)
+            self._client.extendleft(reversed(events))
+            self._schedule_flush()
+
+    def _discard_held(self, failure, channel):
+        events = self._held.pop(channel, None)
+        if events:
+            self._held_count -= len(events)
+            self.dropped += len(events)
+            log.warning("Dropped {0} client events for {1}, its subscription failed: {2}".format(
+                len(events), channel, failure.getErrorMessage()))
+
+    def _send_now(self, events, batch):
+        """Send what can be sent straight away, in order. Returns the rest."""
+        count = 0
+        for event in events:
+            if self._is_client_event(event) and (self._must_hold(event) or
+                                                 self.bucket is not None and not self.bucket.consume()):
+                break
+            count += 1
+        if count == 1 and not batch:
+            self.transport.send_event(events[0])
+        elif count:
+            self.transport.send_events(events[:count])
+        return events[count:]
+
+    def _queue(self, event, connected):
+        if not self._is_client_event(event):
+            name = event.name
+            if name in CONNECTION_FRAMES and not connected:
+                return
+            if name in SUBSCRIPTION_FRAMES:
+                key = ('subscription', event.data.get('channel'))
+            else:
+                key = (name, getattr(event, 'channel', None))
+            # the latest frame wins and is sent after those queued before it
+            self._control.pop(key, None)
+            self._control[key] = event
+            return
+        if len(self._client) + self._held_count >= self.max_buffered:
+            self._drop_oldest()
+        self._client.append(event)
+
+    def _drop_oldest(self):
+        """Make room for a client event, dropping the oldest one."""
+        if self._held_count:
+            # held events were taken from the front of the queue, the channel stays held for its later ones
+            events = next(events for events in self._held.values() if events)
+            events.pop(0)
+            self._held_count -= 1
+        else:
+            self._client.popleft()
+        self.dropped += 1
+        if self.dropped == 1 or not self.dropped % 100:
+            log.warning("Send buffer full, dropped {0} client events so far.".format(self.dropped))
+
+    def _schedule_flush(self, delay=0):
+        if self._flush_call is None:
+            self._flush_call = self.reactor.callLater(delay, self._flush)
+        elif self._flush_call.getTime() > self.reactor.seconds() + delay:
+            # e.g. a control frame queued while client events wait for tokens
+            self._flush_call.reset(delay)
+
+    def _cancel_flush(self):
+        if self._flush_call is not None:
+            if self._flush_call.active():
+                self._flush_call.cancel()
+            self._flush_call = None
+
+    def _flush(self):
+        """Write a batch of queued frames: control frames first, then client events the bucket allows."""
+        self._flush_call = None
+        if self.connection.state != 'connected':
+            return
+        batch = []
+        while self._control and len(batch) < self.frames_per_turn:
+            batch.append(self._control.popitem(last=False)[1])
+        while self._client and len(batch) < self.frames_per_turn:
+            if self._must_hold(self._client[0]):
+                self._hold(self._client.popleft())
+                continue
+            if self.bucket is not None and not self.bucket.consume():
+                break
+            batch.append(self._client.popleft())
+        if batch:
+            self.transport.send_events(batch)
+        if self._control or (self._client and len(batch) >= self.frames_per_turn):
+            self._schedule_flush()
+        elif self._client:
+            self._schedule_flush(self.bucket.delay())
+
+    def _on_connected(self, _):
+        if self:
+            # after the connection's other listeners, whose frames are coalesced with the queued ones
+            self._schedule_flush()
+
+    def _on_interrupted(self, _):
+        self._cancel_flush()
+        for key in [key for key in self._control if key[0] in CONNECTION_FRAMES]:
+            del self._control[key]
+
+    def _on_disconnected(self, _):
+        """The connection was stopped, nothing queued will be sent."""
+        self._cancel_flush()
+        if self:
+            log.info("Discarding {0} queued frames, the connection was stopped.".format(len(self)))
+        self._control.clear()
+        self._client.clear()
+        self._held.clear()
+        self._held_count = 0
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- test-case-name: twistedpusher.test.test_presence -*-
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class MemberStore(object):
+    """
+    Members of a presence channel, indexed by user ID.
+
+    Adding, removing and looking up a member are dict operations, so applying the ``member_added`` and
+    ``member_removed`` stream of a large room costs the same per event whatever its size. The store is a read-only
+    mapping of user IDs to ``user_info``.
+
+    Memory can be bounded two ways. With ``store_info`` off only the user IDs are kept, ``user_info`` reads as
+    None. With ``max_members``, members beyond the limit are only counted: ``count`` stays right but they can't be
+    looked up, and ``complete`` is False while there are any. Which members a removal applies to can't be known
+    for those, so freed places are left empty until the next ``load``.
+
+    :ivar overflow: number of members counted but not stored
+    :type overflow: int
+    """
+    __slots__ = ('max_members', 'store_info', 'overflow', '_members')
+
+    def __init__(self, max_members=None, store_info=True):
+        """
+        :param max_members: most members stored, or None for no limit
+        :type max_members: int or None
+        :param store_info: whether to keep the members' ``user_info``
+        :type store_info: bool
+
+        :raises ValueError: if max_members is below 1
+        """
+        if max_members is not None and max_members < 1:
+            raise ValueError("max_members must be at least 1")
+        self.max_members = max_members
+        self.store_info = store_info
+        self.overflow = 0
+        self._members = dict()
+
+    def __len__(self):
+        return len(self._members)
+
+    def __contains__(self, user_id):
+        return user_id in self._members
+
+    def __iter__(self):
+        return iter(self._members)
+
+    def __getitem__(self, user_id):
+        return self._members[user_id]
+
+    def get(self, user_id, default=None):
+        return self._members.get(user_id, default)
+
+    def keys(self):
+        return list(self._members)
+
+    def items(self):
+        return list(self._members.items())
+
+    @property
+    def count(self):
+        """Number of members, including those not stored."""
+        return len(self._members) + self.overflow
+
+    @property
+    def complete(self):
+        """Whether every member is stored."""
+        return not self.overflow
+
+    def add(self, user_id, user_info=None):
+        """
+        Add a member, or update its ``user_info``.
+
+        :returns: whether the member is new
+        :rtype: bool
+        """
+        members = self._members
+        if user_id not in members:
+            if self.max_members is not None and len(members) >= self.max_members:
+                self.overflow += 1
+                return True
+            members[user_id] = user_info if self.store_info else None
+            return True
+        if self.store_info:
+            members[user_id] = user_info
+        return False
+
+    def remove(self, user_id):
+        """
+        Remove a member.
+
+        :returns: whether the member was known, stored or counted
+        :rtype: bool
+        """
+        try:
+            del self._members[user_id]
+        except KeyError:
+            if not self.overflow:
+                return False
+            # presumably one of those only counted
+            self.overflow -= 1
+        return True
+
+    def load(self, presence):
+        """
+        Replace the members with those of a ``subscription_succeeded`` event.
+
+        :param presence: the event's ``presence`` data, with the ``hash`` of members and their ``count``
+        :type presence: dict
+
+        :returns: the members that joined, as a dict of ``user_info``, and the IDs of those that left, compared
+            with the members stored until then
+        :rtype: tuple
+        """
+        new = presence.get('hash') or dict()
+        old = self._members
+        removed = [user_id for user_id in old if user_id not in new]
+        added = dict((user_id, info) for user_id, info in new.items() if user_id not in old)
+
+        self._members = dict()
+        self.overflow = 0
+        for user_id, info in new.items():
+            self.add(user_id, info)
+        # the count also covers members missing from the hash
+        self.overflow += max(0, presence.get('count', len(new)) - len(new))
+        return added, removed
+
+    def clear(self):
+        self._members.clear()
+        self.overflow = 0
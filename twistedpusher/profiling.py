@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- test-case-name: twistedpusher.test.test_profiling -*-
+
+import logging
+from zope.interface import implementer
+
+from twistedpusher.events import listener_name
+from twistedpusher.interfaces import IListenerProfiler
+from twistedpusher.utils import monotonic_ns, cpu_time_ns
+
+log = logging.getLogger(__name__)
+
+# ``ListenerProfiler.top`` orderings
+SORT_KEYS = ('wall_total_ns', 'wall_max_ns', 'cpu_total_ns', 'cpu_max_ns', 'wall_mean_ns', 'calls')
+# key of the calls of listeners and event names recorded after ``ListenerProfiler.max_entries`` others
+OTHERS = '<others>'
+
+
+class CallStats(object):
+    """Wall clock and CPU time of the sampled calls of a listener or event name."""
+    __slots__ = ('calls', 'wall_total_ns', 'wall_max_ns', 'cpu_total_ns', 'cpu_max_ns')
+
+    def __init__(self):
+        self.calls = 0
+        self.wall_total_ns = 0
+        self.wall_max_ns = 0
+        self.cpu_total_ns = 0
+        self.cpu_max_ns = 0
+
+    def record(self, wall, cpu):
+        self.calls += 1
+        self.wall_total_ns += wall
+        self.cpu_total_ns += cpu
+        if wall > self.wall_max_ns:
+            self.wall_max_ns = wall
+        if cpu > self.cpu_max_ns:
+            self.cpu_max_ns = cpu
+
+    def snapshot(self):
+        """
+        :returns: ``calls``, the totals and maximums, and ``wall_mean_ns``, in nanoseconds
+        :rtype: dict
+        """
+        return {'calls': self.calls,
+                'wall_total_ns': self.wall_total_ns,
+                'wall_max_ns': self.wall_max_ns,
+                'wall_mean_ns': self.wall_total_ns // self.calls if self.calls else 0,
+                'cpu_total_ns': self.cpu_total_ns,
+                'cpu_max_ns': self.cpu_max_ns}
+
+
+@implementer(IListenerProfiler)
+class ListenerProfiler(object):
+    """
+    Records the wall clock and CPU time of listener calls, per listener and per event name.
+
+    Install it on an emitter, or on :class:`~twistedpusher.events.EventEmitter` to profile every emitter:
+
+    >>> profiler = ListenerProfiler(sample_every=100)
+    >>> EventEmitter.profiler = profiler
+    >>> profiler.top(5)
+
+    Only one call in ``sample_every`` is timed, the others only pay for a counter. CPU time is the thread's where
+    the platform has a thread clock and the process' otherwise, so other threads can inflate it.
+
+    Listeners are recorded by qualified name, so that profiling keeps no listener alive and those created anew for
+    each channel add up. At most ``max_entries`` listeners and event names are recorded separately, later ones
+    are summed under ``OTHERS``.
+
+    :ivar listeners: :class:`CallStats` of each listener called, by qualified name
+    :type listeners: dict
+    :ivar events: :class:`CallStats` of each event name, summed over its listeners
+    :type events: dict
+    """
+    def __init__(self, sample_every=1, max_entries=1000):
+        """
+        :param sample_every: time one listener call in this many
+        :type sample_every: int
+        :param max_entries: most listeners, and most event names, recorded separately
+        :type max_entries: int
+
+        :raises ValueError: if sample_every is below 1
+        """
+        if sample_every < 1:
+            raise ValueError("sample_every must be at least 1")
+        self.sample_every = sample_every
+        self.max_entries = max_entries
+        self.listeners = dict()
+        self.events = dict()
+        self._until_sample = 1
+
+    def call(self, emitter, listener, event):
+        self._until_sample -= 1
+        if self._until_sample:
+            return listener(event)
+        self._until_sample = self.sample_every
+
+        wall_start = monotonic_ns()
+        cpu_start = cpu_time_ns()
+        try:
+            return listener(event)
+        finally:
+            cpu = cpu_time_ns() - cpu_start
+            wall = monotonic_ns() - wall_start
+            self._stats(self.listeners, listener_name(listener)).record(wall, cpu)
+            self._stats(self.events, event.name).record(wall, cpu)
+
+    def _stats(self, table, key):
+        stats = table.get(key)
+        if stats is None:
+            if len(table) >= self.max_entries:
+                key = OTHERS
+                stats = table.get(key)
+            if stats is None:
+                stats = table[key] = CallStats()
+        return stats
+
+    def top(self, n=10, by='wall_total_ns'):
+        """
+        Get the slowest listeners.
+
+        :param n: number of listeners
+        :type n: int
+        :param by: one of ``SORT_KEYS``
+        :type by: str
+
+        :returns: the ``CallStats.snapshot`` of each listener with its qualified name as ``listener``, slowest
+            first
+        :rtype: list
+
+        :raises ValueError: if ``by`` is unknown
+        """
+        return self._top(self.listeners, 'listener', n, by)
+
+    def top_events(self, n=10, by='wall_total_ns'):
+        """
+        Get the event names whose listeners took the longest, see :meth:`top`.
+
+        :returns: the ``CallStats.snapshot`` of each event name with the name as ``event``, slowest first
+        :rtype: list
+        """
+        return self._top(self.events, 'event', n, by)
+
+    @staticmethod
+    def _top(stats, field, n, by):
+        if by not in SORT_KEYS:
+            raise ValueError("Unknown sort key '{0}'".format(by))
+        snapshots = []
+        for key, call_stats in list(stats.items()):
+            snapshot = call_stats.snapshot()
+            snapshot[field] = key
+            snapshots.append(snapshot)
+        snapshots.sort(key=lambda snapshot: snapshot[by], reverse=True)
+        return snapshots[:n]
+
+    def reset(self):
+        """Forget everything recorded."""
+        self.listeners.clear()
+        self.events.clear()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- test-case-name: twistedpusher.test.test_redundancy -*-
+
+import logging
+import warnings
+from twisted.application.service import MultiService
+
+from twistedpusher import channel
+from twistedpusher.client import PusherService
+from twistedpusher.dedup import DeduplicationWindow, event_fingerprint
+from twistedpusher.errors import ConnectionError
+from twistedpusher.events import Event, EventEmitter
+
+log = logging.getLogger(__name__)
+
+# Replica channels rename these events in place when handling them, Pusher sends them with the internal names.
+WIRE_NAMES = {
+    'pusher:subscription_succeeded': 'pusher_internal:subscription_succeeded',
+    'pusher:member_added': 'pusher_internal:member_added',
+    'pusher:member_removed': 'pusher_internal:member_removed',
+}
+
+
+class RedundantPusherService(MultiService, EventEmitter):
+    """
+    Pusher client service keeping several connections subscribed to the same channels.
+
+    Each replica is a :class:`~twistedpusher.client.PusherService` with its own websocket. Events are merged and
+    the first copy to arrive wins, so a replica reconnecting doesn't interrupt the channels, and every event takes
+    the fastest connection's route. Duplicates are recognized with a :class:`DeduplicationWindow` of fingerprints.
+
+    Channels returned by ``subscribe`` receive the merged events, replicas keep their own channels internally.
+
+    :ivar replicas: the PusherService of each connection
+    :type replicas: list
+
+    :ivar channels: all subscribed channels, keyed by name
+    :type channels: dict
+
+    :ivar window: the deduplication window
+    :type window: DeduplicationWindow
+    """
+    service_class = PusherService
+
+    def __init__(self, key, replicas=2, window_size=10000, encrypted=True, endpoint_string=None, reactor=None,
+                 **kwargs):
+        """
+        :param key: key for the Pusher application to connect to
+        :type key: str
+
+        :param replicas: number of connections to keep
+        :type replicas: int
+
+        :param window_size: number of recent events remembered to recognize duplicates. Should cover the events
+            received during the largest lag between connections.
+        :type window_size: int
+
+        :param encrypted: whether to use secure websockets
+        :type encrypted: bool
+
+        :param endpoint_string: a string to build each connection's endpoint with, using clientFromString
+        :type endpoint_string: str
+
+        :param reactor: optional Twisted reactor
+
+        :raises ValueError: if there are fewer than one replica
+        """
+        if replicas < 1:
+            raise ValueError("Need at least one replica")
+
+        MultiService.__init__(self)
+        EventEmitter.__init__(self)
+
+        self.key = key
+
+        if not reactor:
+            from twisted.internet import reactor
+        self.reactor = reactor
+
+        self.replicas = []
+        for index in range(replicas):
+            replica = self.service_class(key, encrypted, endpoint_string, reactor=reactor, **kwargs)
+            replica.bind_all(lambda event, index=index: self._on_replica_event(event, index))
+            self.addService(replica)
+            self.replicas.append(replica)
+
+        self.window = DeduplicationWindow(replicas, window_size)
+        self.channels = dict()
+
+    @property
+    def connections(self):
+        """The connection of each replica."""
+        return [replica.connection for replica in self.replicas]
+
+    @property
+    def duplicates(self):
+        """Number of events dropped as copies of an event received earlier."""
+        return self.window.duplicates
+
+    def subscribe(self, channel_name, **kwargs):
+        """
+        Subscribe to a channel on every connection.
+
+        :param channel_name: the channel's name
+        :type channel_name: str or unicode
+
+        :param kwargs: passed to the merged channel, see ``PusherService.subscribe``
+
+        :return: the channel receiving the merged events
+        :rtype: twistedpusher.Channel
+
+        :raises BadChannelNameError: if channel_name is not a valid Pusher channel name
+        """
+        if channel_name in self.channels:
+            warnings.warn("Already subscribed to channel {0}".format(channel_name))
+            return self.channels[channel_name]
+
+        kwargs.setdefault('reactor', self.reactor)
+        # the merged channel only dispatches, subscribing is done by the replicas' channels
+        chan = channel.buildChannel(channel_name, self, **kwargs)
+        for replica in self.replicas:
+            # data is left encoded so copies are compared on the raw payload, the merged channel decodes it
+            replica.subscribe(channel_name, track_latency=False)
+        self.channels[channel_name] = chan
+        return chan
+
+    def unsubscribe(self, channel_name):
+        """
+        Unsubscribe from a channel on every connection.
+
+        :param channel_name: the channel's name
+        :type channel_name: str
+        """
+        if channel_name in self.channels:
+            for replica in self.replicas:
+                replica.unsubscribe(channel_name)
+            self.channels.pop(channel_name)
+        else:
+            warnings.warn("Attempted to unsubscribe from channel {0} when not subscribed".format(channel_name))
+
+    def channel(self, channel_name):
+        """
+        Get a channel by name.
+
+        :type channel_name: str
+
+        :return: the requested channel, if found
+        :rtype: twistedpusher.Channel
+
+        :raises ValueError: if the channel is not found (i.e. subscribed to)
+        """
+        try:
+            return self.channels[channel_name]
+        except KeyError:
+            raise ValueError("Channel not found: '{0}'.".format(channel_name))
+
+    def send_event(self, event):
+        """
+        Send an event on the first connected replica.
+
+        :type event: twistedpusher.events.Event
+
+        :raises ConnectionError: if no replica is connected
+        """
+        for connection in self.connections:
+            if connection.state == 'connected':
+                return connection.send_event(event)
+        raise ConnectionError("Attempted to send an event while disconnected: {0}".format(event))
+
+    def latency_stats(self):
+        """
+        Get the latency histograms of every subscribed channel, see ``Channel.latency_stats``.
+
+        :rtype: dict
+        """
+        return dict((name, chan.latency_stats()) for name, chan in self.channels.items())
+
+    def _on_replica_event(self, event, replica):
+        """
+        Internal events already handled and renamed by a replica channel are passed on under their original name,
+        so the merged channel handles them too, e.g. to track presence members.
+
+        :type event: events.Event
+        :param replica: index of the replica the event arrived on
+        """
+        try:
+            chan = self.channels[event.channel]
+        except (KeyError, AttributeError):
+            return
+        wire_name = WIRE_NAMES.get(event.name)
+        if wire_name is not None:
+            # the replica's own listeners keep the renamed event
+            event = Event(name=wire_name, channel=event.channel, data=event.data)
+        if self.window.is_new(event_fingerprint(event), replica):
+            chan.emit_event(event)
+            self.emit_event(event)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- test-case-name: twistedpusher.test.test_registry -*-
+
+import logging
+
+log = logging.getLogger(__name__)
+
+SUBSCRIPTION_SUCCEEDED = 'pusher_internal:subscription_succeeded'
+
+
+class ChannelRegistry(object):
+    """
+    Owns the subscribed channels of a connection, from subscribing to unsubscribing.
+
+    Adding and removing a channel are O(1) and leave nothing behind: the channel is dropped from the channel map, the
+    set of channels whose data is decoded while loading, and the subscription manager. Nothing is bound to the
+    connection per channel, subscription acknowledgements are routed here with the channel's events.
+
+    :ivar channels: subscribed channels, keyed by name
+    :type channels: dict
+    """
+    def __init__(self, subscriptions, json_data_channels):
+        """
+        :param subscriptions: manager (re)subscribing the channels
+        :type subscriptions: twistedpusher.subscriptions.SubscriptionManager
+        :param json_data_channels: set of channel names the protocol decodes event data for while loading events
+        :type json_data_channels: set
+        """
+        self.subscriptions = subscriptions
+        self.json_data_channels = json_data_channels
+        self.channels = dict()
+
+    def __contains__(self, channel_name):
+        return channel_name in self.channels
+
+    def __len__(self):
+        return len(self.channels)
+
+    def __iter__(self):
+        return iter(self.channels)
+
+    def add(self, chan, json_data=False):
+        """
+        Register and subscribe a channel.
+
+        :type chan: twistedpusher.Channel
+        :param json_data: decode the channel's event data while loading events
+        :type json_data: bool
+        """
+        self.channels[chan.name] = chan
+        if json_data:
+            self.json_data_channels.add(chan.name)
+        self.subscriptions.add(chan)
+
+    def remove(self, channel_name):
+        """
+        Forget a channel.
+
+        :type channel_name: str or unicode
+
+        :returns: the channel
+        :rtype: twistedpusher.Channel
+
+        :raises KeyError: if the channel is not registered
+        """
+        chan = self.channels.pop(channel_name)
+        self.json_data_channels.discard(channel_name)
+        self.subscriptions.remove(channel_name)
+        return chan
+
+    def dispatch(self, event):
+        """
+        Emit a channel event on its channel.
+
+        :type event: twistedpusher.events.Event
+
+        :returns: the channel, or None if the event is for a channel that isn't registered
+        """
+        try:
+            chan = self.channels[event.channel]
+        except (KeyError, AttributeError):
+            return None
+        acknowledged = event.name == SUBSCRIPTION_SUCCEEDED
+        chan.emit_event(event)
+        if acknowledged:
+            self.subscriptions.acknowledge(chan.name)
+        return chan
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- test-case-name: twistedpusher.test.test_sharding -*-
+
+import logging
+import warnings
+import zlib
+from twisted.application.service import MultiService
+
+from twistedpusher.client import PusherService
+from twistedpusher.events import EventEmitter
+
+log = logging.getLogger(__name__)
+
+# how ShardedPusherService picks the connection for a new channel
+ASSIGNMENT_POLICIES = ('hash', 'least-loaded')
+
+
+class ShardedPusherService(MultiService, EventEmitter):
+    """
+    Pusher client service spreading channels over several connections.
+
+    Each shard is a :class:`~twistedpusher.client.PusherService` with its own websocket, so a busy or stalled
+    connection only delays the channels assigned to it. Channel events of every shard are emitted by this service,
+    so ``bind_all`` works as with a single PusherService.
+
+    =============  =============================================================
+    Assignment     Shard of a new channel
+    =============  =============================================================
+    hash           CRC32 of the channel name, the same on every Python version for a given number of shards
+    least-loaded   the shard with the fewest channels at subscription time
+    =============  =============================================================
+
+    :ivar shards: the PusherService of each connection
+    :type shards: list
+
+    :ivar channels: all subscribed channels, keyed by name
+    :type channels: dict
+    """
+    service_class = PusherService
+
+    def __init__(self, key, shards=2, assignment='hash', encrypted=True, endpoint_string=None, reactor=None,
+                 **kwargs):
+        """
+        :param key: key for the Pusher application to connect to
+        :type key: str
+
+        :param shards: number of connections to open
+        :type shards: int
+
+        :param assignment: one of ``ASSIGNMENT_POLICIES``
+        :type assignment: str
+
+        :param encrypted: whether to use secure websockets
+        :type encrypted: bool
+
+        :param endpoint_string: a string to build each connection's endpoint with, using clientFromString
+        :type endpoint_string: str
+
+        :param reactor: optional Twisted reactor
+
+        :raises ValueError: if there are fewer than one shard or the assignment policy is unknown
+        """
+        if shards < 1:
+            raise ValueError("Need at least one shard")
+        if assignment not in ASSIGNMENT_POLICIES:
+            raise ValueError("Unknown assignment policy '{0}'".format(assignment))
+
+        MultiService.__init__(self)
+        EventEmitter.__init__(self)
+
+        self.key = key
+        self.assignment = assignment
+
+        if not reactor:
+            from twisted.internet import reactor
+        self.reactor = reactor
+
+        self.shards = []
+        for _ in range(shards):
+            shard = self.service_class(key, encrypted, endpoint_string, reactor=reactor, **kwargs)
+            shard.bind_all(self.emit_event)
+            self.addService(shard)
+            self.shards.append(shard)
+
+        self.channels = dict()
+        # channel name -> shard it's subscribed on
+        self._assigned = dict()
+
+    @property
+    def connections(self):
+        """The connection of each shard."""
+        return [shard.connection for shard in self.shards]
+
+    def shard_for(self, channel_name):
+        """
+        Get the shard a channel is, or would be, subscribed on.
+
+        :type channel_name: str or unicode
+        :rtype: twistedpusher.PusherService
+        """
+        try:
+            return self._assigned[channel_name]
+        except KeyError:
+            pass
+        if self.assignment == 'hash':
+            # unsigned, Python 2's crc32 is signed
+            return self.shards[(zlib.crc32(channel_name.encode('utf8')) & 0xffffffff) % len(self.shards)]
+        return min(self.shards, key=lambda shard: len(shard.channels))
+
+    def subscribe(self, channel_name, **kwargs):
+        """
+        Subscribe to a channel on the shard picked by the assignment policy.
+
+        :param channel_name: the channel's name
+        :type channel_name: str or unicode
+
+        :param kwargs: passed to ``PusherService.subscribe``
+
+        :return: the created channel
+        :rtype: twistedpusher.Channel
+
+        :raises BadChannelNameError: if channel_name is not a valid Pusher channel name
+        """
+        if channel_name in self.channels:
+            warnings.warn("Already subscribed to channel {0}".format(channel_name))
+            return self.channels[channel_name]
+
+        shard = self.shard_for(channel_name)
+        chan = shard.subscribe(channel_name, **kwargs)
+        self.channels[channel_name] = chan
+        self._assigned[channel_name] = shard
+        return chan
+
+    def unsubscribe(self, channel_name):
+        """
+        Unsubscribe from a channel.
+
+        :param channel_name: the channel's name
+        :type channel_name: str
+        """
+        if channel_name in self.channels:
+            self._assigned.pop(channel_name).unsubscribe(channel_name)
+            self.channels.pop(channel_name)
+        else:
+            warnings.warn("Attempted to unsubscribe from channel {0} when not subscribed".format(channel_name))
+
+    def channel(self, channel_name):
+        """
+        Get a channel by name.
+
+        :type channel_name: str
+
+        :return: the requested channel, if found
+        :rtype: twistedpusher.Channel
+
+        :raises ValueError: if the channel is not found (i.e. subscribed to)
+        """
+        try:
+            return self.channels[channel_name]
+        except KeyError:
+            raise ValueError("Channel not found: '{0}'.".format(channel_name))
+
+    def latency_stats(self):
+        """
+        Get the latency histograms of every subscribed channel, see ``Channel.latency_stats``.
+
+        :rtype: dict
+        """
+        return dict((name, chan.latency_stats()) for name, chan in self.channels.items())
+
+    def shard_stats(self):
+        """
+        Get the state and load of each shard.
+
+        :returns: per shard, in order, its connection ``state``, number of ``channels`` and ``dropped_frames``
+            filtered by its protocol
+        :rtype: list
+        """
+        stats = []
+        for shard in self.shards:
+            protocol = getattr(shard.connection.transport, 'protocol', None)
+            stats.append({'state': shard.connection.state,
+                          'channels': len(shard.channels),
+                          'dropped_frames': getattr(protocol, 'dropped_frames', 0)})
+        return stats
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- test-case-name: twistedpusher.test.test_subscriptions -*-
+
+import logging
+from collections import OrderedDict
+from twisted.internet import defer
+
+from twistedpusher.errors import SubscriptionTimeoutError, AuthorizationError
+from twistedpusher.events import Event
+
+log = logging.getLogger(__name__)
+
+
+class _Subscription(object):
+    """Subscription state of one channel."""
+    def __init__(self, channel):
+        self.channel = channel
+        self.acknowledged = False
+        self.attempts = 0
+        self.timeout_call = None
+        self.waiters = []
+
+
+class SubscriptionManager(object):
+    """
+    Subscribes channels on a connection and tracks Pusher's acknowledgements.
+
+    Subscribe frames requested during one reactor iteration, and those of every channel after (re)connecting, are
+    sent in a single write. A channel is subscribed once :meth:`acknowledge` is called for it, when its
+    ``pusher_internal:subscription_succeeded`` event arrives. Unacknowledged subscriptions are sent again after
+    ``timeout`` seconds, up to ``retries`` times, before their Deferreds fail with
+    :class:`~twistedpusher.errors.SubscriptionTimeoutError`. Failed channels are subscribed again on the next
+    reconnect.
+
+    Private and presence channels are signed by the ``authorizer`` first, all those of a write with one
+    ``authorize`` call, and their subscribe frames are sent once it answers. If a channel is refused, its Deferreds
+    fail with :class:`~twistedpusher.errors.AuthorizationError` and it emits ``pusher:subscription_error``.
+
+    :ivar last_subscribe_duration: seconds from the last connection until every channel was acknowledged, or None
+    :type last_subscribe_duration: float or None
+    """
+    def __init__(self, connection, timeout=10, retries=2, reactor=None, authorizer=None):
+        """
+        :param connection: an IPusherConnection provider
+        :param timeout: seconds to wait for an acknowledgement before subscribing again
+        :type timeout: int or float
+        :param retries: number of times an unacknowledged subscription is sent again
+        :type retries: int
+        :param reactor: :class:`IReactorTime` provider, defaults to :class:`twisted.internet.reactor`
+        :param authorizer: ``IChannelAuthorizer`` provider signing private and presence channel subscriptions
+        """
+        if not reactor:
+            from twisted.internet import reactor
+        self.connection = connection
+        self.authorizer = authorizer
+        self.timeout = timeout
+        self.retries = retries
+        self.reactor = reactor
+
+        # channel name -> _Subscription
+        self.subscriptions = dict()
+        # names of the subscriptions not acknowledged, kept up to date so acknowledging doesn't scan every channel
+        self._unacknowledged = set()
+        self.last_subscribe_duration = None
+
+        # channel name -> _Subscription, for the next write
+        self._to_send = OrderedDict()
+        self._flush_call = None
+        self._connected_at = None
+
+        connection.bind('connected', self._on_connected)
+        for state in ('connecting', 'unavailable', 'disconnected'):
+            connection.bind(state, self._on_disconnected)
+
+    def add(self, channel):
+        """
+        Subscribe a channel, and again whenever the connection is re-established.
+
+        :type channel: twistedpusher.Channel
+        """
+        sub = _Subscription(channel)
+        self.subscriptions[channel.name] = sub
+        self._unacknowledged.add(channel.name)
+        if self.connection.state == 'connected':
+            self._queue(sub)
+
+    def remove(self, channel_name):
+        """
+        Stop managing a channel's subscription. Waiting Deferreds are cancelled.
+
+        :type channel_name: str or unicode
+        """
+        sub = self.subscriptions.pop(channel_name)
+        self._unacknowledged.discard(channel_name)
+        self._stop_timeout(sub)
+        self._to_send.pop(channel_name, None)
+        waiters, sub.waiters = sub.waiters, []
+        for d in waiters:
+            d.cancel()
+
+    def when_subscribed(self, channel_name):
+        """
+        Get a Deferred firing with the channel once its current subscription is acknowledged.
+
+        :type channel_name: str or unicode
+        :rtype: defer.Deferred
+
+        :raises KeyError: if the channel is not managed
+        """
+        sub = self.subscriptions[channel_name]
+        if sub.acknowledged:
+            return defer.succeed(sub.channel)
+        d = defer.Deferred()
+        sub.waiters.append(d)
+        return d
+
+    def is_pending(self, channel_name):
+        """
+        Whether a managed channel is waiting for an acknowledgement.
+
+        :type channel_name: str or unicode
+        :rtype: bool
+        """
+        return channel_name in self._unacknowledged
+
+    @property
+    def pending(self):
+        """Names of the channels waiting for an acknowledgement."""
+        return set(self._unacknowledged)
+
+    def _queue(self, sub):
+        self._to_send[sub.channel.name] = sub
+        if self._flush_call is None:
+            self._flush_call = self.reactor.callLater(0, self._flush)
+
+    def _flush(self):
+        """Send the queued subscribe frames in one write."""
+        if self._flush_call is not None:
+            if self._flush_call.active():
+                self._flush_call.cancel()
+            self._flush_call = None
+        to_send, self._to_send = list(self._to_send.values()), OrderedDict()
+        if not to_send or self.connection.state != 'connected':
+            return
+        public = [sub for sub in to_send if not sub.channel.requires_auth]
+        private = [sub for sub in to_send if sub.channel.requires_auth]
+        if public:
+            self._send(public)
+        if private:
+            self._authorize(private)
+
+    def _send(self, subs, auths=None):
+        """Send subscribe frames in one write and wait for their acknowledgements."""
+        auths = auths or {}
+        self.connection.send_events([sub.channel.subscription_event(auths.get(sub.channel.name)) for sub in subs])
+        for sub in subs:
+            sub.attempts += 1
+            sub.timeout_call = self.reactor.callLater(self.timeout, self._timed_out, sub)
+
+    def _authorize(self, subs):
+        """Get the signatures of private and presence subscriptions, then send them."""
+        if self.authorizer is None:
+            for sub in subs:
+                self._refused(sub, AuthorizationError("No authorizer to subscribe to {0}".format(sub.channel.name)))
+            return
+        socket_id = self.connection.socket_id
+        d = defer.maybeDeferred(self.authorizer.authorize, socket_id, [sub.channel.name for sub in subs])
+        d.addCallbacks(self._authorized, self._authorization_failed, callbackArgs=(subs, socket_id),
+                       errbackArgs=(subs, socket_id))
+
+    def _current(self, subs, socket_id):
+        """The subscriptions still wanted on the connection they were authorized for."""
+        if self.connection.state != 'connected' or self.connection.socket_id != socket_id:
+            # subscribed again, authorized for the new socket, when connected
+            return []
+        return [sub for sub in subs if self.subscriptions.get(sub.channel.name) is sub and not sub.acknowledged]
+
+    def _authorized(self, auths, subs, socket_id):
+        authorized = []
+        for sub in self._current(subs, socket_id):
+            if sub.channel.name in auths:
+                authorized.append(sub)
+            else:
+                self._refused(sub, AuthorizationError("Not authorized to subscribe to {0}".format(sub.channel.name)))
+        if authorized:
+            self._send(authorized, auths)
+
+    def _authorization_failed(self, failure, subs, socket_id):
+        log.warning("Could not authorize subscriptions: {0}".format(failure.getErrorMessage()))
+        for sub in self._current(subs, socket_id):
+            self._refused(sub, AuthorizationError(failure.getErrorMessage()))
+
+    def _refused(self, sub, error):
+        """Give up on a subscription that was not authorized."""
+        log.warning(str(error))
+        self._unacknowledged.discard(sub.channel.name)
+        sub.channel.emit_event(Event(name='pusher:subscription_error', channel=sub.channel.name,
+                                     data={'error': str(error)}))
+        waiters, sub.waiters = sub.waiters, []
+        for d in waiters:
+            d.errback(error)
+
+    def _stop_timeout(self, sub):
+        if sub.timeout_call is not None:
+            if sub.timeout_call.active():
+                sub.timeout_call.cancel()
+            sub.timeout_call = None
+
+    def _timed_out(self, sub):
+        sub.timeout_call = None
+        if sub.attempts <= self.retries:
+            log.info("Subscription to {0} not acknowledged, subscribing again.".format(sub.channel.name))
+            self._queue(sub)
+            return
+        log.warning("Subscription to {0} not acknowledged after {1} attempts.".format(
+            sub.channel.name, sub.attempts))
+        self._unacknowledged.discard(sub.channel.name)
+        waiters, sub.waiters = sub.waiters, []
+        for d in waiters:
+            d.errback(SubscriptionTimeoutError(sub.channel.name))
+
+    def acknowledge(self, channel_name):
+        """
+        Mark a channel's subscription as acknowledged by Pusher.
+
+        :type channel_name: str or unicode
+        """
+        sub = self.subscriptions.get(channel_name)
+        if sub is None or sub.acknowledged:
+            return
+        sub.acknowledged = True
+        self._unacknowledged.discard(channel_name)
+        self._stop_timeout(sub)
+        waiters, sub.waiters = sub.waiters, []
+        for d in waiters:
+            d.callback(sub.channel)
+        if self._connected_at is not None and not self._unacknowledged:
+            self.last_subscribe_duration = self.reactor.seconds() - self._connected_at
+            self._connected_at = None
+
+    def _on_connected(self, _):
+        self._connected_at = self.reactor.seconds()
+        self._unacknowledged = set(self.subscriptions)
+        for name, sub in self.subscriptions.items():
+            sub.acknowledged = False
+            sub.attempts = 0
+            self._to_send[name] = sub
+        self._flush()
+
+    def _on_disconnected(self, _):
+        self._connected_at = None
+        self._unacknowledged = set(self.subscriptions)
+        for sub in self.subscriptions.values():
+            sub.acknowledged = False
+            self._stop_timeout(sub)
+        self._to_send.clear()
+        if self._flush_call is not None:
+            self._flush_call.cancel()
+            self._flush_call = None
@@ -44,6 +44,7 @@ class FakeProtocol(object):
 
         self._on_event = None
         self.send_event = mock.Mock()
+        self.send_events = mock.Mock()
         self.disconnect = mock.Mock()
 
     @property
@@ -56,6 +57,20 @@ class FakeProtocol(object):
         self.on_event_set.callback(func)
 
 
+class FakeThreadPool(object):
+    """Thread pool that runs queued calls on demand, in the calling thread."""
+    def __init__(self):
+        self.calls = []
+
+    def callInThread(self, func, *args, **kwargs):
+        self.calls.append((func, args, kwargs))
+
+    def run(self):
+        while self.calls:
+            func, args, kwargs = self.calls.pop(0)
+            func(*args, **kwargs)
+
+
 def make_mock_endpoint():
     """Returns a tuple of (mock_endpoint, mock_protocol)"""
     endpoint = mock.Mock()
@@ -63,3 +78,18 @@ def make_mock_endpoint():
     endpoint.connect.return_value = defer.succeed(proto)
     ret = (endpoint, proto)
     return ret
+
+
+def connect_service(service, clock):
+    """
+    Start a PusherService over a FakeProtocol and establish its Pusher connection.
+
+    :param clock: the service's task.Clock
+    :returns: the protocol
+    """
+    endpoint, proto = make_mock_endpoint()
+    service.connection.transport.endpoint = endpoint
+    service.startService()
+    clock.advance(0)
+    proto.on_event(PUSHER_CONNECT_EVENT)
+    return proto
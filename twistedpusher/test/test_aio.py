@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+import mock
+import threading
+from twisted.trial import unittest
+from twisted.internet import defer, error
+from twisted.internet.interfaces import IReactorTime
+from zope.interface.verify import verifyObject
+
+try:
+    from twistedpusher import aio
+except ImportError:
+    aio = None
+from twistedpusher.events import Event
+from twistedpusher.test.helpers import TEST_TIMEOUT, PUSHER_CONNECT_EVENT, make_mock_endpoint
+
+
+class AsyncioTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+    skip = None if aio else "neither asyncio nor trollius is installed"
+
+    def setUp(self):
+        self.loop = aio.asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def run_loop(self, seconds=0):
+        self.loop.run_until_complete(aio.asyncio.sleep(seconds, loop=self.loop))
+
+
+class AsyncioClockTestCase(AsyncioTestCase):
+    def setUp(self):
+        super(AsyncioClockTestCase, self).setUp()
+        self.clock = aio.AsyncioClock(self.loop)
+
+    def test_interface(self):
+        verifyObject(IReactorTime, self.clock)
+
+    def test_seconds_follow_the_loop(self):
+        self.assertEqual(int(self.clock.seconds()), int(self.loop.time()))
+
+    def test_call_later(self):
+        callback = mock.Mock()
+        call = self.clock.callLater(0.01, callback, 1, b=2)
+        self.assertEqual(self.clock.getDelayedCalls(), [call])
+        self.run_loop(0.02)
+        callback.assert_called_once_with(1, b=2)
+        self.assertFalse(call.active())
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertRaises(error.AlreadyCalled, call.cancel)
+
+    def test_cancel(self):
+        callback = mock.Mock()
+        call = self.clock.callLater(0, callback)
+        call.cancel()
+        self.run_loop()
+        self.assertFalse(callback.called)
+        self.assertRaises(error.AlreadyCancelled, call.reset, 1)
+
+    def test_reset(self):
+        callback = mock.Mock()
+        call = self.clock.callLater(10, callback)
+        call.reset(0)
+        self.assertLessEqual(call.getTime(), self.loop.time())
+        self.run_loop(0.01)
+        self.assertEqual(callback.call_count, 1)
+
+    def test_call_in_thread(self):
+        called = threading.Event()
+        self.clock.getThreadPool().callInThread(called.set)
+        self.assertTrue(called.wait(TEST_TIMEOUT / 2))
+
+
+class AsFutureTestCase(AsyncioTestCase):
+    def test_result(self):
+        future = aio.as_future(defer.succeed(1), self.loop)
+        self.assertEqual(self.loop.run_until_complete(future), 1)
+
+    def test_failure(self):
+        future = aio.as_future(defer.fail(ValueError()), self.loop)
+        self.assertRaises(ValueError, self.loop.run_until_complete, future)
+
+
+class AsyncioEndpointTestCase(AsyncioTestCase):
+    def setUp(self):
+        super(AsyncioEndpointTestCase, self).setUp()
+        self.server = self.loop.run_until_complete(
+            self.loop.create_server(aio.asyncio.Protocol, '127.0.0.1', 0))
+        self.addCleanup(self.server.close)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    def test_connect(self):
+        protocol = aio.asyncio.Protocol()
+        d = aio.AsyncioEndpoint('127.0.0.1', self.port, loop=self.loop).connect(lambda: protocol)
+        self.assertIs(self.loop.run_until_complete(aio.as_future(d, self.loop)), protocol)
+
+    def test_connect_failure(self):
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        d = aio.AsyncioEndpoint('127.0.0.1', self.port, loop=self.loop).connect(aio.asyncio.Protocol)
+        self.assertRaises(EnvironmentError, self.loop.run_until_complete, aio.as_future(d, self.loop))
+
+    def test_cancel(self):
+        d = aio.AsyncioEndpoint('127.0.0.1', self.port, loop=self.loop).connect(aio.asyncio.Protocol)
+        d.cancel()
+        self.run_loop(0.01)
+        self.failureResultOf(d, defer.CancelledError)
+
+
+class AsyncioPusherTestCase(AsyncioTestCase):
+    def setUp(self):
+        super(AsyncioPusherTestCase, self).setUp()
+        self.endpoint, self.protocol = make_mock_endpoint()
+        factory = mock.Mock(json_data_channels=set(), channel_filter=None)
+        with mock.patch.object(aio.AsyncioPusher, '_build_factory', return_value=factory):
+            self.client = aio.AsyncioPusher('key', loop=self.loop, endpoint=self.endpoint)
+        self.addCleanup(self.client.disconnect)
+
+    def connect(self):
+        self.run_loop()
+        self.protocol.on_event(PUSHER_CONNECT_EVENT)
+
+    def test_connects_on_the_loop(self):
+        self.assertEqual(self.client.connection.state, 'connecting')
+        self.connect()
+        self.endpoint.connect.assert_called_once_with(self.client.factory)
+        self.assertEqual(self.client.connection.state, 'connected')
+
+    def test_channels_use_the_loop_clock(self):
+        self.assertIs(self.client.subscribe('trades').reactor, self.client.reactor)
+        self.assertIs(self.client.factory.channel_filter, self.client.channels)
+
+    def test_subscribe_and_dispatch(self):
+        self.connect()
+        listener = mock.Mock()
+        self.client.subscribe('trades').bind('trade', listener)
+        subscribed = self.client.when_subscribed('trades')
+        self.assertIsInstance(subscribed, aio.asyncio.Future)
+        self.run_loop()
+        self.assertEqual([event.data['channel'] for event in self.protocol.send_events.call_args[0][0]],
+                         ['trades'])
+
+        self.protocol.on_event(Event(name='pusher_internal:subscription_succeeded', channel='trades', data={}))
+        self.assertIs(self.loop.run_until_complete(subscribed), self.client.channel('trades'))
+        event = Event(name='trade', channel='trades', data={})
+        self.protocol.on_event(event)
+        listener.assert_called_once_with(event)
+
+    def test_disconnect(self):
+        self.connect()
+        self.client.disconnect()
+        self.protocol.on_connection_lost.callback({})
+        self.assertEqual(self.client.connection.state, 'disconnected')
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+import json
+import mock
+from twisted.trial import unittest
+from twisted.internet import defer, reactor, task
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from twistedpusher.auth import sign_subscription, SecretAuthorizer, HTTPAuthorizer
+from twistedpusher.errors import AuthorizationError
+from twistedpusher.test.helpers import TEST_TIMEOUT
+
+KEY = 'key'
+SECRET = 'secret'
+
+
+class SignatureTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def test_private_signature(self):
+        # example of Pusher's authentication signature documentation
+        self.assertEqual(sign_subscription('278d425bdf160c739803', '7ad3773142a6692b25b8', '1234.1234',
+                                           'private-foobar'),
+                         '278d425bdf160c739803:58df8b0c36d6982b82c3ecf6b4662e34fe8c25bba48f5369f135bf843651c3a4')
+
+    def test_secret_authorizer(self):
+        authorizer = SecretAuthorizer(KEY, SECRET, user_data={'user_id': 'me'})
+        auths = self.successResultOf(authorizer.authorize('1.1', ['private-a', 'presence-b']))
+        self.assertEqual(auths['private-a'], {'auth': sign_subscription(KEY, SECRET, '1.1', 'private-a')})
+        channel_data = auths['presence-b']['channel_data']
+        self.assertEqual(json.loads(channel_data), {'user_id': 'me'})
+        self.assertEqual(auths['presence-b']['auth'],
+                         sign_subscription(KEY, SECRET, '1.1', 'presence-b', channel_data))
+
+    def test_presence_refused_without_user(self):
+        auths = self.successResultOf(SecretAuthorizer(KEY, SECRET).authorize('1.1', ['presence-b']))
+        self.assertEqual(auths, {})
+
+
+class FakeAuthEndpoint(Resource):
+    """Authentication endpoint of an application, refusing channels named ``private-refused``."""
+    isLeaf = True
+
+    def __init__(self):
+        Resource.__init__(self)
+        self.requests = []
+        self.peers = set()
+        self.code = 200
+
+    def render_POST(self, request):
+        args = dict((k.decode('ascii'), [v.decode('utf8') for v in values]) for k, values in request.args.items())
+        self.requests.append(args)
+        self.peers.add(request.transport.getPeer().port)
+        request.setResponseCode(self.code)
+        socket_id = args['socket_id'][0]
+        if 'channel_name' in args:
+            name = args['channel_name'][0]
+            body = {'auth': sign_subscription(KEY, SECRET, socket_id, name)}
+        else:
+            body = dict()
+            for name in args['channel_name[]']:
+                if name == 'private-refused':
+                    body[name] = {'status': 403, 'data': {}}
+                else:
+                    body[name] = {'status': 200, 'data': {'auth': sign_subscription(KEY, SECRET, socket_id, name)}}
+        return json.dumps(body).encode('utf8')
+
+
+class HTTPAuthorizerTestCase(unittest.TestCase):
+    # requests go over the loopback interface
+    timeout = 5
+
+    def setUp(self):
+        self.endpoint = FakeAuthEndpoint()
+        self.port = reactor.listenTCP(0, Site(self.endpoint), interface='127.0.0.1')
+        url = 'http://127.0.0.1:{0}/pusher/auth'.format(self.port.getHost().port)
+        self.authorizer = HTTPAuthorizer(url, params={'session': 'abc'})
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.authorizer.close()
+        yield self.port.stopListening()
+
+    @defer.inlineCallbacks
+    def test_single_channel(self):
+        auths = yield self.authorizer.authorize('1.1', ['private-a'])
+        self.assertEqual(auths, {'private-a': {'auth': sign_subscription(KEY, SECRET, '1.1', 'private-a')}})
+        self.assertEqual(self.endpoint.requests, [{'socket_id': ['1.1'], 'channel_name': ['private-a'],
+                                                   'session': ['abc']}])
+
+    @defer.inlineCallbacks
+    def test_calls_of_one_iteration_share_a_request(self):
+        results = yield defer.gatherResults([self.authorizer.authorize('1.1', ['private-a', 'private-b']),
+                                             self.authorizer.authorize('1.1', ['private-c'])])
+        self.assertEqual(sorted(results[0]), ['private-a', 'private-b'])
+        self.assertEqual(list(results[1]), ['private-c'])
+        self.assertEqual(len(self.endpoint.requests), 1)
+        self.assertEqual(self.endpoint.requests[0]['channel_name[]'], ['private-a', 'private-b', 'private-c'])
+
+    @defer.inlineCallbacks
+    def test_refused_channel_is_left_out(self):
+        auths = yield self.authorizer.authorize('1.1', ['private-a', 'private-refused'])
+        self.assertEqual(list(auths), ['private-a'])
+
+    @defer.inlineCallbacks
+    def test_signatures_are_cached_per_socket(self):
+        yield self.authorizer.authorize('1.1', ['private-a'])
+        auths = yield self.authorizer.authorize('1.1', ['private-a'])
+        self.assertIn('private-a', auths)
+        self.assertEqual(len(self.endpoint.requests), 1)
+        yield self.authorizer.authorize('2.2', ['private-a'])
+        self.assertEqual(len(self.endpoint.requests), 2)
+
+    @defer.inlineCallbacks
+    def test_connection_is_reused(self):
+        yield self.authorizer.authorize('1.1', ['private-a'])
+        yield self.authorizer.authorize('2.2', ['private-a'])
+        self.assertEqual(len(self.endpoint.peers), 1)
+
+    @defer.inlineCallbacks
+    def test_error_status(self):
+        self.endpoint.code = 403
+        d = self.authorizer.authorize('1.1', ['private-a'])
+        yield self.assertFailure(d, AuthorizationError)
+
+    def test_unanswered_request_times_out(self):
+        """A request that never completes is cancelled after the timeout and fails the authorization."""
+        clock = task.Clock()
+        cancelled = []
+        request = defer.Deferred(cancelled.append)
+        authorizer = HTTPAuthorizer('http://127.0.0.1/pusher/auth', reactor=clock, pool=mock.Mock(), timeout=3)
+        authorizer.agent = mock.Mock(**{'request.return_value': request})
+        d = authorizer.authorize('1.1', ['private-a'])
+        clock.advance(0)
+        clock.advance(2.9)
+        self.assertNoResult(d)
+        clock.advance(0.1)
+        self.failureResultOf(d, AuthorizationError)
+        self.assertEqual(cancelled, [request])
+        self.assertEqual(clock.getDelayedCalls(), [])
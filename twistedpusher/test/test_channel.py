@@ -2,11 +2,12 @@
 
 import mock
 from twisted.trial import unittest
-from twisted.internet import defer
+from twisted.internet import defer, task
 
-from twistedpusher.channel import Channel, buildChannel
-from twistedpusher.test.helpers import FakeEvent
-from twistedpusher.errors import BadChannelNameError
+from twistedpusher.channel import Channel, PrivateChannel, PresenceChannel, buildChannel
+from twistedpusher.events import DisableFailingListeners, Event
+from twistedpusher.test.helpers import FakeEvent, FakeThreadPool
+from twistedpusher.errors import BadChannelNameError, BadEventNameError
 from twistedpusher.connection import Connection
 from twistedpusher.test.helpers import TEST_TIMEOUT
 
@@ -44,12 +45,9 @@ class ChannelTestCase(unittest.TestCase):
         self.chan.unsubscribe()
         self.conn.send_event.assert_called_once_with(UNSUBSCRIBE_EVENT)
 
-    def test_subscribe_on_connect(self):
-        """Automatically subscribe on connected Connection state."""
-        event = FakeEvent(name='connected')
-        listener = self.conn.bind.call_args[0][1]
-        listener(event)
-        self.conn.send_event.assert_called_once_with(SUBSCRIBE_EVENT)
+    def test_does_not_bind_connection(self):
+        """Subscribing on connect is left to the client's SubscriptionManager."""
+        self.assertFalse(self.conn.bind.called)
 
 
 class ChannelEventEmitterTestCase(unittest.TestCase):
@@ -92,12 +90,49 @@ class ChannelEventEmitterTestCase(unittest.TestCase):
         self.chan.bind_all(handler, ignore_pusher_events=True)
         self.assertTrue(handler in self.chan.global_listeners)
 
+    def test_ignore_pusher_events_receives_client_events(self):
+        self.chan.bind_all(self.mock_handler, ignore_pusher_events=True)
+        event = FakeEvent(name='client-event')
+        self.chan.emit_event(event)
+        self.mock_handler.assert_called_once_with(event)
+
+    def test_ignore_pusher_events_with_bound_pusher_event(self):
+        """Filtering also applies to pusher events that have listeners of their own."""
+        self.chan.bind_all(self.fail, ignore_pusher_events=True)
+        self.chan.bind('pusher:subscription_succeeded', self.mock_handler)
+        self.chan.emit_event(FakeEvent(name='pusher:subscription_succeeded'))
+        self.assertEqual(self.mock_handler.call_count, 1)
+
+    def test_listener_is_not_wrapped(self):
+        """Global listeners are stored as given, so they unbind by identity."""
+        self.chan.bind_all(self.mock_handler, ignore_pusher_events=True)
+        self.assertIn(self.mock_handler, self.chan.global_listeners)
+        self.chan.unbind_all(self.mock_handler)
+        self.assertEqual(self.chan.user_listeners, set())
+        self.chan.emit_event(FakeEvent(name='client-event'))
+        self.assertFalse(self.mock_handler.called)
+
+    def test_rebind_with_other_flag(self):
+        """Binding a global listener again switches whether it receives pusher events."""
+        self.chan.bind_all(self.mock_handler, ignore_pusher_events=True)
+        self.chan.bind_all(self.mock_handler, ignore_pusher_events=False)
+        self.chan.emit_event(FakeEvent(name='pusher:conn'))
+        self.assertEqual(self.mock_handler.call_count, 1)
+
     def test_json_data_flag(self):
         """The json_data flag enables parsing of client event data as JSON."""
         self.chan = Channel(CHANNEL_NAME, mock.Mock(), json_data=True)
         self.chan.emit_event(self.mock_event)
         self.assertDictEqual(self.mock_event.data, {'test_key': 'test_value'})
 
+    def test_json_data_flag_decodes_events_lazily(self):
+        """With json_data set, the data of Event objects is decoded when a listener reads it."""
+        event = Event(name='test-event', data='{"test_key": "test_value"}')
+        self.chan = Channel(CHANNEL_NAME, mock.Mock(), json_data=True)
+        self.chan.emit_event(event)
+        self.assertTrue(event.data_pending)
+        self.assertEqual(event.data, {'test_key': 'test_value'})
+
     def test_no_json_data_flag(self):
         """Without json_data set, client event data should not be parsed as json."""
         self.chan = Channel(CHANNEL_NAME, mock.Mock(), json_data=False)
@@ -105,6 +140,224 @@ class ChannelEventEmitterTestCase(unittest.TestCase):
         self.assertEqual(self.mock_event.data, '{"test_key": "test_value"}')
 
 
+class ChannelPooledListenerTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.chan = Channel(CHANNEL_NAME, mock.Mock(spec=Connection))
+        self.pool = FakeThreadPool()
+        self.m = mock.Mock()
+        self.event = FakeEvent(name='trade')
+
+    def test_bind_threaded(self):
+        """Listeners bound with delivery options are called from the thread pool."""
+        self.chan.bind('trade', self.m, threadpool=self.pool)
+        self.chan.emit_event(self.event)
+        self.assertFalse(self.m.called)
+        self.pool.run()
+        self.m.assert_called_once_with(self.event)
+
+    def test_unbind_threaded(self):
+        self.chan.bind('trade', self.m, threadpool=self.pool)
+        self.chan.unbind('trade', self.m)
+        self.assertNotIn('trade', self.chan.listeners)
+
+    def test_rebind_replaces_wrapper(self):
+        self.chan.bind('trade', self.m, threadpool=self.pool)
+        self.chan.bind('trade', self.m, threadpool=self.pool, max_pending=5)
+        self.assertEqual(len(self.chan.listeners['trade']), 1)
+
+    def test_bind_all_threaded(self):
+        self.chan.bind_all(self.m, threadpool=self.pool)
+        self.chan.emit_event(FakeEvent(name='pusher:ignored'))
+        self.chan.emit_event(self.event)
+        self.pool.run()
+        self.m.assert_called_once_with(self.event)
+        self.chan.unbind_all(self.m)
+        self.assertEqual(self.chan.global_listeners, set())
+        self.assertEqual(self.chan.user_listeners, set())
+
+    @mock.patch('twistedpusher.events.log.error')
+    def test_failures_handled_by_error_policy(self, mock_log):
+        """The channel's error policy gets failures of threaded listeners back on the reactor thread."""
+        reactor = mock.Mock(**{'callFromThread.side_effect': lambda f, *args: f(*args)})
+        chan = Channel(CHANNEL_NAME, mock.Mock(spec=Connection), reactor=reactor)
+        chan.error_policy = DisableFailingListeners(max_failures=1)
+        self.m.side_effect = ValueError
+        chan.bind('trade', self.m, threadpool=self.pool)
+        chan.emit_event(self.event)
+        self.pool.run()
+        self.assertEqual(reactor.callFromThread.call_count, 1)
+        self.assertEqual(mock_log.call_count, 1)
+        self.assertNotIn('trade', chan.listeners)
+        self.assertEqual(chan.listener_stats(), {})
+
+
+class ChannelAsyncListenerTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.pending = []
+
+    def listener(self, event):
+        d = defer.Deferred()
+        self.pending.append(d)
+        return d
+
+    def test_bind_max_in_flight(self):
+        chan = Channel(CHANNEL_NAME, mock.Mock(spec=Connection), reactor=self.clock)
+        chan.bind('trade', self.listener, max_in_flight=1)
+        chan.emit_event(FakeEvent(name='trade'))
+        chan.emit_event(FakeEvent(name='trade'))
+        self.assertEqual(len(self.pending), 1)
+        stats = chan.listener_stats()[('trade', self.listener)]
+        self.assertEqual(stats['queue_depth'], 1)
+        self.assertEqual(stats['in_flight'], 1)
+
+    def test_channel_default_max_in_flight(self):
+        """The channel's max_in_flight applies to listeners bound without one, but not to its own."""
+        chan = Channel(CHANNEL_NAME, mock.Mock(spec=Connection), reactor=self.clock, max_in_flight=1)
+        chan.bind_all(self.listener)
+        chan.emit_event(FakeEvent(name='trade'))
+        chan.emit_event(FakeEvent(name='trade'))
+        self.assertEqual(len(self.pending), 1)
+        self.assertEqual(list(chan.listener_stats()), [(None, self.listener)])
+
+    def test_options_without_delivery_mode(self):
+        chan = Channel(CHANNEL_NAME, mock.Mock(spec=Connection), reactor=self.clock)
+        self.assertRaises(TypeError, chan.bind, 'trade', self.listener, max_pending=3)
+
+
+class ChannelConflationTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.received = []
+
+    def make_channel(self, conflate, **kwargs):
+        chan = Channel(CHANNEL_NAME, mock.Mock(spec=Connection), reactor=self.clock, conflate=conflate, **kwargs)
+        chan.bind_all(lambda event: self.received.append(event))
+        return chan
+
+    def test_conflate_by_name(self):
+        """Events of one reactor iteration are conflated by name, keeping their first position."""
+        chan = self.make_channel('name')
+        a1, b, a2 = FakeEvent(name='a'), FakeEvent(name='b'), FakeEvent(name='a')
+        for event in (a1, b, a2):
+            chan.emit_event(event)
+        self.assertEqual(self.received, [])
+        self.clock.advance(0)
+        self.assertEqual(self.received, [a2, b])
+        self.assertEqual(chan.conflated.dropped, 1)
+
+    def test_conflate_by_data_field(self):
+        chan = self.make_channel('pair')
+        events = [FakeEvent(name='book', data={'pair': pair, 'seq': i}) for i, pair in enumerate('xyx')]
+        for event in events:
+            chan.emit_event(event)
+        self.clock.advance(0)
+        self.assertEqual(self.received, [events[2], events[1]])
+
+    def test_conflate_by_data_field_without_json_data(self):
+        """Undecoded data can't be keyed by field, those events are conflated by name."""
+        chan = self.make_channel('symbol')
+        events = [Event(name='trade', channel=CHANNEL_NAME, data='{{"symbol": "{0}"}}'.format(symbol))
+                  for symbol in 'xy']
+        events.append(Event(name='quote', channel=CHANNEL_NAME, data='{}'))
+        for event in events:
+            chan.emit_event(event)
+        self.clock.advance(0)
+        self.assertEqual(self.received, [events[1], events[2]])
+
+    def test_pusher_events_not_conflated(self):
+        chan = self.make_channel('name')
+        chan.bind('pusher:subscription_succeeded', lambda event: self.received.append(event))
+        event = FakeEvent(name='pusher:subscription_succeeded')
+        chan.emit_event(event)
+        self.assertEqual(self.received, [event])
+
+    def test_bounded(self):
+        chan = self.make_channel('name', max_conflated=2)
+        for name in 'abc':
+            chan.emit_event(FakeEvent(name=name))
+        self.clock.advance(0)
+        self.assertEqual([event.name for event in self.received], ['b', 'c'])
+
+    def test_slow_listeners_conflate(self):
+        """Waiting events of listeners with an in-flight limit are conflated by the channel's key."""
+        chan = self.make_channel('name')
+        pending = []
+
+        def slow(event):
+            pending.append(event)
+            return defer.Deferred()
+        chan.bind_all(slow, max_in_flight=1)
+        for name in 'abab':
+            chan.emit_event(FakeEvent(name=name))
+            self.clock.advance(0)
+        self.assertEqual(len(pending), 1)
+        stats = chan.listener_stats()[(None, slow)]
+        self.assertEqual(stats['queue_depth'], 2)
+        self.assertEqual(stats['dropped'], 1)
+
+
+class ChannelBatchTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.chan = Channel(CHANNEL_NAME, mock.Mock(spec=Connection), reactor=self.clock)
+        self.batches = []
+        self.listener = lambda batch: self.batches.append(batch)
+
+    def test_bind_batch_client_events(self):
+        self.chan.bind_batch(self.listener)
+        events = [FakeEvent(name='a'), FakeEvent(name='pusher:ping'), FakeEvent(name='b')]
+        for event in events:
+            self.chan.emit_event(event)
+        self.clock.advance(0)
+        self.assertEqual(self.batches, [[events[0], events[2]]])
+        self.assertEqual(self.chan.listener_stats()[(None, self.listener)]['batches'], 1)
+
+    def test_bind_batch_event_name(self):
+        self.chan.bind_batch(self.listener, max_size=2, event_name='a')
+        events = [FakeEvent(name='a'), FakeEvent(name='b'), FakeEvent(name='a')]
+        for event in events:
+            self.chan.emit_event(event)
+        self.assertEqual(self.batches, [[events[0], events[2]]])
+        self.chan.unbind('a', self.listener)
+        self.assertNotIn('a', self.chan.listeners)
+
+    def test_unbind_all(self):
+        self.chan.bind_batch(self.listener)
+        self.chan.unbind_all(self.listener)
+        self.chan.emit_event(FakeEvent(name='a'))
+        self.clock.advance(0)
+        self.assertEqual(self.batches, [])
+        self.assertEqual(self.chan.listener_stats(), {})
+
+
+class ChannelLatencyTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def test_latency_stats(self):
+        chan = Channel(CHANNEL_NAME, mock.Mock(spec=Connection))
+        chan.bind('a', lambda event: None)
+        event = Event(name='a', channel=CHANNEL_NAME, data={})
+        event.stamp(0, 0)
+        chan.emit_event(event)
+        stats = chan.latency_stats()
+        self.assertEqual(stats['dispatch']['count'], 1)
+        self.assertEqual(stats['parse']['count'], 1)
+
+    def test_track_latency_disabled(self):
+        chan = Channel(CHANNEL_NAME, mock.Mock(spec=Connection), track_latency=False)
+        chan.emit_event(FakeEvent(name='a'))
+        self.assertIsNone(chan.latency_stats())
+
+
 class BuilderTestCase(unittest.TestCase):
     timeout = TEST_TIMEOUT
 
@@ -118,8 +371,87 @@ class BuilderTestCase(unittest.TestCase):
 
     def test_private(self):
         """buildChannel returns a private channel if the name starts with 'private-'."""
-        self.assertRaises(NotImplementedError, buildChannel, 'private-channel', self.conn)
+        self.assertIsInstance(buildChannel('private-channel', self.conn), PrivateChannel)
 
     def test_presence(self):
         """buildChannel returns a presence channel if the name starts with 'presence-'."""
-        self.assertRaises(NotImplementedError, buildChannel, 'presence-channel', self.conn)
\ No newline at end of file
+        self.assertIsInstance(buildChannel('presence-channel', self.conn), PresenceChannel)
+
+
+class PrivateChannelTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.conn = mock.Mock(spec=Connection)
+        self.chan = PrivateChannel('private-channel', self.conn)
+
+    def test_subscription_event_carries_auth(self):
+        event = self.chan.subscription_event({'auth': 'key:signature'})
+        self.assertEqual(event.name, 'pusher:subscribe')
+        self.assertEqual(event.data, {'channel': 'private-channel', 'auth': 'key:signature'})
+
+    def test_trigger(self):
+        self.chan.trigger('client-typing', {'user': 'someone'})
+        event = self.conn.send_event.call_args[0][0]
+        self.assertEqual((event.name, event.channel, event.data),
+                         ('client-typing', 'private-channel', {'user': 'someone'}))
+
+    def test_trigger_needs_client_prefix(self):
+        self.assertRaises(BadEventNameError, self.chan.trigger, 'typing', {})
+        self.assertFalse(self.conn.send_event.called)
+
+
+class PresenceChannelTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.chan = PresenceChannel('presence-channel', mock.Mock(spec=Connection))
+        self.received = []
+        self.chan.bind_all(lambda event: event.name.startswith('pusher:') and self.received.append(event.name),
+                           ignore_pusher_events=False)
+
+    def subscribe(self):
+        event = self.chan.subscription_event({'auth': 'key:signature', 'channel_data': '{"user_id": "me"}'})
+        self.assertEqual(event.data['channel_data'], '{"user_id": "me"}')
+        self.chan.emit_event(Event(name='pusher_internal:subscription_succeeded', channel='presence-channel',
+                                   data={'presence': {'count': 2, 'ids': ['me', 'you'],
+                                                      'hash': {'me': None, 'you': {'name': 'You'}}}}))
+
+    def test_members_on_subscription(self):
+        self.subscribe()
+        self.assertEqual(dict(self.chan.members), {'me': None, 'you': {'name': 'You'}})
+        self.assertEqual(self.chan.me, {'user_id': 'me'})
+        self.assertEqual(self.received, ['pusher:subscription_succeeded'])
+
+    def test_members_join_and_leave(self):
+        self.subscribe()
+        self.chan.emit_event(Event(name='pusher_internal:member_added', channel='presence-channel',
+                                   data={'user_id': 'them', 'user_info': {'name': 'Them'}}))
+        self.chan.emit_event(Event(name='pusher_internal:member_removed', channel='presence-channel',
+                                   data={'user_id': 'you'}))
+        self.assertEqual(dict(self.chan.members), {'me': None, 'them': {'name': 'Them'}})
+        self.assertEqual(self.received[1:], ['pusher:member_added', 'pusher:member_removed'])
+
+    def test_repeated_events_are_not_emitted(self):
+        self.subscribe()
+        self.chan.emit_event(Event(name='pusher_internal:member_added', channel='presence-channel',
+                                   data={'user_id': 'you', 'user_info': {'name': 'You'}}))
+        self.chan.emit_event(Event(name='pusher_internal:member_removed', channel='presence-channel',
+                                   data={'user_id': 'nobody'}))
+        self.assertEqual(self.received, ['pusher:subscription_succeeded'])
+
+    def test_resubscription_emits_changes(self):
+        self.subscribe()
+        self.chan.emit_event(Event(name='pusher_internal:subscription_succeeded', channel='presence-channel',
+                                   data={'presence': {'count': 2, 'hash': {'me': None, 'them': None}}}))
+        self.assertEqual(self.received, ['pusher:subscription_succeeded', 'pusher:subscription_succeeded',
+                                         'pusher:member_removed', 'pusher:member_added'])
+        self.assertEqual(sorted(self.chan.members), ['me', 'them'])
+
+    def test_members_bounded(self):
+        chan = PresenceChannel('presence-channel', mock.Mock(spec=Connection), max_members=1,
+                               store_member_info=False)
+        chan.emit_event(Event(name='pusher_internal:subscription_succeeded', channel='presence-channel',
+                              data={'presence': {'count': 2, 'hash': {'you': {'name': 'You'}}}}))
+        self.assertEqual(dict(chan.members), {'you': None})
+        self.assertEqual(chan.members.count, 2)
\ No newline at end of file
@@ -6,8 +6,10 @@ from zope.interface.verify import verifyClass, verifyObject
 from twisted.internet import task, defer
 
 from twistedpusher.client import Pusher, PusherService
+from twistedpusher.errors import ConnectionError
+from twistedpusher.events import Event
 from twistedpusher.interfaces import IPusherClient, IPusherClientService
-from twistedpusher.test.helpers import TEST_TIMEOUT
+from twistedpusher.test.helpers import TEST_TIMEOUT, FakeEvent, FakeProtocol, PUSHER_CONNECT_EVENT, connect_service
 
 # Tests needed:
 # url creation?
@@ -32,6 +34,37 @@ class InterfacesTestCase(unittest.TestCase):
 class ChannelManagementTestCase(unittest.TestCase):
     timeout = TEST_TIMEOUT
 
+    def setUp(self):
+        self.clock = task.Clock()
+        self.client = PusherService('key', reactor=self.clock)
+
+    def test_factory_filters_unsubscribed_channels(self):
+        """The factory drops frames for channels missing from the client's channels."""
+        self.assertIs(self.client.factory.channel_filter, self.client.channels)
+
+    def test_subscribe_json_data_registers_channel_with_factory(self):
+        """Channels subscribed with json_data get their event data decoded while loading."""
+        self.client.subscribe('trades', json_data=True)
+        self.client.subscribe('other')
+        self.assertEqual(self.client.factory.json_data_channels, {'trades'})
+        connect_service(self.client, self.client.reactor)
+        self.client.unsubscribe('trades')
+        self.assertEqual(self.client.factory.json_data_channels, set())
+
+    def test_unsubscribe_while_disconnected(self):
+        """Pusher can't be told while disconnected, the channel is kept."""
+        self.client.subscribe('trades')
+        self.assertRaises(ConnectionError, self.client.unsubscribe, 'trades')
+        self.assertIn('trades', self.client.channels)
+
+    def test_latency_stats_per_channel(self):
+        self.client.subscribe('trades')
+        self.client.subscribe('other', track_latency=False)
+        stats = self.client.latency_stats()
+        self.assertEqual(sorted(stats), ['other', 'trades'])
+        self.assertIsNone(stats['other'])
+        self.assertEqual(stats['trades']['dispatch']['count'], 0)
+
     def test_subscribe_normal(self):
         """Client triggers subscribe on the created Channel and adds it to self.channels."""
 
@@ -45,4 +78,146 @@ class ChannelManagementTestCase(unittest.TestCase):
         """Client dispatches events to appropriate Channels."""
 
     def test_triggers_subscribe_on_connect(self):
-        """Client calls subscribe on all Channels on reconnect."""
\ No newline at end of file
+        """Client subscribes all Channels in one write on reconnect."""
+        self.client.subscribe('trades')
+        self.client.subscribe('other')
+        with mock.patch.object(self.client.connection, 'send_events') as send_events:
+            self.client.connection.state = 'connected'
+        sent = send_events.call_args[0][0]
+        self.assertEqual(sorted(event.data['channel'] for event in sent), ['other', 'trades'])
+
+    def test_subscribe_many(self):
+        self.client.connection._state = 'connected'
+        with mock.patch.object(self.client.connection, 'send_events') as send_events:
+            d = self.client.subscribe_many(['trades', 'other'])
+            self.client.reactor.advance(0)
+        self.assertEqual(send_events.call_count, 1)
+        for name in ('trades', 'other'):
+            self.client._on_event(Event(name='pusher_internal:subscription_succeeded', channel=name, data={}))
+        self.assertEqual(self.successResultOf(d), [self.client.channel('trades'), self.client.channel('other')])
+
+    def test_client_events_wait_for_resubscription(self):
+        """After a reconnect, client events are sent once their channel is subscribed again."""
+        self.client.subscribe('trades')
+        proto = connect_service(self.client, self.clock)
+        self.client._on_event(Event(name='pusher_internal:subscription_succeeded', channel='trades', data={}))
+
+        endpoint = self.client.connection.transport.endpoint
+        new_proto = FakeProtocol()
+        endpoint.connect.return_value = defer.succeed(new_proto)
+        proto.on_connection_lost.callback({})
+        self.client.connection.send_event(Event(name='client-update', channel='trades', data={}))
+        self.clock.advance(1)
+        new_proto.on_event(PUSHER_CONNECT_EVENT)
+        self.clock.advance(0)
+        sent = [event.name for call in new_proto.send_events.call_args_list for event in call[0][0]]
+        self.assertEqual(sent, ['pusher:subscribe'])
+
+        self.client._on_event(Event(name='pusher_internal:subscription_succeeded', channel='trades', data={}))
+        self.clock.advance(0)
+        self.assertEqual(new_proto.send_events.call_args[0][0][0].name, 'client-update')
+
+    def test_when_subscribed_unknown_channel(self):
+        self.assertRaises(ValueError, self.client.when_subscribed, 'trades')
+
+class MigrationTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.client = PusherService('key', reactor=self.clock, migrate=True, migration_timeout=30, handover_period=5)
+        self.old_proto, self.new_proto = FakeProtocol(), FakeProtocol()
+        self.endpoint = mock.Mock()
+        self.endpoint.connect.side_effect = [defer.succeed(self.old_proto), defer.succeed(self.new_proto)]
+        self.client.connection.transport.endpoint = self.endpoint
+        self.chan = self.client.subscribe('trades')
+        self.received = []
+        self.chan.bind('update', lambda event: self.received.append(event.data))
+
+        self.client.startService()
+        self.clock.advance(0)
+        self.old_proto.on_event(PUSHER_CONNECT_EVENT)
+        self.old = self.client.connection
+
+    def tearDown(self):
+        self.client.stopService()
+
+    def request_reconnect(self):
+        self.old_proto.on_event(FakeEvent(name='pusher:error', data={'code': 4200}))
+        self.clock.advance(0)
+        self.new_proto.on_event(PUSHER_CONNECT_EVENT)
+
+    def update(self, proto, data):
+        proto.on_event(Event(name='update', channel='trades', data=data))
+
+    def test_server_reconnect_keeps_old_connection_until_new_one_is_subscribed(self):
+        self.request_reconnect()
+        self.assertIs(self.client.connection, self.old)
+        self.assertFalse(self.old_proto.disconnect.called)
+        sent = self.new_proto.send_events.call_args[0][0]
+        self.assertEqual([event.data['channel'] for event in sent], ['trades'])
+
+        self.new_proto.on_event(Event(name='pusher_internal:subscription_succeeded', channel='trades', data={}))
+        self.assertIsNot(self.client.connection, self.old)
+        self.assertIs(self.chan.connection, self.client.connection)
+        self.assertTrue(self.old_proto.disconnect.called)
+        self.assertEqual(self.client.migrations, 1)
+        self.assertEqual(self.client.last_migration_duration, 0)
+
+    def test_events_delivered_once_during_handover(self):
+        self.request_reconnect()
+        self.update(self.old_proto, 'a')
+        self.update(self.new_proto, 'a')
+        self.update(self.new_proto, 'b')
+        self.new_proto.on_event(Event(name='pusher_internal:subscription_succeeded', channel='trades', data={}))
+        self.update(self.old_proto, 'b')
+        self.update(self.new_proto, 'c')
+        self.assertEqual(self.received, ['a', 'b', 'c'])
+
+        self.clock.advance(5)
+        self.assertIsNone(self.client._handover)
+        self.update(self.new_proto, 'c')
+        self.assertEqual(self.received, ['a', 'b', 'c', 'c'])
+
+    def test_migration_timeout_keeps_old_connection(self):
+        self.request_reconnect()
+        self.clock.advance(30)
+        self.assertIs(self.client.connection, self.old)
+        self.assertTrue(self.new_proto.disconnect.called)
+        self.assertFalse(self.old_proto.disconnect.called)
+        self.assertEqual(self.client.migrations, 0)
+        self.update(self.old_proto, 'a')
+        self.assertEqual(self.received, ['a'])
+        self.assertEqual(self.old.on_channel_event, self.client._on_event)
+
+    def test_old_connection_does_not_reconnect_during_migration(self):
+        """Pusher closes the socket after a 4200 error, only the migration connects again."""
+        self.request_reconnect()
+        self.old_proto.on_connection_lost.callback({'clean': True, 'code': 4200, 'reason': ''})
+        self.clock.advance(1)
+        self.assertEqual(self.endpoint.connect.call_count, 2)
+
+        self.new_proto.on_event(Event(name='pusher_internal:subscription_succeeded', channel='trades', data={}))
+        self.assertIsNot(self.client.connection, self.old)
+        self.clock.advance(10)
+        self.assertEqual(self.endpoint.connect.call_count, 2)
+
+    def test_old_connection_reconnects_if_migration_fails(self):
+        self.request_reconnect()
+        self.old_proto.on_connection_lost.callback({'clean': True, 'code': 4200, 'reason': ''})
+        self.endpoint.connect.side_effect = None
+        self.endpoint.connect.return_value = defer.succeed(FakeProtocol())
+        self.clock.advance(30)
+        self.assertIs(self.client.connection, self.old)
+        self.assertTrue(self.old.transport.auto_reconnect)
+        self.clock.advance(1)
+        self.assertEqual(self.endpoint.connect.call_count, 3)
+
+    def test_stop_during_migration(self):
+        self.request_reconnect()
+        new = self.client._migration['connection']
+        self.client.stopService()
+        self.assertIsNone(self.client._migration)
+        self.assertFalse(new.running)
+        self.clock.advance(30)
+        self.assertEqual(self.endpoint.connect.call_count, 2)
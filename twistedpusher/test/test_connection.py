@@ -8,6 +8,7 @@ from zope.interface.verify import verifyObject, verifyClass
 from twistedpusher.connection import Connection
 from twistedpusher.interfaces import IPusherConnection
 from twistedpusher.errors import ConnectionError
+from twistedpusher.events import Event
 from twistedpusher.test.helpers import *
 
 
@@ -48,6 +49,24 @@ class ConnectionTestCase(BaseConnTestCase):
     def test_send_event_while_not_connected_raises_connection_error(self):
         self.assertRaises(ConnectionError, self.conn.send_event, FakeEvent(name='test'))
 
+    def test_send_events_while_connected(self):
+        self.connect()
+        self.conn.send_events([TEST_EVENT, TEST_EVENT])
+        self.proto.send_events.assert_called_once_with([TEST_EVENT, TEST_EVENT])
+
+    def test_send_events_while_not_connected_raises_connection_error(self):
+        self.assertRaises(ConnectionError, self.conn.send_events, [FakeEvent(name='test')])
+
+    def test_client_events_buffered_while_connecting(self):
+        self.conn.startService()
+        event = Event(name='client-test', channel='private-a', data={})
+        self.conn.send_event(event)
+        self.assertFalse(self.proto.send_event.called)
+        self.clock.advance(CONNECT_TIME)
+        self.proto.on_event(PUSHER_CONNECT_EVENT)
+        self.clock.advance(0)
+        self.proto.send_events.assert_called_once_with([event])
+
     def test_init_raises_assertion_error_with_bad_channel_event_callback(self):
         """Connection constructor raises AssertionError if on_channel_event is not callable."""
         self.assertRaises(AssertionError, Connection, None, None, {}, self.clock)
@@ -59,10 +78,17 @@ class ConnectionEventEmittingTestCase(BaseConnTestCase):
         super(ConnectionEventEmittingTestCase, self).setUp()
 
     def test_connecting_in_event(self):
+        """The first attempt connects without a delay, retries announce theirs."""
         m = mock.Mock()
         self.conn.bind('connecting_in', m)
+        d = defer.Deferred()
+        self.endpoint.connect.side_effect = [d, defer.Deferred()]
         self.conn.startService()
+        self.clock.advance(0)
+        self.assertEqual(m.call_count, 0)
+        d.cancel()
         self.assertEqual(m.call_count, 1)
+        self.assertTrue(m.call_args[0][0].delay >= 1)
 
     def test_state_change_events(self):
         m = mock.Mock()
@@ -74,7 +100,7 @@ class ConnectionEventEmittingTestCase(BaseConnTestCase):
         m.assert_called_with({'name': 'state_change', 'current': 'connected', 'previous': 'connecting'})
         self.assertEqual(m.call_count, 2)
 
-    @mock.patch('twistedpusher.connection.log.warning')
+    @mock.patch('twistedpusher.core.log.warning')
     def test_error_event_on_pusher_error(self, _):
         m = mock.Mock()
         self.conn.bind('error', m)
@@ -98,7 +124,7 @@ class ConnectionEventHandlingTestCase(BaseConnTestCase):
         self.proto.on_event(PUSHER_PING_EVENT)
         self.proto.send_event.assert_called_once_with({'name': 'pusher:pong'})
 
-    @mock.patch('twistedpusher.connection.log.warning')
+    @mock.patch('twistedpusher.core.log.warning')
     @mock.patch('warnings.warn')
     def test_error_handler_fatal_error_warns_and_stops(self,  mock_warn, mock_log):
         """Code between 4000 and 4001 results in warning, log message, and stopped service"""
@@ -111,7 +137,7 @@ class ConnectionEventHandlingTestCase(BaseConnTestCase):
         self.assertEqual(mock_warn.call_count, 1)
         self.assertEqual(mock_log.call_count, 1)
 
-    @mock.patch('twistedpusher.connection.log.warning')
+    @mock.patch('twistedpusher.core.log.warning')
     def test_error_handler_nonfatal_error(self, mock_log):
         """Anything else results in log message"""
         self.conn.startService()
@@ -232,9 +258,9 @@ class ConnectionTimeoutsTestCase(BaseConnTestCase):
         self.connect()
         self.clock.advance(150)
 
-        self.assertTrue(self.conn.pong_timeout.active)
+        self.assertIsNotNone(self.conn.core.pong_deadline)
         self.proto.on_connection_lost.callback(mock.Mock())
-        self.assertFalse(self.conn.pong_timeout.active)
+        self.assertIsNone(self.conn.core.pong_deadline)
 
 
 class ReconnectingTestCase(BaseConnTestCase):
@@ -276,6 +302,21 @@ class ReconnectingTestCase(BaseConnTestCase):
         self.clock.advance(CONNECT_TIME*2)
         self.assertEqual(self.endpoint.connect.call_count, 2)
 
+    def test_first_connect_is_immediate(self):
+        self.conn.startService()
+        self.clock.advance(0)
+        self.assertEqual(self.endpoint.connect.call_count, 1)
+
+    @mock.patch('twistedpusher.core.log.warning')
+    def test_fast_retry_after_reconnect_error(self, _):
+        """Pusher errors asking to reconnect immediately skip the backoff."""
+        self.endpoint.connect.side_effect = [defer.succeed(self.proto), defer.Deferred()]
+        self.connect()
+        self.proto.on_event(FakeEvent(name='pusher:error', data={'code': 4200}))
+        self.proto.on_connection_lost.callback(mock.Mock())
+        self.clock.advance(self.conn.transport.backoff.fast_retry_window)
+        self.assertEqual(self.endpoint.connect.call_count, 2)
+
     def test_no_auto_reconnect_after_stop_service_if_connected(self):
         self.endpoint.connect.side_effect = [defer.succeed(self.proto), defer.succeed(FakeProtocol())]
         self.connect()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+import json
+import mock
+from twisted.trial import unittest
+
+from twistedpusher.core import ConnectionCore, decode_frame
+from twistedpusher.test.helpers import TEST_TIMEOUT
+
+
+def frame(name, data=None, channel=None):
+    fields = {'event': name, 'data': json.dumps(data or {})}
+    if channel:
+        fields['channel'] = channel
+    return json.dumps(fields)
+
+
+ESTABLISHED = frame('pusher:connection_established', {'socket_id': '1.1', 'activity_timeout': 60})
+
+
+class DecodeFrameTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def test_decodes_json_data_channels(self):
+        event = decode_frame(frame('trade', {'a': 1}, 'trades'), 5, json_data_channels={'trades'})
+        self.assertEqual(event.data, {'a': 1})
+        self.assertEqual(event.received_ns, 5)
+
+    def test_drops_filtered_channels(self):
+        metrics = mock.Mock()
+        self.assertIsNone(decode_frame(frame('trade', channel='other'), channel_filter={'trades'}, metrics=metrics))
+        metrics.frames_dropped.inc.assert_called_once_with()
+
+    def test_accepted_frames_are_not_scanned(self):
+        """Frames for channels in the filter are loaded without scanning their envelope."""
+        with mock.patch('twistedpusher.core.scan_pusher_envelope') as scan:
+            event = decode_frame(frame('trade', {'a': 1}, 'trades'), channel_filter={'trades'})
+        self.assertEqual(event.channel, 'trades')
+        self.assertFalse(scan.called)
+
+    def test_nested_channel_key_is_confirmed(self):
+        """A channel key found in nested data doesn't get the frame dropped."""
+        payload = '{"event": "trade", "data": {"channel": "other"}, "channel": "trades"}'
+        self.assertEqual(decode_frame(payload, channel_filter={'trades'}).channel, 'trades')
+
+    def test_invalid_payload(self):
+        self.assertRaises(ValueError, decode_frame, 'nonsense')
+
+
+class ConnectionCoreTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.core = ConnectionCore()
+
+    def take_actions(self):
+        actions = list(self.core.actions)
+        self.core.actions.clear()
+        return actions
+
+    def connect(self, now=0):
+        self.core.connecting(now)
+        self.core.opened(now)
+        self.core.receive(ESTABLISHED, now)
+        self.take_actions()
+
+    def test_connects(self):
+        self.core.connecting(0)
+        self.core.opened(1)
+        self.assertIsNone(self.core.receive(ESTABLISHED, 2))
+        self.assertEqual([(action.previous, action.current) for action in self.take_actions()],
+                         [('initialized', 'connecting'), ('connecting', 'connected')])
+        self.assertEqual(self.core.socket_id, '1.1')
+        self.assertEqual(self.core.next_deadline(), 62)
+
+    def test_unavailable_after_trying_for_a_while(self):
+        self.core.connecting(0)
+        self.take_actions()
+        self.assertEqual(self.core.next_deadline(), 30)
+        self.core.tick(30)
+        self.assertEqual(self.core.state, 'unavailable')
+        self.assertIsNone(self.core.next_deadline())
+
+    def test_channel_events_are_returned_and_push_back_the_ping(self):
+        self.connect()
+        event = self.core.receive(frame('trade', channel='trades'), 50)
+        self.assertEqual(event.channel, 'trades')
+        self.assertEqual(self.core.next_deadline(), 110)
+        self.assertFalse(self.core.actions)
+
+    def test_ping_after_inactivity_then_reconnect_without_pong(self):
+        self.connect()
+        self.core.tick(60)
+        self.assertEqual([json.loads(payload)['event'] for payload in self.core.frames_to_send()], ['pusher:ping'])
+        self.assertEqual(self.core.next_deadline(), 90)
+        self.core.tick(90)
+        self.assertEqual([action.name for action in self.take_actions()], ['reconnect_requested', 'reconnect'])
+
+    def test_pong_restarts_the_activity_timer(self):
+        self.connect()
+        self.core.tick(60)
+        self.core.receive(frame('pusher:pong'), 61)
+        self.assertIsNone(self.core.pong_deadline)
+        self.assertEqual(self.core.next_deadline(), 121)
+
+    def test_make_before_break_leaves_reconnecting_to_the_caller(self):
+        self.core.make_before_break = True
+        self.connect()
+        self.core.tick(60)
+        self.core.tick(90)
+        self.assertEqual([action.name for action in self.take_actions()], ['reconnect_requested'])
+
+    def test_ping_answered(self):
+        self.connect()
+        self.core.receive(frame('pusher:ping'), 1)
+        self.assertEqual([event.name for event in self.core.outgoing], ['pusher:pong'])
+
+    @mock.patch('twistedpusher.core.log.warning')
+    @mock.patch('warnings.warn')
+    def test_fatal_error_stops(self, *_):
+        self.connect()
+        self.core.receive(frame('pusher:error', {'code': 4001}), 1)
+        self.assertEqual([action.name for action in self.take_actions()], ['error', 'stop'])
+
+    @mock.patch('twistedpusher.core.log.warning')
+    def test_reconnect_error_retries_fast(self, _):
+        self.connect()
+        self.core.receive(frame('pusher:error', {'code': 4200}), 1)
+        actions = self.take_actions()
+        self.assertEqual([action.name for action in actions], ['error', 'fast_retry', 'reconnect_requested'])
+        self.assertEqual(actions[-1].reason, 4200)
+
+    def test_closed(self):
+        self.connect()
+        self.core.tick(60)
+        self.core.closed(61)
+        self.assertEqual(self.core.state, 'connecting')
+        self.assertIsNone(self.core.next_deadline())
+        self.core.closed(62, reconnecting=False)
+        self.assertEqual(self.core.state, 'disconnected')
@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+
+import threading
+import mock
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from twisted.python.threadpool import ThreadPool
+
+from twistedpusher.delivery import EventQueue, PooledListener, AsyncListener, BatchListener, make_conflation_key
+from twistedpusher.events import Event
+from twistedpusher.test.helpers import FakeEvent, FakeThreadPool, TEST_TIMEOUT
+
+
+def raise_again():
+    """Raise the exception being handled."""
+    raise
+
+
+def make_events(*names):
+    return [FakeEvent(name=name, data={'symbol': name[0]}) for name in names]
+
+
+class EventQueueTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def test_fifo(self):
+        queue = EventQueue()
+        events = make_events('a', 'b', 'c')
+        for event in events:
+            queue.put(event)
+        self.assertEqual([queue.get() for _ in range(3)], events)
+        self.assertRaises(IndexError, queue.get)
+
+    def test_drop_oldest_when_full(self):
+        queue = EventQueue(max_size=2)
+        events = make_events('a', 'b', 'c')
+        for event in events:
+            queue.put(event)
+        self.assertEqual(queue.get_all(), events[1:])
+        self.assertEqual(queue.dropped, 1)
+
+    def test_conflate_replaces_in_place(self):
+        queue = EventQueue(conflate_key='name')
+        a1, b, a2 = make_events('a', 'b', 'a')
+        for event in (a1, b, a2):
+            queue.put(event)
+        self.assertEqual(queue.get_all(), [a2, b])
+        self.assertEqual(queue.dropped, 1)
+
+    def test_conflate_by_data_field(self):
+        key = make_conflation_key('symbol')
+        self.assertEqual(key(FakeEvent(name='trade', data={'symbol': 'x'})), ('trade', 'x'))
+
+    def test_conflate_by_data_field_without_dict_data(self):
+        key = make_conflation_key('symbol')
+        self.assertEqual(key(FakeEvent(name='trade', data='{"symbol": "x"}')), ('trade', None))
+        self.assertEqual(key(FakeEvent(name='trade', data=[1])), ('trade', None))
+
+    def test_conflate_bounded(self):
+        queue = EventQueue(max_size=2, conflate_key='name')
+        events = make_events('a', 'b', 'c')
+        for event in events:
+            queue.put(event)
+        self.assertEqual(queue.get_all(), events[1:])
+
+
+class PooledListenerTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.pool = FakeThreadPool()
+        self.received = []
+
+    def make(self, **kwargs):
+        return PooledListener(self.received.append, threadpool=self.pool, **kwargs)
+
+    def test_delivered_in_order_by_one_thread(self):
+        listener = self.make()
+        events = make_events('a', 'b', 'c')
+        for event in events:
+            listener(event)
+        self.assertEqual(len(self.pool.calls), 1)
+        self.assertEqual(self.received, [])
+        self.pool.run()
+        self.assertEqual(self.received, events)
+        self.assertEqual(listener.delivered, 3)
+
+    def test_drop_oldest_overflow(self):
+        listener = self.make(max_pending=2, overflow='drop-oldest')
+        events = make_events('a', 'b', 'c')
+        for event in events:
+            listener(event)
+        self.pool.run()
+        self.assertEqual(self.received, events[1:])
+        self.assertEqual(listener.dropped, 1)
+
+    def test_conflate_overflow(self):
+        listener = self.make(overflow='conflate')
+        a1, b, a2 = make_events('a', 'b', 'a')
+        for event in (a1, b, a2):
+            listener(event)
+        self.pool.run()
+        self.assertEqual(self.received, [a2, b])
+
+    def test_block_overflow(self):
+        """With the block policy, emitting waits for the listener to make room."""
+        pool = ThreadPool(1, 1)
+        pool.start()
+        release = threading.Event()
+        received = []
+
+        def slow(event):
+            release.wait()
+            received.append(event)
+        listener = PooledListener(slow, threadpool=pool, max_pending=1, overflow='block')
+        events = make_events('a', 'b', 'c')
+        listener(events[0])
+        listener(events[1])
+
+        emitter = threading.Thread(target=listener, args=(events[2],))
+        emitter.start()
+        emitter.join(0.01)
+        self.assertTrue(emitter.is_alive())
+        release.set()
+        emitter.join(1)
+        pool.stop()
+        self.assertFalse(emitter.is_alive())
+        self.assertEqual(received, events)
+
+    def test_process_pool_receives_plain_dicts(self):
+        """Events sent to a process pool are plain dicts with their data decoded."""
+        process_pool = mock.Mock()
+        listener = self.make(process_pool=process_pool)
+        event = Event(name='a', data='[1]')
+        event.decode_data_lazily()
+        listener(event)
+        self.pool.run()
+        process_pool.apply.assert_called_once_with(self.received.append, ({'name': 'a', 'data': [1]},))
+        self.assertIs(type(process_pool.apply.call_args[0][1][0]), dict)
+
+    @mock.patch('twistedpusher.delivery.log.error')
+    def test_listener_errors_are_counted(self, mock_log):
+        listener = PooledListener(mock.Mock(side_effect=ValueError), threadpool=self.pool)
+        listener(FakeEvent(name='a'))
+        self.pool.run()
+        self.assertEqual(listener.failures, 1)
+        self.assertEqual(mock_log.call_count, 1)
+
+    @mock.patch('twistedpusher.delivery.log.error')
+    def test_listener_errors_go_to_emitter_policy(self, mock_log):
+        """Failures are handed to the emitter's error policy on the reactor thread, with the exception raised."""
+        reactor = mock.Mock()
+        emitter = mock.Mock()
+        emitter.error_policy.listener_failed.side_effect = lambda *args: self.assertRaises(ValueError, raise_again)
+        listener = PooledListener(mock.Mock(side_effect=ValueError), threadpool=self.pool, reactor=reactor,
+                                  emitter=emitter)
+        event = FakeEvent(name='a')
+        listener(event)
+        self.pool.run()
+        self.assertFalse(emitter.error_policy.listener_failed.called)
+        func, args = reactor.callFromThread.call_args[0][0], reactor.callFromThread.call_args[0][1:]
+        func(*args)
+        emitter.error_policy.listener_failed.assert_called_once_with(emitter, listener, event)
+        self.assertEqual(listener.failures, 1)
+        self.assertFalse(mock_log.called)
+
+    def test_bad_arguments(self):
+        self.assertRaises(ValueError, PooledListener, None, threadpool=self.pool)
+        self.assertRaises(ValueError, self.make, overflow='explode')
+
+
+class AsyncListenerTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.calls = []
+
+    def listener(self, event):
+        d = defer.Deferred()
+        self.calls.append((event, d))
+        return d
+
+    def test_limits_in_flight(self):
+        """Events beyond max_in_flight wait and are delivered in order as calls finish."""
+        listener = AsyncListener(self.listener, max_in_flight=2, reactor=self.clock)
+        events = make_events('a', 'b', 'c', 'd')
+        for event in events:
+            listener(event)
+        self.assertEqual([e for e, _ in self.calls], events[:2])
+        self.assertEqual(listener.stats()['queue_depth'], 2)
+
+        self.calls[1][1].callback(None)
+        self.assertEqual([e for e, _ in self.calls], events[:3])
+        self.calls[0][1].callback(None)
+        self.assertEqual([e for e, _ in self.calls], events)
+        self.assertEqual(listener.in_flight, 2)
+        self.assertEqual(listener.max_queue_depth, 2)
+
+    def test_completion_latency(self):
+        listener = AsyncListener(self.listener, reactor=self.clock)
+        listener(FakeEvent(name='a'))
+        self.clock.advance(2)
+        self.calls[0][1].callback(None)
+        stats = listener.stats()
+        self.assertEqual(stats['completed'], 1)
+        self.assertEqual(stats['latency_mean'], 2)
+        self.assertEqual(stats['latency_max'], 2)
+
+    @mock.patch('twistedpusher.delivery.log.error')
+    def test_failures_counted_and_next_delivered(self, mock_log):
+        listener = AsyncListener(self.listener, reactor=self.clock)
+        listener(FakeEvent(name='a'))
+        listener(FakeEvent(name='b'))
+        self.calls[0][1].errback(ValueError())
+        self.assertEqual(listener.failures, 1)
+        self.assertEqual(mock_log.call_count, 1)
+        self.assertEqual(len(self.calls), 2)
+
+    @mock.patch('twistedpusher.delivery.log.error')
+    def test_failures_go_to_emitter_policy(self, mock_log):
+        emitter = mock.Mock()
+        emitter.error_policy.listener_failed.side_effect = lambda *args: self.assertRaises(ValueError, raise_again)
+        listener = AsyncListener(self.listener, reactor=self.clock, emitter=emitter)
+        event = FakeEvent(name='a')
+        listener(event)
+        self.calls[0][1].errback(ValueError())
+        emitter.error_policy.listener_failed.assert_called_once_with(emitter, listener, event)
+        self.assertEqual(listener.failures, 1)
+        self.assertFalse(mock_log.called)
+
+    def test_synchronous_listener(self):
+        """Listeners returning plain values finish immediately, without recursing per waiting event."""
+        received = []
+        listener = AsyncListener(received.append, reactor=self.clock)
+        for event in make_events(*['a'] * 2000):
+            listener(event)
+        self.assertEqual(len(received), 2000)
+        self.assertEqual(listener.in_flight, 0)
+
+    def test_max_pending(self):
+        listener = AsyncListener(self.listener, max_pending=1, reactor=self.clock)
+        events = make_events('a', 'b', 'c')
+        for event in events:
+            listener(event)
+        self.calls[0][1].callback(None)
+        self.assertEqual([e for e, _ in self.calls], [events[0], events[2]])
+        self.assertEqual(listener.dropped, 1)
+
+    def test_bad_arguments(self):
+        self.assertRaises(ValueError, AsyncListener, None, reactor=self.clock)
+        self.assertRaises(ValueError, AsyncListener, self.listener, max_in_flight=0, reactor=self.clock)
+
+
+class BatchListenerTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.batches = []
+
+    def make_listener(self, **kwargs):
+        return BatchListener(lambda batch: self.batches.append(batch), reactor=self.clock, **kwargs)
+
+    def test_batch_per_reactor_iteration(self):
+        listener = self.make_listener()
+        events = make_events('a', 'b', 'c')
+        for event in events:
+            listener(event)
+        self.assertEqual(self.batches, [])
+        self.clock.advance(0)
+        self.assertEqual(self.batches, [events])
+        self.clock.advance(0)
+        self.assertEqual(len(self.batches), 1)
+
+    def test_max_size(self):
+        listener = self.make_listener(max_size=2)
+        events = make_events('a', 'b', 'c')
+        for event in events:
+            listener(event)
+        self.assertEqual(self.batches, [events[:2]])
+        self.clock.advance(0)
+        self.assertEqual(self.batches, [events[:2], events[2:]])
+
+    def test_max_delay(self):
+        listener = self.make_listener(max_delay=1)
+        events = make_events('a', 'b')
+        listener(events[0])
+        self.clock.advance(0.5)
+        listener(events[1])
+        self.assertEqual(self.batches, [])
+        self.clock.advance(0.5)
+        self.assertEqual(self.batches, [events])
+
+    def test_size_bound_cancels_timer(self):
+        listener = self.make_listener(max_size=1, max_delay=1)
+        listener(make_events('a')[0])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    @mock.patch('twistedpusher.delivery.log')
+    def test_listener_errors_are_counted(self, mock_log):
+        listener = BatchListener(mock.Mock(side_effect=ValueError), reactor=self.clock)
+        listener(make_events('a')[0])
+        self.clock.advance(0)
+        self.assertEqual(listener.stats(), {'queue_depth': 0, 'batches': 0, 'delivered': 0, 'failures': 1})
+        self.assertTrue(mock_log.error.called)
+
+    @mock.patch('twistedpusher.delivery.log')
+    def test_listener_errors_go_to_emitter_policy(self, mock_log):
+        emitter = mock.Mock()
+        listener = BatchListener(mock.Mock(side_effect=ValueError), reactor=self.clock, emitter=emitter)
+        events = make_events('a', 'b')
+        for event in events:
+            listener(event)
+        self.clock.advance(0)
+        emitter.error_policy.listener_failed.assert_called_once_with(emitter, listener, events[-1])
+        self.assertEqual(listener.failures, 1)
+        self.assertFalse(mock_log.error.called)
+
+    def test_bad_arguments(self):
+        self.assertRaises(ValueError, BatchListener, None, reactor=self.clock)
+        self.assertRaises(ValueError, self.make_listener, max_size=0)
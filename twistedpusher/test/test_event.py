@@ -1,12 +1,19 @@
 #!/usr/bin/env python
 
+import copy
 import json
+import mock
+import pickle
 from twisted.trial import unittest
 
-from twistedpusher.events import Event, load_pusher_event, serialize_pusher_event
+from twistedpusher import events
+from twistedpusher.events import Event, load_pusher_event, peek_channel, scan_pusher_envelope, serialize_pusher_event
 from twistedpusher.errors import BadEventNameError
 from twistedpusher.test.helpers import TEST_TIMEOUT
 
+# before any test selects another one
+IMPORTED_JSON_BACKEND = events.json_backend
+
 
 class EventTestCase(unittest.TestCase):
     timeout = TEST_TIMEOUT
@@ -19,7 +26,7 @@ class EventTestCase(unittest.TestCase):
     def test_constructor_kwargs(self):
         """Test constructor with extra fields in kwargs."""
         event = Event(name='098765', test=[], nothing=None, last='{"a": ""}')
-        self.assertDictEqual(event, {'name': '098765', 'test': [], 'nothing': None, 'last': '{"a": ""}'})
+        self.assertDictEqual(dict(event), {'name': '098765', 'test': [], 'nothing': None, 'last': '{"a": ""}'})
 
     def test_attribute_and_dict_access(self):
         """Check that attributes can be accessed via attribute AND dict index."""
@@ -27,6 +34,134 @@ class EventTestCase(unittest.TestCase):
         self.assertEqual(event['name'], 'abcd')
         self.assertEqual(event.name, 'abcd')
 
+    def test_missing_attribute_raises_attribute_error(self):
+        event = Event(name='abcd')
+        self.assertRaises(AttributeError, getattr, event, 'channel')
+        self.assertFalse(hasattr(event, 'channel'))
+
+    def test_no_instance_dict(self):
+        """Events use __slots__, so they don't carry an instance __dict__."""
+        self.assertFalse(hasattr(Event(name='abcd'), '__dict__'))
+
+    def test_stamp_is_not_a_field(self):
+        event = Event(name='abcd')
+        self.assertIsNone(event.received_ns)
+        event.stamp(1, 2)
+        self.assertEqual((event.received_ns, event.parsed_ns), (1, 2))
+        self.assertEqual(event, {'name': 'abcd'})
+
+    def test_mapping_methods(self):
+        event = Event(name='trade', channel='trades', data=1, extra=None)
+        self.assertEqual(event.keys(), ['name', 'channel', 'data', 'extra'])
+        self.assertEqual(len(event), 4)
+        self.assertIn('extra', event)
+        self.assertEqual(event.pop('extra'), None)
+        self.assertNotIn('extra', event)
+        self.assertRaises(AttributeError, getattr, event, 'extra')
+        del event['channel']
+        self.assertFalse(hasattr(event, 'channel'))
+        self.assertRaises(KeyError, event.__getitem__, 'channel')
+
+    def test_not_a_dict(self):
+        """Events compare equal to dicts of their fields without being one, so C code can't skip decoding."""
+        event = Event(name='abcd')
+        self.assertNotIsInstance(event, dict)
+        self.assertEqual(dict(event), {'name': 'abcd'})
+        self.assertRaises(TypeError, hash, event)
+
+
+class IsPusherEventTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def test_pusher_events(self):
+        self.assertTrue(events.is_pusher_event('pusher:ping'))
+        self.assertTrue(events.is_pusher_event('pusher_internal:subscription_succeeded'))
+
+    def test_client_events(self):
+        self.assertFalse(events.is_pusher_event('trade'))
+        self.assertFalse(events.is_pusher_event('client-pusher:x'))
+
+
+class LazyDataTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.event = Event(name='trade', data='{"price": 1}')
+        self.event.decode_data_lazily()
+
+    def test_data_decoded_on_first_access(self):
+        self.assertTrue(self.event.data_pending)
+        self.assertEqual(self.event.data, {'price': 1})
+        self.assertFalse(self.event.data_pending)
+
+    def test_data_decoded_on_item_access_and_get(self):
+        self.assertEqual(self.event['data'], {'price': 1})
+        other = Event(name='trade', data='[1]')
+        other.decode_data_lazily()
+        self.assertEqual(other.get('data'), [1])
+
+    def test_data_not_decoded_without_access(self):
+        """Reading other fields does not decode data."""
+        with mock.patch.object(events, 'json_backend') as backend:
+            self.assertEqual(self.event.name, 'trade')
+        self.assertFalse(backend.loads.called)
+
+    def test_decoded_only_once(self):
+        """Data decoding to a string is not decoded a second time."""
+        event = Event(name='quote', data='"\\"x\\""')
+        event.decode_data_lazily()
+        self.assertEqual(event.data, '"x"')
+        event.decode_data_lazily()
+        self.assertEqual(event.data, '"x"')
+
+    def test_assigning_data_cancels_pending_decode(self):
+        self.event.data = {'price': 2}
+        self.assertFalse(self.event.data_pending)
+        self.assertEqual(self.event.data, {'price': 2})
+
+    def test_equality_decodes_data(self):
+        self.assertEqual(self.event, {'name': 'trade', 'data': {'price': 1}})
+
+    def test_equality_decodes_both_events(self):
+        other = Event(name='trade', data='{"price": 1}')
+        other.decode_data_lazily()
+        self.assertEqual(Event(name='trade', data={'price': 1}), other)
+        self.assertEqual(other, self.event)
+        self.assertFalse(other.data_pending)
+
+    def test_mapping_methods_decode_data(self):
+        decoded = {'name': 'trade', 'data': {'price': 1}}
+        for read in (dict, lambda event: dict(event.items()), Event.copy):
+            event = Event(name='trade', data='{"price": 1}')
+            event.decode_data_lazily()
+            self.assertEqual(read(event), decoded)
+        self.assertEqual(self.event.values(), ['trade', {'price': 1}])
+
+    def test_repr_decodes_data(self):
+        self.assertEqual(repr(self.event), repr({'name': 'trade', 'data': {'price': 1}}))
+
+    def test_copies_keep_stamps_and_decode(self):
+        self.event.stamp(1, 2)
+        copies = [copy.copy(self.event), copy.deepcopy(self.event)]
+        copies.extend(pickle.loads(pickle.dumps(self.event, protocol)) for protocol in range(3))
+        for duplicate in copies:
+            self.assertIsInstance(duplicate, Event)
+            self.assertIsNot(duplicate, self.event)
+            self.assertFalse(duplicate.data_pending)
+            self.assertEqual(duplicate.data, {'price': 1})
+            self.assertEqual(duplicate, self.event)
+            self.assertEqual((duplicate.received_ns, duplicate.parsed_ns), (1, 2))
+
+    def test_deepcopy_copies_data(self):
+        duplicate = copy.deepcopy(self.event)
+        duplicate.data['price'] = 2
+        self.assertEqual(self.event.data, {'price': 1})
+
+    def test_non_string_data_not_marked(self):
+        event = Event(name='trade', data={'price': 1})
+        event.decode_data_lazily()
+        self.assertFalse(event.data_pending)
+
 
 class LoadPusherEventTestCase(unittest.TestCase):
     timeout = TEST_TIMEOUT
@@ -72,6 +207,37 @@ class LoadPusherEventTestCase(unittest.TestCase):
         expected = {'name': 'anevent', 'data': {}}
         self._check_load(raw, expected)
 
+    def test_load_client_event_data_not_decoded_by_default(self):
+        """Load leaves the data field of client events alone unless asked to decode it."""
+        raw = '{"event": "trade", "channel": "trades", "data": "{\\"price\\": 1}"}'
+        expected = {'name': 'trade', 'channel': 'trades', 'data': '{"price": 1}'}
+        self._check_load(raw, expected)
+
+    def test_load_json_data_flag(self):
+        """Load decodes the data field of client events in the same pass if json_data is True."""
+        raw = '{"event": "trade", "channel": "trades", "data": "{\\"price\\": 1}"}'
+        expected = {'name': 'trade', 'channel': 'trades', 'data': {'price': 1}}
+        self.assertDictEqual(dict(load_pusher_event(raw, json_data=True)), expected)
+
+    def test_load_json_data_is_lazy(self):
+        """Client event data requested with json_data is only decoded when read."""
+        raw = '{"event": "trade", "channel": "trades", "data": "[1]"}'
+        event = load_pusher_event(raw, json_data=True)
+        self.assertTrue(event.data_pending)
+
+    def test_load_interns_names(self):
+        """Loaded events share a single copy of each event and channel name."""
+        raw = '{"event": "trade", "channel": "trades"}'
+        first, second = load_pusher_event(raw), load_pusher_event(raw)
+        self.assertIs(first.name, second.name)
+        self.assertIs(first.channel, second.channel)
+
+    def test_load_json_data_channels(self):
+        """Load only decodes client event data for channels in json_data if it is a container."""
+        raw = '{"event": "trade", "channel": "%s", "data": "[1]"}'
+        self.assertEqual(load_pusher_event(raw % 'trades', json_data={'trades'}).data, [1])
+        self.assertEqual(load_pusher_event(raw % 'other', json_data={'trades'}).data, '[1]')
+
     def test_load_invalid_no_event_name(self):
         """Load raises a BadEventNameError if there is no event name."""
         raw = '{"data": 123}'
@@ -84,7 +250,74 @@ class LoadPusherEventTestCase(unittest.TestCase):
 
     def _check_load(self, raw, expected_result):
         loaded = load_pusher_event(raw)
-        self.assertDictEqual(loaded, expected_result)
+        self.assertDictEqual(dict(loaded), expected_result)
+
+
+class ScanPusherEnvelopeTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def test_scan_channel_event(self):
+        """The scan skips over the doubly encoded data field, even if it mentions a channel."""
+        raw = '{"event": "trade", "data": "{\\"channel\\": \\"x\\"}", "channel": "trades"}'
+        self.assertEqual(scan_pusher_envelope(raw), ('trade', 'trades'))
+
+    def test_scan_no_channel(self):
+        self.assertEqual(scan_pusher_envelope('{"event": "pusher:pong", "data": 1}'), ('pusher:pong', None))
+
+    def test_scan_escaped_name(self):
+        raw = '{"channel": "trades", "event": "\\u00e9v"}'
+        self.assertEqual(scan_pusher_envelope(raw), (u'\u00e9v', 'trades'))
+
+    def test_scan_gives_up_on_nested_data(self):
+        """Returns None if a nested value comes before the fields are found."""
+        self.assertIsNone(scan_pusher_envelope('{"event": "pusher:error", "data": {"code": 1}, "channel": "a"}'))
+
+    def test_scan_invalid(self):
+        self.assertIsNone(scan_pusher_envelope(''))
+        self.assertIsNone(scan_pusher_envelope('[1, 2]'))
+
+    def test_peek_channel(self):
+        raw = '{"event": "trade", "data": "{\\"channel\\": \\"x\\"}", "channel" : "trades"}'
+        self.assertEqual(peek_channel(raw), 'trades')
+        self.assertEqual(peek_channel('{"channel":"trades","event":"trade"}'), 'trades')
+
+    def test_peek_channel_not_found(self):
+        self.assertIsNone(peek_channel('{"event": "pusher:pong", "data": "{}"}'))
+        self.assertIsNone(peek_channel('{"event": "channel", "data": "x"}'))
+        self.assertIsNone(peek_channel('{"channel": null, "event": "x"}'))
+        self.assertIsNone(peek_channel('{"channel": "tr\\u0061des"}'))
+
+
+class JSONBackendTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def tearDown(self):
+        events.set_json_backend()
+
+    def test_set_backend_object(self):
+        """Events are loaded and serialized with the selected backend."""
+        backend = mock.Mock(wraps=json)
+        events.set_json_backend(backend)
+        load_pusher_event('{"event": "a"}')
+        serialize_pusher_event(Event(name='a'))
+        backend.loads.assert_called_once_with('{"event": "a"}')
+        self.assertEqual(backend.dumps.call_count, 1)
+
+    def test_set_backend_by_name(self):
+        """A backend can be selected by module name."""
+        self.assertIs(events.set_json_backend('json'), json)
+        self.assertIs(events.json_backend, json)
+
+    def test_set_missing_backend_raises_import_error(self):
+        self.assertRaises(ImportError, events.set_json_backend, 'not_a_json_module')
+
+    def test_default_backend_is_installed(self):
+        """With no argument, the first importable codec in JSON_BACKENDS is used."""
+        backend = events.set_json_backend()
+        self.assertIn(backend.__name__, events.JSON_BACKENDS)
+
+    def test_default_backend_is_selected_on_import(self):
+        self.assertIs(IMPORTED_JSON_BACKEND, events.set_json_backend())
 
 
 # could replace the ev/expected pairs here with a single dict after adding auto-convert for event->name fields
@@ -4,8 +4,11 @@ import mock
 from twisted.trial import unittest
 from zope.interface.verify import verifyClass, verifyObject
 
-from twistedpusher.interfaces import IEventEmitter
-from twistedpusher.events import EventEmitter
+from twisted.internet import task
+
+from twistedpusher.interfaces import IEventEmitter, IListenerErrorPolicy
+from twistedpusher.events import EventEmitter, listener_name
+from twistedpusher import events
 from twistedpusher.test.helpers import FakeEvent, TEST_TIMEOUT
 
 
@@ -101,6 +104,47 @@ class EventEmitterTestCase(unittest.TestCase):
         self.m2.assert_called_once_with(self.event)
         self.m3.assert_called_once_with(self.event)
 
+    def test_emit_unknown_name_allocates_nothing(self):
+        """Emitting events nobody is bound to leaves no bookkeeping behind."""
+        self.em.bind_all(self.m)
+        for i in range(10):
+            self.em.emit_event(FakeEvent(name='unknown:{0}'.format(i)))
+        self.assertEqual(self.m.call_count, 10)
+        self.assertEqual(self.em.listeners, {})
+
+    def test_unbind_last_listener_removes_event_name(self):
+        self.em.bind('an:event', self.m)
+        self.em.unbind('an:event', self.m)
+        self.assertNotIn('an:event', self.em.listeners)
+        self.em.emit_event(self.event)
+        self.assertFalse(self.m.called)
+
+    def test_bind_all_after_bind(self):
+        """Global listeners bound later still receive events that have specific listeners."""
+        self.em.bind('an:event', self.m)
+        m2 = mock.Mock()
+        self.em.bind_all(m2)
+        self.em.emit_event(self.event)
+        self.m.assert_called_once_with(self.event)
+        m2.assert_called_once_with(self.event)
+
+    def test_unbind_during_emit(self):
+        """
+        Listeners may unbind themselves or others while an event is being emitted. The emit in progress still calls
+        every listener bound when it started, later ones don't.
+        """
+        unbinder = mock.Mock(side_effect=lambda _: (self.em.unbind('an:event', unbinder),
+                                                    self.em.unbind('an:event', self.m)))
+        self.em.bind('an:event', unbinder)
+        self.em.bind('an:event', self.m)
+        self.em.emit_event(self.event)
+        self.assertEqual(unbinder.call_count, 1)
+        self.m.assert_called_once_with(self.event)
+
+        self.em.emit_event(self.event)
+        self.assertEqual(unbinder.call_count, 1)
+        self.assertEqual(self.m.call_count, 1)
+
     def test_implements_interface(self):
         verifyClass(IEventEmitter, EventEmitter)
         emitter = EventEmitter()
@@ -124,4 +168,97 @@ class EventEmitterTestCase(unittest.TestCase):
         except AssertionError:
             pass
         else:
-            self.fail('AssertionError was trapped')
\ No newline at end of file
+            self.fail('AssertionError was trapped')
+
+
+def bad_listener(event):
+    raise ValueError("This listener always fails")
+
+
+class ListenerErrorPolicyTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.em = EventEmitter()
+        self.event = FakeEvent(name='an:event')
+        self.em.bind('an:event', bad_listener)
+
+    def emit(self, times):
+        for _ in range(times):
+            self.em.emit_event(self.event)
+
+    def test_policies_implement_interface(self):
+        for cls in (events.ListenerErrorPolicy, events.WarnOnListenerError, events.SampleListenerErrors,
+                    events.RateLimitListenerErrors, events.DisableFailingListeners):
+            verifyClass(IListenerErrorPolicy, cls)
+
+    def test_count_only(self):
+        """The base policy only counts failures per listener."""
+        self.em.error_policy = events.ListenerErrorPolicy()
+        self.emit(3)
+        self.assertEqual(self.em.error_policy.failures[bad_listener], 3)
+
+    def test_policy_factory_set_on_class(self):
+        """Setting the policy factory on EventEmitter applies it to every emitter created afterwards."""
+        self.patch(EventEmitter, 'error_policy_factory', events.ListenerErrorPolicy)
+        emitter = EventEmitter()
+        self.assertIsInstance(emitter.error_policy, events.ListenerErrorPolicy)
+        self.assertNotIsInstance(emitter.error_policy, events.WarnOnListenerError)
+
+    @mock.patch('warnings.warn')
+    def test_default_policy_per_emitter(self, mock_warn):
+        """Emitters don't share failure counts, so a listener isn't kept alive by another emitter's policy."""
+        other = EventEmitter()
+        self.assertIsNot(other.error_policy, self.em.error_policy)
+        self.emit(2)
+        self.assertEqual(self.em.error_policy.failures[bad_listener], 2)
+        self.assertNotIn(bad_listener, other.error_policy.failures)
+
+    @mock.patch('twistedpusher.events.log.error')
+    def test_sampled_logging(self, mock_log):
+        self.em.error_policy = events.SampleListenerErrors(rate=10)
+        self.emit(25)
+        self.assertEqual(mock_log.call_count, 3)
+
+    @mock.patch('twistedpusher.events.log.error')
+    def test_rate_limited_logging(self, mock_log):
+        clock = task.Clock()
+        self.em.error_policy = events.RateLimitListenerErrors(max_logs=2, period=10, reactor=clock)
+        self.emit(5)
+        self.assertEqual(mock_log.call_count, 2)
+        self.assertEqual(self.em.error_policy.suppressed, 3)
+        clock.advance(10)
+        self.emit(1)
+        self.assertEqual(mock_log.call_count, 3)
+        self.assertIn('3 failures not logged', mock_log.call_args[0][0])
+        self.assertEqual(self.em.error_policy.failures[bad_listener], 6)
+
+    @mock.patch('twistedpusher.events.log.error')
+    def test_disable_after_failures(self, mock_log):
+        self.em.bind_all(bad_listener)
+        self.em.error_policy = events.DisableFailingListeners(max_failures=2)
+        self.emit(5)
+        # called globally and specifically by the first event, which reaches the limit
+        self.assertEqual(self.em.error_policy.failures[bad_listener], 2)
+        self.assertEqual(self.em.listeners, {})
+        self.assertEqual(self.em.global_listeners, set())
+        self.assertEqual(mock_log.call_count, 1)
+
+    def test_reset(self):
+        policy = self.em.error_policy = events.ListenerErrorPolicy()
+        self.emit(2)
+        policy.reset(bad_listener)
+        self.assertEqual(policy.failures[bad_listener], 0)
+
+
+class ListenerNameTestCase(unittest.TestCase):
+    def test_function(self):
+        self.assertEqual(listener_name(bad_listener), 'twistedpusher.test.test_eventemitter.bad_listener')
+
+    def test_method(self):
+        self.assertEqual(listener_name(self.test_method),
+                         'twistedpusher.test.test_eventemitter.ListenerNameTestCase.test_method')
+
+    def test_other_callable(self):
+        m = mock.Mock()
+        self.assertEqual(listener_name(m), repr(m))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+import time
+import mock
+from twisted.trial import unittest
+
+from twistedpusher.events import Event
+from twistedpusher.latency import LatencyHistogram, ChannelLatency, timestamp_to_seconds
+from twistedpusher.test.helpers import FakeEvent, TEST_TIMEOUT
+
+
+class LatencyHistogramTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.hist = LatencyHistogram()
+
+    def test_empty(self):
+        self.assertEqual(self.hist.snapshot(), {'count': 0, 'min': None, 'max': None, 'mean': None,
+                                                'p50': None, 'p90': None, 'p99': None, 'p99.9': None})
+
+    def test_small_values_exact(self):
+        for value in range(1, 101):
+            self.hist.record(value)
+        snapshot = self.hist.snapshot()
+        self.assertEqual((snapshot['count'], snapshot['min'], snapshot['max']), (100, 1, 100))
+        self.assertEqual(snapshot['mean'], 50.5)
+        self.assertEqual((snapshot['p50'], snapshot['p90'], snapshot['p99']), (50, 90, 99))
+
+    def test_large_values_bounded_error(self):
+        """Large values share log-linear buckets, with a small relative error."""
+        for value in (10 ** 6, 10 ** 9, 123456789):
+            self.hist.record(value)
+            error = value - self.hist.percentile(100) if value == self.hist.max else 0
+            self.assertTrue(0 <= error < value / 64.0)
+        self.assertTrue(len(self.hist.counts) <= 3)
+
+    def test_sparse(self):
+        for _ in range(1000):
+            self.hist.record(10 ** 6)
+        self.assertEqual(len(self.hist.counts), 1)
+
+    def test_negative_recorded_as_zero(self):
+        self.hist.record(-5)
+        self.assertEqual(self.hist.min, 0)
+
+    def test_reset(self):
+        self.hist.record(5)
+        self.hist.reset()
+        self.assertEqual(self.hist.count, 0)
+        self.assertEqual(self.hist.counts, {})
+
+
+class TimestampTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def test_units(self):
+        for timestamp in (1500000000, 1500000000000, '1500000000000000', 1500000000000000000):
+            self.assertAlmostEqual(timestamp_to_seconds(timestamp), 1500000000)
+
+    def test_not_a_number(self):
+        self.assertRaises(ValueError, timestamp_to_seconds, 'yesterday')
+
+
+class ChannelLatencyTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def test_unstamped_events_only_dispatch(self):
+        latency = ChannelLatency()
+        latency.record(FakeEvent(name='a'), 100, 150)
+        self.assertEqual(latency.dispatch.max, 50)
+        self.assertEqual(latency.parse.count, 0)
+
+    def test_stamped_event(self):
+        latency = ChannelLatency()
+        event = Event(name='a')
+        event.stamp(100, 130)
+        latency.record(event, 200, 210)
+        snapshot = latency.snapshot()
+        self.assertEqual(snapshot['parse']['max'], 30)
+        self.assertEqual(snapshot['queue']['max'], 70)
+        self.assertEqual(snapshot['dispatch']['max'], 10)
+        self.assertEqual(snapshot['exchange']['count'], 0)
+
+    @mock.patch('twistedpusher.latency.monotonic_ns', return_value=1000 * 10 ** 6)
+    @mock.patch('twistedpusher.latency.time')
+    def test_exchange_latency(self, mock_time, _):
+        """Exchange latency runs from the timestamp in the data to the wall clock time of receipt."""
+        mock_time.time.return_value = 1500000001.0
+        latency = ChannelLatency(timestamp_field='ts')
+        # received 0.5s before now on the monotonic clock, sent 0.25s before that
+        event = Event(name='a', data={'ts': 1500000000250})
+        event.stamp(500 * 10 ** 6, 500 * 10 ** 6)
+        latency.record(event, 500 * 10 ** 6, 500 * 10 ** 6)
+        self.assertAlmostEqual(latency.exchange.max / 1e9, 0.25, places=3)
+
+    def test_exchange_latency_missing_timestamp(self):
+        latency = ChannelLatency(timestamp_field='ts')
+        for data in ({}, 'not decoded', {'ts': 'bad'}):
+            event = Event(name='a', data=data)
+            event.stamp(1, 2)
+            latency.record(event, 3, 4)
+        self.assertEqual(latency.exchange.count, 0)
+        self.assertEqual(latency.parse.count, 3)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+import mock
+from twisted.trial import unittest
+from twisted.internet import task
+from twisted.web.test.requesthelper import DummyRequest
+
+from twistedpusher.connection import Connection
+from twistedpusher.events import Event
+from twistedpusher.metrics import Counter, Gauge, PusherMetrics, MetricsResource
+from twistedpusher.websocket import PusherWebsocketProtocol, PusherWebsocketFactory
+from twistedpusher.test.helpers import TEST_TIMEOUT, CONNECT_TIME, PUSHER_CONNECT_EVENT, FakeEvent, \
+    make_mock_endpoint
+
+
+class MetricTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def test_counter_render(self):
+        counter = Counter('frames_total', 'Frames.', ('channel',))
+        counter.inc(1, ('b',))
+        counter.inc(2, ('a"\n',))
+        counter.inc(1, ('b',))
+        self.assertEqual(counter.render(), ['# HELP frames_total Frames.',
+                                            '# TYPE frames_total counter',
+                                            'frames_total{channel="a\\"\\n"} 2',
+                                            'frames_total{channel="b"} 2'])
+
+    def test_gauge_without_labels(self):
+        gauge = Gauge('open', 'Open.')
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        self.assertEqual(gauge.render()[-1], 'open 1')
+        gauge.set(0.5)
+        self.assertEqual(gauge.render()[-1], 'open 0.5')
+
+    def test_resource_serves_text_format(self):
+        metrics = PusherMetrics()
+        metrics.frames_received.inc(3)
+        request = DummyRequest([b''])
+        body = MetricsResource(metrics).render_GET(request)
+        self.assertIn(b'pusher_frames_received_total 3\n', body)
+        self.assertEqual(request.responseHeaders.getRawHeaders(b'content-type'),
+                         [b'text/plain; version=0.0.4; charset=utf-8'])
+
+
+class ProtocolMetricsTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.metrics = PusherMetrics()
+        self.factory = PusherWebsocketFactory()
+        self.factory.metrics = self.metrics
+        self.factory.channel_filter = {'trades'}
+        self.pr = PusherWebsocketProtocol()
+        self.pr.factory = self.factory
+        self.pr.on_event = mock.Mock()
+
+    def test_counts_frames(self):
+        frame = '{"event": "trade", "channel": "trades", "data": "{}"}'
+        self.pr.onMessage(frame, False)
+        self.pr.onMessage('{"event": "trade", "channel": "other", "data": "{}"}', False)
+        self.assertEqual(self.metrics.frames_received.value(), 2)
+        self.assertEqual(self.metrics.frames_dropped.value(), 1)
+        self.assertEqual(self.metrics.bytes_received.value(), 2 * len(frame) - 1)
+        self.assertEqual(self.metrics.channel_events.values, {('trades',): 1})
+
+    def test_counts_parse_errors(self):
+        self.assertRaises(ValueError, self.pr.onMessage, '{"data": {}}', False)
+        self.assertRaises(ValueError, self.pr.onMessage, '{"event"', False)
+        self.assertEqual(self.metrics.parse_errors.value(), 2)
+
+    def test_counts_sent_frames(self):
+        self.pr.sendMessage = mock.Mock()
+        self.pr.send_event(Event(name='a'))
+        self.pr.send_events([Event(name='b'), Event(name='c')])
+        self.assertEqual(self.metrics.frames_sent.value(), 3)
+
+
+class ConnectionMetricsTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.endpoint, self.proto = make_mock_endpoint()
+        self.clock = task.Clock()
+        self.metrics = PusherMetrics()
+        self.conn = Connection(None, self.endpoint, lambda event: None, reactor=self.clock, metrics=self.metrics)
+
+    def test_counts_connections_and_state_durations(self):
+        self.assertEqual(self.metrics.transports.values, {('disconnected',): 1})
+        self.clock.advance(2)
+        self.conn.startService()
+        self.clock.advance(CONNECT_TIME)
+        self.assertEqual(self.metrics.connection_attempts.value(), 1)
+        self.assertEqual(self.metrics.connections.value(), 1)
+        self.assertEqual(self.metrics.transports.value(('connected',)), 1)
+        self.assertEqual(self.metrics.state_seconds.value(('disconnected',)), 2)
+
+        self.clock.advance(5)
+        self.proto.on_connection_lost.callback({})
+        self.assertEqual(self.metrics.disconnections.value(), 1)
+        self.assertEqual(self.metrics.state_seconds.value(('connected',)), 5)
+
+    def test_counts_pusher_errors(self):
+        self.conn.startService()
+        self.clock.advance(CONNECT_TIME)
+        self.proto.on_event(PUSHER_CONNECT_EVENT)
+        self.proto.on_event(FakeEvent(name='pusher:error', data={'code': 4201}))
+        self.assertEqual(self.metrics.errors.values, {(4201,): 1})
+        self.assertIn('pusher_errors_total{code="4201"} 1', self.metrics.render())
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+import mock
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+from twistedpusher.errors import ConnectionError
+from twistedpusher.events import Event, EventEmitter
+from twistedpusher.outbound import SendQueue, TokenBucket
+from twistedpusher.test.helpers import TEST_TIMEOUT
+
+
+class FakeConnection(EventEmitter):
+    def __init__(self, state='connected'):
+        super(FakeConnection, self).__init__()
+        self.state = state
+
+    def set_state(self, state):
+        self.state = state
+        self.emit_event(Event(name=state))
+
+
+def client_event(n):
+    return Event(name='client-update', channel='private-trades', data={'n': n})
+
+
+class TokenBucketTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.bucket = TokenBucket(rate=2, burst=3, reactor=self.clock)
+
+    def test_starts_full(self):
+        self.assertEqual(self.bucket.tokens, 3)
+        self.assertTrue(self.bucket.consume(3))
+        self.assertFalse(self.bucket.consume())
+
+    def test_refills_up_to_burst(self):
+        self.bucket.consume(3)
+        self.assertEqual(self.bucket.delay(), 0.5)
+        self.clock.advance(0.5)
+        self.assertTrue(self.bucket.consume())
+        self.clock.advance(10)
+        self.assertEqual(self.bucket.tokens, 3)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, TokenBucket, 0, 1, self.clock)
+        self.assertRaises(ValueError, TokenBucket, 1, 0, self.clock)
+
+
+class SendQueueTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.conn = FakeConnection()
+        self.transport = mock.Mock()
+        self.queue = SendQueue(self.conn, self.transport, rate=10, burst=2, max_buffered=3, frames_per_turn=3,
+                               reactor=self.clock)
+
+    def sent(self):
+        """Data of the client events written, per write."""
+        writes = []
+        for name, args, _ in self.transport.method_calls:
+            events = args[0] if name == 'send_events' else [args[0]]
+            writes.append([event.data.get('n', event.name) for event in events])
+        return writes
+
+    def test_sends_straight_away_when_idle(self):
+        self.queue.send([client_event(1)], batch=False)
+        self.transport.send_event.assert_called_once_with(client_event(1))
+        self.assertEqual(len(self.queue), 0)
+
+    def test_rate_limits_client_events(self):
+        self.queue.send([client_event(n) for n in range(5)])
+        self.assertEqual(self.sent(), [[0, 1]])
+        self.clock.advance(0.1)
+        self.assertEqual(self.sent(), [[0, 1], [2]])
+        self.clock.pump([0.1, 0.1])
+        self.assertEqual(self.sent(), [[0, 1], [2], [3], [4]])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_control_frames_not_rate_limited(self):
+        self.queue.send([client_event(n) for n in range(3)])
+        self.queue.send([Event(name='pusher:unsubscribe', data={'channel': 'trades'})])
+        self.clock.advance(0)
+        self.assertEqual(self.sent(), [[0, 1], ['pusher:unsubscribe']])
+
+    def test_buffers_while_reconnecting(self):
+        self.conn.set_state('connecting')
+        self.queue.send([client_event(n) for n in range(5)])
+        self.queue.send([Event(name='pusher:ping')])
+        self.assertEqual(self.queue.dropped, 2)
+        self.assertEqual(self.sent(), [])
+
+        self.conn.set_state('connected')
+        self.clock.advance(0)
+        self.assertEqual(self.sent(), [[2, 3]])
+        self.clock.advance(0.1)
+        self.assertEqual(self.sent(), [[2, 3], [4]])
+
+    def test_coalesces_control_frames(self):
+        self.conn.set_state('connecting')
+        for name in ('pusher:subscribe', 'pusher:unsubscribe', 'pusher:subscribe'):
+            self.queue.send([Event(name=name, data={'channel': 'trades'})])
+        self.queue.send([Event(name='pusher:subscribe', data={'channel': 'other'})])
+        self.conn.set_state('connected')
+        self.queue.send([Event(name='pusher:subscribe', data={'channel': 'trades'})])
+        self.clock.advance(0)
+        sent = self.transport.send_events.call_args[0][0]
+        self.assertEqual([(event.name, event.data['channel']) for event in sent],
+                         [('pusher:subscribe', 'other'), ('pusher:subscribe', 'trades')])
+
+    def test_flushes_at_most_frames_per_turn(self):
+        self.queue.bucket = None
+        self.conn.set_state('connecting')
+        self.queue.max_buffered = 10
+        self.queue.send([client_event(n) for n in range(5)])
+        self.conn.set_state('connected')
+        self.clock.advance(0)
+        self.assertEqual(self.sent(), [[0, 1, 2], [3, 4]])
+
+    def hold_subscriptions(self, *pending):
+        """Make the queue wait for the subscriptions of the channels given, returns their Deferreds by name."""
+        waiting = dict((name, defer.Deferred()) for name in pending)
+        self.queue.subscriptions = mock.Mock(**{'is_pending.side_effect': lambda name: not waiting[name].called,
+                                                'when_subscribed.side_effect': waiting.get})
+        return waiting
+
+    def test_holds_client_events_until_subscribed(self):
+        """Client events wait for their channel's subscription, those of other channels are sent meanwhile."""
+        self.queue.bucket = None
+        waiting = self.hold_subscriptions('private-trades', 'private-other')
+        waiting['private-other'].callback(None)
+        other = Event(name='client-update', channel='private-other', data={'n': 'other'})
+        self.queue.send([client_event(1)])
+        self.queue.send([other, client_event(2)])
+        self.clock.advance(0)
+        self.assertEqual(self.sent(), [['other']])
+        self.assertEqual(len(self.queue), 2)
+
+        waiting['private-trades'].callback(None)
+        self.queue.send([client_event(3)])
+        self.clock.advance(0)
+        self.assertEqual(self.sent(), [['other'], [1, 2, 3]])
+        self.assertEqual(self.queue.subscriptions.when_subscribed.call_count, 1)
+
+    def test_drops_held_events_if_subscription_fails(self):
+        waiting = self.hold_subscriptions('private-trades')
+        self.queue.send([client_event(1), client_event(2)])
+        self.clock.advance(0)
+        waiting['private-trades'].errback(defer.CancelledError())
+        self.assertEqual(self.queue.dropped, 2)
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual(self.sent(), [])
+
+    def test_held_events_count_against_buffer(self):
+        """Held client events take room in the buffer, the oldest of them is dropped when it is full."""
+        self.queue.bucket = None
+        waiting = self.hold_subscriptions('private-trades')
+        self.queue.send([client_event(n) for n in range(3)])
+        self.clock.advance(0)
+        self.conn.set_state('connecting')
+        self.queue.send([client_event(3), client_event(4)])
+        self.assertEqual((len(self.queue), self.queue.dropped), (3, 2))
+        self.conn.set_state('connected')
+        waiting['private-trades'].callback(None)
+        self.clock.advance(0)
+        self.assertEqual(self.sent(), [[2, 3, 4]])
+
+    def test_refuses_before_start_and_after_stop(self):
+        self.conn.state = 'initialized'
+        self.assertRaises(ConnectionError, self.queue.send, [client_event(1)])
+        self.conn.set_state('connecting')
+        self.queue.send([client_event(1)])
+        self.conn.set_state('disconnected')
+        self.assertEqual(len(self.queue), 0)
+        self.assertRaises(ConnectionError, self.queue.send, [client_event(1)])
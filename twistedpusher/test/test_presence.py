@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+from twisted.trial import unittest
+
+from twistedpusher.presence import MemberStore
+from twistedpusher.test.helpers import TEST_TIMEOUT
+
+
+class MemberStoreTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.store = MemberStore()
+
+    def test_add_and_remove(self):
+        self.assertTrue(self.store.add('a', {'name': 'A'}))
+        self.assertFalse(self.store.add('a', {'name': 'AA'}))
+        self.assertEqual(self.store['a'], {'name': 'AA'})
+        self.assertIn('a', self.store)
+        self.assertTrue(self.store.remove('a'))
+        self.assertFalse(self.store.remove('a'))
+        self.assertEqual(len(self.store), 0)
+
+    def test_load_returns_changes(self):
+        self.store.load({'count': 2, 'hash': {'a': None, 'b': None}})
+        added, removed = self.store.load({'count': 2, 'hash': {'b': None, 'c': {'name': 'C'}}})
+        self.assertEqual(added, {'c': {'name': 'C'}})
+        self.assertEqual(removed, ['a'])
+        self.assertEqual(sorted(self.store.keys()), ['b', 'c'])
+
+    def test_without_info(self):
+        store = MemberStore(store_info=False)
+        store.add('a', {'name': 'A'})
+        self.assertIsNone(store['a'])
+        self.assertIsNone(store.get('b'))
+
+    def test_members_beyond_the_limit_are_counted(self):
+        store = MemberStore(max_members=2)
+        for user_id in 'abc':
+            self.assertTrue(store.add(user_id))
+        self.assertEqual((len(store), store.count, store.complete), (2, 3, False))
+        self.assertNotIn('c', store)
+        self.assertTrue(store.remove('c'))
+        self.assertEqual((store.count, store.complete), (2, True))
+        self.assertFalse(store.remove('c'))
+
+    def test_load_counts_members_missing_from_the_hash(self):
+        self.store.load({'count': 5, 'hash': {'a': None}})
+        self.assertEqual((len(self.store), self.store.count), (1, 5))
+
+    def test_max_members_validated(self):
+        self.assertRaises(ValueError, MemberStore, max_members=0)
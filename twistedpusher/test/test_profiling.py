@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+import mock
+import weakref
+from twisted.trial import unittest
+from zope.interface.verify import verifyClass
+
+from twistedpusher import events
+from twistedpusher.events import Event, EventEmitter, listener_name
+from twistedpusher.interfaces import IListenerProfiler
+from twistedpusher.profiling import ListenerProfiler
+from twistedpusher.test.helpers import TEST_TIMEOUT
+
+
+def slow_listener(event):
+    pass
+
+
+def fast_listener(event):
+    pass
+
+
+def failing_listener(event):
+    raise ValueError()
+
+
+def make_listener():
+    def on_trade(event):
+        pass
+    return on_trade
+
+
+LISTENER_NAME = 'twistedpusher.test.test_profiling.on_trade'
+
+
+class ListenerProfilerTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.profiler = ListenerProfiler()
+        self.em = EventEmitter()
+        self.em.profiler = self.profiler
+
+    def test_implements_interface(self):
+        verifyClass(IListenerProfiler, ListenerProfiler)
+
+    @mock.patch('twistedpusher.profiling.cpu_time_ns', side_effect=[0, 5, 0, 1, 0, 2])
+    @mock.patch('twistedpusher.profiling.monotonic_ns', side_effect=[0, 30, 0, 10, 0, 20])
+    def test_records_per_listener_and_event(self, _, __):
+        self.em.bind('a', slow_listener)
+        self.em.emit_event(Event(name='a'))
+        self.em.unbind('a', slow_listener)
+        self.em.bind('a', fast_listener)
+        self.em.bind('b', fast_listener)
+        self.em.emit_event(Event(name='a'))
+        self.em.emit_event(Event(name='b'))
+
+        top = self.profiler.top()
+        self.assertEqual([entry['listener'] for entry in top],
+                         ['twistedpusher.test.test_profiling.slow_listener',
+                          'twistedpusher.test.test_profiling.fast_listener'])
+        self.assertEqual(top[1], {'listener': 'twistedpusher.test.test_profiling.fast_listener', 'calls': 2,
+                                  'wall_total_ns': 30, 'wall_max_ns': 20, 'wall_mean_ns': 15,
+                                  'cpu_total_ns': 3, 'cpu_max_ns': 2})
+        self.assertEqual(self.profiler.top(1, by='cpu_max_ns')[0]['cpu_max_ns'], 5)
+        self.assertEqual([(entry['event'], entry['calls']) for entry in self.profiler.top_events()],
+                         [('a', 2), ('b', 1)])
+
+    def test_sampling(self):
+        self.profiler.sample_every = 10
+        listener = mock.Mock()
+        self.em.bind('a', listener)
+        for _ in range(25):
+            self.em.emit_event(Event(name='a'))
+        self.assertEqual(listener.call_count, 25)
+        self.assertEqual(self.profiler.listeners[listener_name(listener)].calls, 3)
+
+    def test_failing_listener_recorded_and_handled(self):
+        self.em.error_policy = events.ListenerErrorPolicy()
+        self.em.bind('a', failing_listener)
+        self.em.emit_event(Event(name='a'))
+        self.assertEqual(self.em.error_policy.failures[failing_listener], 1)
+        self.assertEqual(self.profiler.listeners[listener_name(failing_listener)].calls, 1)
+
+    def test_keeps_no_listener_alive(self):
+        """Listeners are recorded by name: those made for each channel add up and can be collected."""
+        for _ in range(3):
+            listener = make_listener()
+            ref = weakref.ref(listener)
+            self.em.bind('a', listener)
+            self.em.emit_event(Event(name='a'))
+            self.em.unbind('a', listener)
+            del listener
+            self.assertIsNone(ref())
+        self.assertEqual(list(self.profiler.listeners), [LISTENER_NAME])
+        self.assertEqual(self.profiler.listeners[LISTENER_NAME].calls, 3)
+
+    def test_entries_are_bounded(self):
+        self.profiler.max_entries = 2
+        self.em.bind_all(fast_listener)
+        for name in ('a', 'b', 'c', 'd'):
+            self.em.emit_event(Event(name=name))
+        self.assertEqual(sorted((entry['event'], entry['calls']) for entry in self.profiler.top_events()),
+                         [('<others>', 2), ('a', 1), ('b', 1)])
+
+    def test_unknown_sort_key(self):
+        self.assertRaises(ValueError, self.profiler.top, 5, 'nope')
+
+    def test_invalid_sampling(self):
+        self.assertRaises(ValueError, ListenerProfiler, 0)
+
+    def test_profiler_set_on_class(self):
+        self.patch(EventEmitter, 'profiler', ListenerProfiler())
+        em = EventEmitter()
+        em.bind('a', fast_listener)
+        em.emit_event(Event(name='a'))
+        self.assertEqual(EventEmitter.profiler.listeners[listener_name(fast_listener)].calls, 1)
+
+    def test_reset(self):
+        self.em.bind('a', fast_listener)
+        self.em.emit_event(Event(name='a'))
+        self.profiler.reset()
+        self.assertEqual(self.profiler.top(), [])
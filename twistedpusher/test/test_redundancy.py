@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+import mock
+from twisted.trial import unittest
+from twisted.internet import task
+
+from twistedpusher.errors import ConnectionError
+from twistedpusher.events import Event
+from twistedpusher.dedup import DeduplicationWindow, event_fingerprint
+from twistedpusher.redundancy import RedundantPusherService
+from twistedpusher.test.helpers import TEST_TIMEOUT, connect_service
+
+
+def make_event(name='trade', channel='trades', data='{"price": 1}'):
+    return Event(name=name, channel=channel, data=data)
+
+
+class DeduplicationWindowTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def test_first_arrival_wins(self):
+        window = DeduplicationWindow(2)
+        self.assertTrue(window.is_new('a', 1))
+        self.assertFalse(window.is_new('a', 0))
+        self.assertEqual(window.duplicates, 1)
+
+    def test_repeated_events_are_kept(self):
+        """An event sent twice is delivered twice, each copy once."""
+        window = DeduplicationWindow(2)
+        self.assertEqual([window.is_new('a', replica) for replica in (0, 0, 1, 1)], [True, True, False, False])
+        self.assertEqual([window.is_new('a', replica) for replica in (1, 0)], [True, False])
+
+    def test_bounded(self):
+        window = DeduplicationWindow(2, max_size=2)
+        for fingerprint in 'abc':
+            window.is_new(fingerprint, 0)
+        self.assertEqual(len(window), 2)
+        # 'a' was forgotten
+        self.assertTrue(window.is_new('a', 1))
+
+    def test_fingerprint(self):
+        self.assertEqual(event_fingerprint(make_event()), event_fingerprint(make_event()))
+        self.assertNotEqual(event_fingerprint(make_event()), event_fingerprint(make_event(data='{"price": 2}')))
+        self.assertNotEqual(event_fingerprint(make_event()), event_fingerprint(make_event(channel='other')))
+        self.assertEqual(event_fingerprint(make_event(data={'a': 1})), event_fingerprint(make_event(data={'a': 1})))
+
+
+class RedundantPusherServiceTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.service = RedundantPusherService('key', replicas=2, reactor=self.clock)
+        self.listener = mock.Mock()
+
+    def test_subscribes_every_replica(self):
+        chan = self.service.subscribe('trades')
+        self.assertIs(self.service.channel('trades'), chan)
+        for replica in self.service.replicas:
+            self.assertIn('trades', replica.channels)
+            self.assertIsNot(replica.channel('trades'), chan)
+            connect_service(replica, self.clock)
+        self.service.unsubscribe('trades')
+        self.assertEqual([replica.channels for replica in self.service.replicas], [{}, {}])
+        self.assertRaises(ValueError, self.service.channel, 'trades')
+
+    def test_merges_first_arrival(self):
+        chan = self.service.subscribe('trades')
+        chan.bind('trade', self.listener)
+        self.service.bind_all(self.listener)
+        first, second = self.service.replicas
+        second._on_event(make_event())
+        first._on_event(make_event())
+        first._on_event(make_event(data='{"price": 2}'))
+        second._on_event(make_event(data='{"price": 2}'))
+        self.assertEqual([c[0][0].data for c in self.listener.call_args_list],
+                         ['{"price": 1}', '{"price": 1}', '{"price": 2}', '{"price": 2}'])
+        self.assertEqual(self.service.duplicates, 2)
+
+    def test_failover_is_gapless(self):
+        """Events keep arriving from the other replica while one is down."""
+        chan = self.service.subscribe('trades')
+        chan.bind('trade', self.listener)
+        for price in range(3):
+            self.service.replicas[1]._on_event(make_event(data=str(price)))
+        self.assertEqual(self.listener.call_count, 3)
+
+    def test_json_data_decoded_by_merged_channel(self):
+        chan = self.service.subscribe('trades', json_data=True)
+        chan.bind('trade', self.listener)
+        self.service.replicas[0]._on_event(make_event())
+        self.assertEqual(self.listener.call_args[0][0].data, {'price': 1})
+        self.assertEqual([replica.factory.json_data_channels for replica in self.service.replicas], [set(), set()])
+
+    def test_merged_presence_channel_tracks_members(self):
+        """The merged channel gets the internal events the replica channels handle, and loads members from them."""
+        chan = self.service.subscribe('presence-room')
+        chan.bind('pusher:subscription_succeeded', self.listener)
+        chan.bind('pusher:member_added', self.listener)
+        presence = {'presence': {'hash': {'a': None}, 'count': 1}}
+        for replica in self.service.replicas:
+            replica._on_event(Event(name='pusher_internal:subscription_succeeded', channel='presence-room',
+                                    data=dict(presence)))
+            self.assertEqual(dict(replica.channel('presence-room').members), {'a': None})
+        self.assertEqual(dict(chan.members), {'a': None})
+        for replica in reversed(self.service.replicas):
+            replica._on_event(Event(name='pusher_internal:member_added', channel='presence-room',
+                                    data={'user_id': 'b', 'user_info': {}}))
+        self.assertEqual(dict(chan.members), {'a': None, 'b': {}})
+        self.assertEqual([c[0][0].name for c in self.listener.call_args_list],
+                         ['pusher:subscription_succeeded', 'pusher:member_added'])
+        self.assertEqual(self.service.duplicates, 2)
+
+    def test_send_event_uses_connected_replica(self):
+        connections = self.service.connections
+        connections[1]._state = 'connected'
+        event = Event(name='client-test')
+        with mock.patch.object(connections[1], 'send_event') as send:
+            self.service.send_event(event)
+        send.assert_called_once_with(event)
+        connections[1]._state = 'disconnected'
+        self.assertRaises(ConnectionError, self.service.send_event, event)
+
+    def test_bad_arguments(self):
+        self.assertRaises(ValueError, RedundantPusherService, 'key', replicas=0, reactor=task.Clock())
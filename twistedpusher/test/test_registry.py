@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import mock
+from twisted.trial import unittest
+
+from twistedpusher.channel import Channel
+from twistedpusher.connection import Connection
+from twistedpusher.events import Event
+from twistedpusher.registry import ChannelRegistry
+from twistedpusher.subscriptions import SubscriptionManager
+from twistedpusher.test.helpers import TEST_TIMEOUT
+
+
+class ChannelRegistryTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.conn = mock.Mock(spec=Connection)
+        self.subscriptions = mock.Mock(spec=SubscriptionManager)
+        self.json_data_channels = set()
+        self.registry = ChannelRegistry(self.subscriptions, self.json_data_channels)
+        self.chan = Channel('trades', self.conn)
+
+    def test_add(self):
+        self.registry.add(self.chan, json_data=True)
+        self.assertIn('trades', self.registry)
+        self.assertEqual(list(self.registry), ['trades'])
+        self.assertEqual(self.json_data_channels, {'trades'})
+        self.subscriptions.add.assert_called_once_with(self.chan)
+
+    def test_remove_cleans_up(self):
+        self.registry.add(self.chan, json_data=True)
+        self.assertIs(self.registry.remove('trades'), self.chan)
+        self.assertEqual(len(self.registry), 0)
+        self.assertEqual(self.json_data_channels, set())
+        self.subscriptions.remove.assert_called_once_with('trades')
+        self.assertRaises(KeyError, self.registry.remove, 'trades')
+
+    def test_dispatch(self):
+        self.registry.add(self.chan)
+        listener = mock.Mock()
+        self.chan.bind('trade', listener)
+        event = Event(name='trade', channel='trades', data={})
+        self.assertIs(self.registry.dispatch(event), self.chan)
+        listener.assert_called_once_with(event)
+        self.assertIsNone(self.registry.dispatch(Event(name='trade', channel='other', data={})))
+        self.assertIsNone(self.registry.dispatch(Event(name='pusher:pong', data={})))
+        self.assertFalse(self.subscriptions.acknowledge.called)
+
+    def test_dispatch_acknowledges_subscription(self):
+        """Acknowledgements are routed to the subscription manager after the channel's listeners ran."""
+        self.registry.add(self.chan)
+        listener = mock.Mock()
+        self.chan.bind('pusher:subscription_succeeded', listener)
+        self.registry.dispatch(Event(name='pusher_internal:subscription_succeeded', channel='trades', data={}))
+        self.assertTrue(listener.called)
+        self.subscriptions.acknowledge.assert_called_once_with('trades')
+
+    def test_channels_do_not_bind_connection(self):
+        for _ in range(3):
+            self.registry.add(Channel('trades', self.conn))
+            self.registry.remove('trades')
+        self.assertFalse(self.conn.bind.called)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+import mock
+from twisted.trial import unittest
+from twisted.internet import task
+
+from twistedpusher import sharding
+from twistedpusher.events import Event
+from twistedpusher.sharding import ShardedPusherService
+from twistedpusher.test.helpers import TEST_TIMEOUT, connect_service
+
+
+class ShardedPusherServiceTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def make_service(self, **kwargs):
+        self.clock = task.Clock()
+        return ShardedPusherService('key', reactor=self.clock, **kwargs)
+
+    def connect(self, service):
+        for shard in service.shards:
+            connect_service(shard, self.clock)
+
+    def test_one_connection_per_shard(self):
+        service = self.make_service(shards=3)
+        self.assertEqual(len(service.shards), 3)
+        self.assertEqual(len(set(map(id, service.connections))), 3)
+        self.assertEqual(list(service), service.shards)
+
+    def test_hash_assignment_is_stable(self):
+        service = self.make_service(shards=4)
+        other = self.make_service(shards=4)
+        names = ['channel-' + a + b for a in 'abcd' for b in 'abcde']
+        for name in names:
+            service.subscribe(name)
+        self.assertEqual([service.shards.index(service.shard_for(name)) for name in names],
+                         [other.shards.index(other.shard_for(name)) for name in names])
+        self.assertTrue(all(len(shard.channels) for shard in service.shards))
+
+    def test_hash_assignment_is_unsigned_crc32(self):
+        """Shards don't depend on the sign of crc32, which differs between Python 2 and 3."""
+        service = self.make_service(shards=3)
+        self.assertEqual([service.shards.index(service.shard_for(name))
+                          for name in ('live_trades', 'order_book', 'diff_order_book')], [2, 0, 1])
+
+    def test_least_loaded_assignment(self):
+        service = self.make_service(shards=2, assignment='least-loaded')
+        for name in ('a', 'b', 'c', 'd'):
+            service.subscribe(name)
+        self.assertEqual([len(shard.channels) for shard in service.shards], [2, 2])
+        self.connect(service)
+        service.unsubscribe('a')
+        service.unsubscribe('c')
+        self.assertEqual([len(shard.channels) for shard in service.shards], [0, 2])
+        service.subscribe('e')
+        self.assertIn('e', service.shards[0].channels)
+
+    def test_subscribe_and_lookup(self):
+        service = self.make_service()
+        chan = service.subscribe('trades', json_data=True)
+        shard = service.shard_for('trades')
+        self.assertIs(service.channel('trades'), chan)
+        self.assertIs(shard.channel('trades'), chan)
+        self.assertEqual(shard.factory.json_data_channels, {'trades'})
+        self.assertRaises(ValueError, service.channel, 'other')
+
+    def test_subscribe_twice_warns(self):
+        service = self.make_service()
+        chan = service.subscribe('trades')
+        self.assertIs(self.assertWarns(UserWarning, "Already subscribed to channel trades", sharding.__file__,
+                                       service.subscribe, 'trades'), chan)
+
+    def test_unsubscribe(self):
+        service = self.make_service()
+        service.subscribe('trades')
+        shard = service.shard_for('trades')
+        self.connect(service)
+        service.unsubscribe('trades')
+        self.assertEqual(service.channels, {})
+        self.assertEqual(shard.channels, {})
+
+    def test_bind_all_receives_events_of_every_shard(self):
+        service = self.make_service(shards=2, assignment='least-loaded')
+        listener = mock.Mock()
+        service.bind_all(listener)
+        service.subscribe('a')
+        service.subscribe('b')
+        events = [Event(name='trade', channel=name, data={}) for name in ('a', 'b')]
+        for shard, event in zip(service.shards, events):
+            shard._on_event(event)
+        self.assertEqual(listener.call_args_list, [mock.call(event) for event in events])
+
+    def test_shard_stats(self):
+        service = self.make_service(shards=2)
+        service.subscribe('a')
+        stats = service.shard_stats()
+        self.assertEqual(sum(shard['channels'] for shard in stats), 1)
+        self.assertEqual(stats[0]['state'], 'initialized')
+
+    def test_bad_arguments(self):
+        self.assertRaises(ValueError, self.make_service, shards=0)
+        self.assertRaises(ValueError, self.make_service, assignment='random')
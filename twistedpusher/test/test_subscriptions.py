@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+import mock
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+from twistedpusher.channel import Channel, PrivateChannel
+from twistedpusher.errors import SubscriptionTimeoutError, AuthorizationError
+from twistedpusher.events import Event, EventEmitter
+from twistedpusher.outbound import SendQueue
+from twistedpusher.subscriptions import SubscriptionManager
+from twistedpusher.test.helpers import TEST_TIMEOUT
+
+
+class FakeConnection(EventEmitter):
+    def __init__(self):
+        super(FakeConnection, self).__init__()
+        self.state = 'initialized'
+        self.socket_id = '1.1'
+        self.send_events = mock.Mock()
+
+    def set_state(self, state):
+        self.state = state
+        self.emit_event(Event(name=state))
+
+
+class SubscriptionManagerTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.conn = FakeConnection()
+        self.manager = SubscriptionManager(self.conn, timeout=5, retries=1, reactor=self.clock)
+
+    def make_channel(self, name):
+        return Channel(name, self.conn, reactor=self.clock)
+
+    def sent_channels(self, call=-1):
+        return [event.data['channel'] for event in self.conn.send_events.call_args_list[call][0][0]]
+
+    def test_subscriptions_of_one_iteration_share_a_write(self):
+        self.conn.set_state('connected')
+        for name in ('a', 'b', 'c'):
+            self.manager.add(self.make_channel(name))
+        self.assertFalse(self.conn.send_events.called)
+        self.clock.advance(0)
+        self.assertEqual(self.conn.send_events.call_count, 1)
+        self.assertEqual(self.sent_channels(), ['a', 'b', 'c'])
+
+    def test_deferred_fires_on_acknowledgement(self):
+        self.conn.set_state('connected')
+        chan = self.make_channel('a')
+        self.manager.add(chan)
+        d = self.manager.when_subscribed('a')
+        self.clock.advance(0)
+        self.assertNoResult(d)
+        self.manager.acknowledge(chan.name)
+        self.assertIs(self.successResultOf(d), chan)
+        self.assertIs(self.successResultOf(self.manager.when_subscribed('a')), chan)
+        self.assertEqual(self.manager.pending, set())
+
+    def test_waits_for_connection(self):
+        self.manager.add(self.make_channel('a'))
+        self.manager.add(self.make_channel('b'))
+        self.clock.advance(0)
+        self.assertFalse(self.conn.send_events.called)
+        self.conn.set_state('connected')
+        self.assertEqual(self.sent_channels(), ['a', 'b'])
+
+    def test_resubscribes_everything_on_reconnect(self):
+        self.conn.set_state('connected')
+        channels = [self.make_channel(name) for name in ('a', 'b')]
+        for chan in channels:
+            self.manager.add(chan)
+        self.clock.advance(0)
+        for chan in channels:
+            self.manager.acknowledge(chan.name)
+        self.conn.set_state('connecting')
+        self.assertEqual(self.manager.pending, {'a', 'b'})
+        self.conn.set_state('connected')
+        self.assertEqual(self.conn.send_events.call_count, 2)
+        self.assertEqual(sorted(self.sent_channels()), ['a', 'b'])
+        self.clock.advance(2)
+        for chan in channels:
+            self.manager.acknowledge(chan.name)
+        self.assertEqual(self.manager.last_subscribe_duration, 2)
+
+    def test_acknowledgements_do_not_scan_channels(self):
+        """Acknowledging each of many channels takes constant time, the pending set is kept up to date."""
+        names = ['chan-' + first + second + third for first in 'abcdefghij' for second in 'abcdefghij'
+                 for third in 'abcdefghij']
+        self.conn.set_state('connected')
+        for name in names:
+            self.manager.add(self.make_channel(name))
+        self.clock.advance(0)
+        self.manager.remove(names.pop())
+        with mock.patch.object(self.manager, 'subscriptions', mock.Mock(wraps=self.manager.subscriptions)) as subs:
+            for name in names[:-1]:
+                self.manager.acknowledge(name)
+            self.assertEqual(self.manager.pending, {names[-1]})
+            self.assertIsNone(self.manager.last_subscribe_duration)
+            self.manager.acknowledge(names[-1])
+        self.assertEqual(self.manager.pending, set())
+        self.assertEqual(self.manager.last_subscribe_duration, 0)
+        self.assertEqual([call[0] for call in subs.method_calls], ['get'] * len(names))
+
+    def test_retry_then_timeout(self):
+        self.conn.set_state('connected')
+        self.manager.add(self.make_channel('a'))
+        d = self.manager.when_subscribed('a')
+        self.clock.advance(0)
+        self.clock.advance(5)
+        self.clock.advance(0)
+        self.assertEqual(self.conn.send_events.call_count, 2)
+        self.assertNoResult(d)
+        self.clock.advance(5)
+        self.failureResultOf(d, SubscriptionTimeoutError)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertFalse(self.manager.is_pending('a'))
+
+    def test_disconnect_stops_timeouts(self):
+        self.conn.set_state('connected')
+        self.manager.add(self.make_channel('a'))
+        d = self.manager.when_subscribed('a')
+        self.clock.advance(0)
+        self.conn.set_state('connecting')
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertNoResult(d)
+
+    def test_remove_cancels_waiters(self):
+        self.conn.set_state('connected')
+        chan = self.make_channel('a')
+        self.manager.add(chan)
+        d = self.manager.when_subscribed('a')
+        self.manager.remove('a')
+        self.clock.advance(0)
+        self.assertFalse(self.conn.send_events.called)
+        self.failureResultOf(d, defer.CancelledError)
+        self.assertEqual(self.manager.subscriptions, {})
+
+
+class FakeAuthorizer(object):
+    def __init__(self):
+        self.requests = []
+
+    def authorize(self, socket_id, channel_names):
+        d = defer.Deferred()
+        self.requests.append((socket_id, channel_names, d))
+        return d
+
+
+class AuthorizedSubscriptionTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.conn = FakeConnection()
+        self.authorizer = FakeAuthorizer()
+        self.manager = SubscriptionManager(self.conn, timeout=5, retries=1, reactor=self.clock,
+                                           authorizer=self.authorizer)
+        self.conn.set_state('connected')
+
+    def add(self, *names):
+        channels = []
+        for name in names:
+            cls = PrivateChannel if name.startswith('private-') else Channel
+            channels.append(cls(name, self.conn, reactor=self.clock))
+            self.manager.add(channels[-1])
+        self.clock.advance(0)
+        return channels
+
+    def sent(self, call=-1):
+        return [event.data for event in self.conn.send_events.call_args_list[call][0][0]]
+
+    def test_public_channels_do_not_wait_for_authorization(self):
+        self.add('a', 'private-b', 'private-c')
+        self.assertEqual(self.sent(), [{'channel': 'a'}])
+        self.assertEqual(self.authorizer.requests[0][:2], ('1.1', ['private-b', 'private-c']))
+
+    def test_authorized_channels_are_sent_together(self):
+        self.add('private-b', 'private-c')
+        self.assertFalse(self.conn.send_events.called)
+        self.authorizer.requests[0][2].callback({'private-b': {'auth': 'k:b'}, 'private-c': {'auth': 'k:c'}})
+        self.assertEqual(self.sent(), [{'channel': 'private-b', 'auth': 'k:b'},
+                                       {'channel': 'private-c', 'auth': 'k:c'}])
+        self.assertEqual(self.conn.send_events.call_count, 1)
+
+    def test_refused_channel(self):
+        chan, = self.add('private-b')
+        errors = []
+        chan.bind('pusher:subscription_error', lambda event: errors.append(event.data))
+        d = self.manager.when_subscribed('private-b')
+        self.authorizer.requests[0][2].callback({})
+        self.failureResultOf(d, AuthorizationError)
+        self.assertEqual(len(errors), 1)
+        self.assertFalse(self.conn.send_events.called)
+        self.assertFalse(self.manager.is_pending('private-b'))
+
+    def test_refused_channel_drops_held_client_events(self):
+        """Client events waiting for a refused subscription are dropped, later ones aren't held."""
+        transport = mock.Mock()
+        queue = SendQueue(self.conn, transport, rate=None, reactor=self.clock)
+        queue.subscriptions = self.manager
+        self.add('private-b')
+        queue.send([Event(name='client-update', channel='private-b', data={})])
+        self.clock.advance(0)
+        self.assertEqual(len(queue), 1)
+        self.authorizer.requests[0][2].callback({})
+        self.assertEqual((len(queue), queue.dropped), (0, 1))
+        queue.send([Event(name='client-update', channel='private-b', data={})])
+        self.assertEqual(transport.send_events.call_count, 1)
+
+    def test_authorization_failure(self):
+        self.add('private-b')
+        d = self.manager.when_subscribed('private-b')
+        self.authorizer.requests[0][2].errback(AuthorizationError('endpoint down'))
+        self.failureResultOf(d, AuthorizationError)
+
+    def test_stale_authorization_is_discarded(self):
+        """Signatures requested for a previous connection aren't sent, the new socket ID is authorized."""
+        self.add('private-b')
+        self.conn.set_state('connecting')
+        self.conn.socket_id = '2.2'
+        self.conn.set_state('connected')
+        self.authorizer.requests[0][2].callback({'private-b': {'auth': 'k:old'}})
+        self.assertFalse(self.conn.send_events.called)
+        self.assertEqual(self.authorizer.requests[1][:2], ('2.2', ['private-b']))
+
+    def test_no_authorizer(self):
+        self.manager.authorizer = None
+        self.manager.add(PrivateChannel('private-b', self.conn, reactor=self.clock))
+        d = self.manager.when_subscribed('private-b')
+        self.clock.advance(0)
+        self.failureResultOf(d, AuthorizationError)
@@ -1,12 +1,13 @@
 #!/usr/bin/env python
 
 import mock
+import random
 from twisted.trial import unittest
 from zope.interface.verify import verifyClass, verifyObject
 from twisted.internet import task
 
 from twistedpusher.interfaces import IPusherTransport
-from twistedpusher.transport import Transport
+from twistedpusher.transport import Transport, BackoffPolicy
 
 from twistedpusher.test.helpers import TEST_TIMEOUT
 
@@ -24,3 +25,55 @@ class TransportTestCase(unittest.TestCase):
         """IPusherTransport is implemented"""
         verifyClass(IPusherTransport, Transport)
         verifyObject(IPusherTransport, self.tr)
+
+
+class BackoffPolicyTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.policy = BackoffPolicy(base=1, cap=10, rng=random.Random(0))
+
+    def test_first_attempt_immediate(self):
+        self.assertEqual(self.policy.next_delay(), 0)
+
+    def test_decorrelated_jitter(self):
+        """Retries wait between base and three times the previous delay, up to the cap."""
+        self.policy.next_delay()
+        previous = 1
+        delays = []
+        for _ in range(50):
+            delay = self.policy.next_delay()
+            self.assertTrue(1 <= delay <= min(10, previous * 3))
+            previous = delay
+            delays.append(delay)
+        self.assertEqual(max(delays), 10)
+        self.assertTrue(len(set(delays)) > 1)
+
+    def test_first_attempt_after_loss_is_jittered(self):
+        self.policy.next_delay()
+        self.policy.reset()
+        delay = self.policy.next_delay()
+        self.assertTrue(0 < delay <= 1)
+        other = BackoffPolicy(rng=random.Random(1))
+        other.reset()
+        self.assertNotEqual(other.next_delay(), delay)
+
+    def test_fast_retry(self):
+        policy = BackoffPolicy(fast_retry_window=0.5, fast_retries=2, rng=random.Random(0))
+        for _ in range(5):
+            policy.next_delay()
+        policy.fast_retry()
+        self.assertTrue(all(policy.next_delay() <= 0.5 for _ in range(2)))
+        self.assertTrue(policy.next_delay() >= 1)
+
+    def test_transport_uses_policy(self):
+        policy = mock.Mock(spec=BackoffPolicy)
+        policy.next_delay.return_value = 4
+        clock = task.Clock()
+        endpoint = mock.Mock()
+        tr = Transport('fake_factory', endpoint, on_pusher_event=mock.Mock(), reactor=clock, backoff=policy)
+        tr.startService()
+        clock.advance(3)
+        self.assertFalse(endpoint.connect.called)
+        clock.advance(1)
+        self.assertTrue(endpoint.connect.called)
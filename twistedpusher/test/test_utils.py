@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+import mock
+from twisted.trial import unittest
+from twisted.internet import task
+
+from twistedpusher.test.helpers import TEST_TIMEOUT
+from twistedpusher.utils import Timeout, TimerWheel
+
+
+class TimeoutTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.callback = mock.Mock()
+        self.timeout_ = Timeout(10, self.callback, reactor=self.clock)
+
+    def test_triggers_after_duration(self):
+        self.timeout_.start('a', b=1)
+        self.clock.advance(9)
+        self.assertFalse(self.callback.called)
+        self.clock.advance(1)
+        self.callback.assert_called_once_with('a', b=1)
+        self.assertTrue(self.timeout_.timed_out)
+        self.assertFalse(self.timeout_.active)
+
+    def test_reset_pushes_deadline_back(self):
+        self.timeout_.start()
+        self.clock.advance(8)
+        self.timeout_.reset()
+        self.clock.advance(9)
+        self.assertFalse(self.callback.called)
+        self.clock.advance(1)
+        self.assertEqual(self.callback.call_count, 1)
+
+    def test_reset_to_shorter_duration(self):
+        self.timeout_.start()
+        self.timeout_.reset(3)
+        self.clock.advance(3)
+        self.assertEqual(self.callback.call_count, 1)
+
+    def test_start_at(self):
+        self.timeout_.start_at(20)
+        self.timeout_.start_at(5)
+        self.clock.advance(5)
+        self.assertEqual(self.callback.call_count, 1)
+        self.assertFalse(self.timeout_.active)
+
+    def test_stop(self):
+        self.timeout_.start()
+        self.timeout_.stop()
+        self.clock.advance(20)
+        self.assertFalse(self.callback.called)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_fires_at_most_one_tick_late(self):
+        self.clock.advance(0.5)
+        self.timeout_.start()
+        self.clock.advance(10)
+        self.assertFalse(self.callback.called)
+        self.clock.advance(0.5)
+        self.assertEqual(self.callback.call_count, 1)
+
+    def test_timeouts_share_the_reactor_wheel(self):
+        other = Timeout(10, self.callback, reactor=self.clock)
+        self.assertIs(other.wheel, self.timeout_.wheel)
+        self.timeout_.start()
+        other.start()
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+
+
+class TimerWheelTestCase(unittest.TestCase):
+    timeout = TEST_TIMEOUT
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.wheel = TimerWheel(resolution=1, slots=8, reactor=self.clock)
+
+    def make_timeout(self, duration, callback):
+        return Timeout(duration, callback, reactor=self.clock, wheel=self.wheel)
+
+    def test_timers_beyond_one_turn(self):
+        callback = mock.Mock()
+        self.make_timeout(20, callback).start()
+        self.clock.advance(19)
+        self.assertFalse(callback.called)
+        self.clock.advance(1)
+        self.assertEqual(callback.call_count, 1)
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_resets_do_not_reschedule(self):
+        timeout = self.make_timeout(5, mock.Mock())
+        timeout.start()
+        call = self.clock.getDelayedCalls()[0]
+        for _ in range(100):
+            timeout.reset()
+        self.assertEqual(self.clock.getDelayedCalls(), [call])
+
+    def test_callback_stopping_timer_due_on_same_tick(self):
+        second_callback = mock.Mock()
+        second = self.make_timeout(5, second_callback)
+        first = self.make_timeout(5, second.stop)
+        first.start()
+        second.start()
+        # whichever fires first, the other must not be fired once stopped
+        self.clock.advance(5)
+        self.assertFalse(first.active or second.active)
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_callback_error_does_not_stop_the_wheel(self):
+        callback = mock.Mock()
+        self.make_timeout(1, mock.Mock(side_effect=ValueError)).start()
+        self.make_timeout(2, callback).start()
+        self.clock.advance(2)
+        self.assertEqual(callback.call_count, 1)
+        self.flushLoggedErrors(ValueError)
+
+    def test_stops_ticking_when_empty(self):
+        self.make_timeout(1, mock.Mock()).start()
+        self.clock.advance(1)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
@@ -5,6 +5,7 @@ from twisted.trial import unittest
 from twisted.internet import defer
 from zope.interface.verify import verifyClass, verifyObject
 
+from twistedpusher.events import Event, serialize_pusher_event
 from twistedpusher.websocket import PusherWebsocketProtocol
 from twistedpusher.interfaces import IPusherProtocol
 from twistedpusher.test.helpers import TEST_TIMEOUT
@@ -34,5 +35,48 @@ class WebsocketProtocolTestCase(unittest.TestCase):
         self.pr.onMessage('{"event": "pusher:none"}', False)
         self.m.assert_called_once_with({'name': 'pusher:none', 'data': {}})
 
+    @mock.patch('twistedpusher.core.monotonic_ns', side_effect=[10, 25])
+    def test_on_message_stamps_events(self, _):
+        self.pr.on_event = self.m
+        self.pr.onMessage('{"event": "pusher:none"}', False)
+        event = self.m.call_args[0][0]
+        self.assertEqual((event.received_ns, event.parsed_ns), (10, 25))
+
+    def test_send_events_writes_once(self):
+        """Frames of send_events are collected and written to the transport together."""
+        self.pr.sendMessage = lambda payload: self.pr.sendData(payload.encode('utf8'))
+        events = [Event(name='a'), Event(name='b')]
+        with mock.patch('twistedpusher.websocket.WebSocketClientProtocol.sendData') as send_data:
+            self.pr.send_events(events)
+        expected = b''.join(serialize_pusher_event(event).encode('utf8') for event in events)
+        send_data.assert_called_once_with(self.pr, expected)
+        self.assertIsNone(self.pr._write_batch)
+
+    def test_on_message_decodes_json_data_channels(self):
+        """Client event data is decoded while loading for channels registered with the factory."""
+        self.pr.factory = mock.Mock(json_data_channels={'trades'}, channel_filter=None)
+        self.pr.on_event = self.m
+        self.pr.onMessage('{"event": "trade", "channel": "trades", "data": "{\\"a\\": 1}"}', False)
+        self.m.assert_called_once_with({'name': 'trade', 'channel': 'trades', 'data': {'a': 1}})
+
+    def test_on_message_drops_filtered_channels(self):
+        """Frames for channels missing from the factory's channel_filter are dropped without being loaded."""
+        self.pr.factory = mock.Mock(json_data_channels=set(), channel_filter={'trades'})
+        self.pr.on_event = self.m
+        with mock.patch('twistedpusher.core.load_pusher_event') as load:
+            self.pr.onMessage('{"event": "trade", "data": "{}", "channel": "other"}', False)
+        self.assertFalse(load.called)
+        self.assertFalse(self.m.called)
+        self.assertEqual(self.pr.dropped_frames, 1)
+
+    def test_on_message_passes_allowed_and_pusher_events(self):
+        """Frames for channels in channel_filter and events without a channel are delivered."""
+        self.pr.factory = mock.Mock(json_data_channels=set(), channel_filter={'trades'})
+        self.pr.on_event = self.m
+        self.pr.onMessage('{"event": "trade", "data": "{}", "channel": "trades"}', False)
+        self.pr.onMessage('{"event": "pusher:pong", "data": "{}"}', False)
+        self.assertEqual(self.m.call_count, 2)
+        self.assertEqual(self.pr.dropped_frames, 0)
+
     def test_on_message_with_binary_raises_not_implemented(self):
         self.assertRaises(NotImplementedError, self.pr.onMessage, '', True)
\ No newline at end of file
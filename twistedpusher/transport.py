@@ -2,6 +2,7 @@
 # -*- test-case-name: twistedpusher.test.test_channel -*-
 
 import logging
+import random
 import warnings
 from twisted.application.service import Service
 from twisted.internet import task
@@ -16,6 +17,83 @@ log = logging.getLogger(__name__)
 # maximum delay between reconnect attempts
 MAX_RECONNECT_DELAY = 10
 
+
+class BackoffPolicy(object):
+    """
+    Decides how long a Transport waits before each connection attempt.
+
+    ========================  =========================================================
+    Attempt                   Delay
+    ========================  =========================================================
+    first, on startup         ``first_delay``, none by default
+    first, after a loss       random between 0 and ``base``
+    after a 4200-class error  random between 0 and ``fast_retry_window``, ``fast_retries`` times
+    later attempts            decorrelated jitter: random between ``base`` and 3 times the
+                              previous delay, at most ``cap``
+    ========================  =========================================================
+
+    Randomized delays keep many clients that lost their connections at once from reconnecting at once.
+    """
+    def __init__(self, base=1, cap=MAX_RECONNECT_DELAY, first_delay=0, fast_retry_window=0.5, fast_retries=1,
+                 rng=None):
+        """
+        :param base: shortest delay of a retry, in seconds
+        :type base: int or float
+        :param cap: longest delay, in seconds
+        :type cap: int or float
+        :param first_delay: delay of the very first connection attempt
+        :type first_delay: int or float
+        :param fast_retry_window: longest delay of a retry after a server error asking to reconnect immediately
+        :type fast_retry_window: float
+        :param fast_retries: number of attempts using the fast retry window after such an error
+        :type fast_retries: int
+        :param rng: optional ``random.Random`` instance
+        """
+        self.base = base
+        self.cap = cap
+        self.first_delay = first_delay
+        self.fast_retry_window = fast_retry_window
+        self.fast_retries = fast_retries
+        self.rng = rng or random.Random()
+
+        self._attempt = 0
+        self._previous = base
+        self._connected_before = False
+        self._fast_retries_left = 0
+
+    def next_delay(self):
+        """
+        Get the delay of the next connection attempt.
+
+        :rtype: float
+        """
+        if self._fast_retries_left:
+            self._fast_retries_left -= 1
+            delay = self.rng.uniform(0, self.fast_retry_window)
+        elif not self._attempt:
+            delay = self.rng.uniform(0, self.base) if self._connected_before else self.first_delay
+        else:
+            delay = min(self.cap, self.rng.uniform(self.base, self._previous * 3))
+            self._previous = delay
+        self._attempt += 1
+        return delay
+
+    def reset(self):
+        """Start over after a connection succeeded."""
+        self._attempt = 0
+        self._previous = self.base
+        self._connected_before = True
+
+    def copy(self):
+        """Get a policy with the same settings and no history, for another transport."""
+        return BackoffPolicy(self.base, self.cap, self.first_delay, self.fast_retry_window, self.fast_retries,
+                             self.rng)
+
+    def fast_retry(self):
+        """Use the fast retry window for the next attempts, e.g. after a 4200-class Pusher error."""
+        self._fast_retries_left = self.fast_retries
+
+
 # all possible transport states
 TRANSPORT_STATES = {'connected', 'disconnected', 'connecting', 'disconnecting', 'reconnecting'}
 
@@ -30,6 +108,8 @@ class Transport(EventEmitter, Service):
 
     :ivar endpoint: the endpoint to connect with
     :ivar factory: the factory that builds `IPusherProtocol` objects
+    :ivar auto_reconnect: whether to connect again after losing the connection or failing to connect, see
+        ``resume_reconnecting``
 
     ==================  =======================================
     Possible states:
@@ -55,7 +135,7 @@ class Transport(EventEmitter, Service):
     ==================  =======================================
 
     """
-    def __init__(self, factory, endpoint, on_pusher_event, reactor=None):
+    def __init__(self, factory, endpoint, on_pusher_event, reactor=None, backoff=None, metrics=None):
         """
         Manages the transport with auto-reconnecting and state events.
 
@@ -63,6 +143,10 @@ class Transport(EventEmitter, Service):
         :param endpoint: an endpoint to connect with
         :param on_pusher_event: function to call with received Pusher events
         :param reactor: optional IReactorTime provider, defaults to twisted.internet.reactor
+        :param backoff: optional policy for the delays between connection attempts, defaults to a BackoffPolicy
+        :type backoff: BackoffPolicy
+        :param metrics: optional metrics to count connections and time spent in each state with
+        :type metrics: twistedpusher.metrics.PusherMetrics
         """
         EventEmitter.__init__(self)
 
@@ -80,12 +164,20 @@ class Transport(EventEmitter, Service):
         self._state = 'disconnected'
         self.prev_state = self._state
 
+        self.metrics = metrics
+        self._state_since = self.reactor.seconds()
+        self._connected_before = False
+        if metrics is not None:
+            metrics.transport_state_changed(None, self._state, 0)
+
         self.connect_attempt_timeout = Timeout(30,
                                                self._disconnect,
                                                reactor=self.reactor)
 
+        self.backoff = backoff or BackoffPolicy()
         self.connect_attempt = None
         self.connect_attempt_count = 0
+        self.auto_reconnect = True
 
     def startService(self):
         super(Transport, self).startService()
@@ -100,14 +192,18 @@ class Transport(EventEmitter, Service):
         self._disconnect()
         # connect will happen automatically
 
+    def resume_reconnecting(self):
+        """Turn ``auto_reconnect`` back on, and connect if the connection was lost while it was off."""
+        self.auto_reconnect = True
+        if self.running and self.state == 'disconnected':
+            self._connect()
+
     def _connect(self):
         """Connect the transport."""
         if self.state == 'disconnected':
             self.state = 'connecting'
 
-            # double reconnect delay each call.
-            # Range:     1 <= delay <= max_reconn_delay
-            connect_wait_time = max(1, min(MAX_RECONNECT_DELAY, 2**self.connect_attempt_count))
+            connect_wait_time = self.backoff.next_delay()
 
             if connect_wait_time:
                 # we'll be waiting to connect
@@ -118,6 +214,8 @@ class Transport(EventEmitter, Service):
                 self.emit_event(Event(name='started_connecting'))
 
             def do_connect():
+                if self.metrics is not None:
+                    self.metrics.connection_attempts.inc()
                 self.connect_attempt = self.endpoint.connect(self.factory)
                 self.connect_attempt_timeout.start()
                 self.connect_attempt.addCallbacks(self._connected, self._failed)
@@ -151,6 +249,16 @@ class Transport(EventEmitter, Service):
         else:
             warnings.warn("Attempted to send an event while the transport is disconnected")
 
+    def send_events(self, events):
+        """
+        :param events: the events to send in one write
+        :type events: list
+        """
+        if self.state == 'connected':
+            self.protocol.send_events(events)
+        else:
+            warnings.warn("Attempted to send events while the transport is disconnected")
+
     @property
     def state(self):
         return self._state
@@ -162,6 +270,10 @@ class Transport(EventEmitter, Service):
             self.prev_state = self._state
             self._state = new_state
             log.debug("Transport state: {} -> {}".format(self.prev_state, new_state))
+            if self.metrics is not None:
+                now = self.reactor.seconds()
+                self.metrics.transport_state_changed(self.prev_state, new_state, now - self._state_since)
+                self._state_since = now
 
     def _connected(self, proto):
         """
@@ -170,9 +282,15 @@ class Transport(EventEmitter, Service):
         :param proto: an IPusherProtocol provider
         """
         self.state = 'connected'
+        if self.metrics is not None:
+            self.metrics.connections.inc()
+            if self._connected_before:
+                self.metrics.reconnects.inc()
+        self._connected_before = True
 
         self.protocol = proto
         self.connect_attempt_count = 0
+        self.backoff.reset()
         self.connect_attempt_timeout.stop()
         self.protocol.on_event = self.on_event
         self.protocol.on_connection_lost.addCallback(self._lost)
@@ -187,8 +305,10 @@ class Transport(EventEmitter, Service):
         """
         old_state = self.state
         self.state = 'disconnected'
+        if self.metrics is not None:
+            self.metrics.connection_failures.inc()
 
-        if old_state != 'disconnecting':
+        if old_state != 'disconnecting' and self.auto_reconnect:
             self._connect()
         # returning this doesn't work, since it re-raises the exception
         #return reason
@@ -201,6 +321,8 @@ class Transport(EventEmitter, Service):
         """
         old_state = self.state
         self.state = 'disconnected'
+        if self.metrics is not None:
+            self.metrics.disconnections.inc()
         self.emit_event(Event(name='disconnected'))
 
         if old_state == 'connected':
@@ -210,7 +332,7 @@ class Transport(EventEmitter, Service):
                     reason = ': ' + reason
                 log.info("Unexpected Pusher connection loss{}".format(reason))
 
-        if old_state != 'disconnecting':
+        if old_state != 'disconnecting' and self.auto_reconnect:
             self._connect()
 
         return info
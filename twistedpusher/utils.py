@@ -1,11 +1,201 @@
 #!/usr/bin/env python
+# -*- test-case-name: twistedpusher.test.test_utils -*-
 
 import logging
-from twisted.internet import error
+import math
+import time
+import weakref
 
 log = logging.getLogger(__name__)
 
 
+if hasattr(time, 'monotonic_ns'):
+    monotonic_ns = time.monotonic_ns
+elif hasattr(time, 'monotonic'):
+    def monotonic_ns():
+        """Get the time of a monotonic clock in integer nanoseconds."""
+        return int(time.monotonic() * 1e9)
+else:
+    def monotonic_ns():
+        """Get the time in integer nanoseconds. Python 2 has no monotonic clock, so this follows the wall clock."""
+        return int(time.time() * 1e9)
+
+
+if hasattr(time, 'thread_time_ns'):
+    cpu_time_ns = time.thread_time_ns
+elif hasattr(time, 'process_time'):
+    def cpu_time_ns():
+        """Get the CPU time of the process in integer nanoseconds."""
+        return int(time.process_time() * 1e9)
+else:
+    def cpu_time_ns():
+        """Get the CPU time of the process in integer nanoseconds."""
+        return int(time.clock() * 1e9)
+
+
+# seconds between ticks of the shared timer wheels, timeouts fire at most this late
+TIMER_RESOLUTION = 1
+# number of slots of a timer wheel, timers further than this many ticks away wait several turns
+TIMER_WHEEL_SLOTS = 512
+
+
+class TimerWheel(object):
+    """
+    Hashed timer wheel firing :class:`Timeout` callbacks at coarse ticks.
+
+    Timers are kept in the slot of the tick their deadline falls on. Moving a deadline later, as resetting an
+    activity timeout does on every message, only records the new deadline: the timer is moved when its old slot
+    comes up. The wheel only ticks while it holds timers, so a reactor with no timeouts running has no call
+    scheduled.
+
+    :ivar resolution: seconds between ticks
+    :type resolution: int or float
+    """
+    # IReactorTime provider -> its shared TimerWheel
+    _shared = weakref.WeakKeyDictionary()
+
+    def __init__(self, resolution=TIMER_RESOLUTION, slots=TIMER_WHEEL_SLOTS, reactor=None):
+        """
+        :param resolution: seconds between ticks
+        :type resolution: int or float
+        :param slots: number of slots
+        :type slots: int
+        :param reactor: :class:`IReactorTime` provider, defaults to :class:`twisted.internet.reactor`
+        """
+        if not reactor:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self.resolution = resolution
+        self._slots = [set() for _ in range(slots)]
+        self._timers = 0
+        # the next tick to process, and the call processing it
+        self._next_tick = None
+        self._call = None
+        # timers due in the tick being processed, not fired yet
+        self._due = set()
+        self._processing = False
+
+    @classmethod
+    def for_reactor(cls, reactor):
+        """
+        Get the wheel shared by the timeouts of a reactor.
+
+        :param reactor: :class:`IReactorTime` provider
+        :rtype: TimerWheel
+        """
+        try:
+            return cls._shared[reactor]
+        except KeyError:
+            wheel = cls._shared[reactor] = cls(reactor=reactor)
+            return wheel
+
+    def __len__(self):
+        return self._timers
+
+    def tick_of(self, when):
+        """Get the first tick at or after a time."""
+        # tolerate float error so timers due exactly on a tick fire on it
+        return int(math.ceil(when / float(self.resolution) - 1e-9))
+
+    def add(self, timer):
+        """
+        Schedule a timer to fire at its ``deadline``.
+
+        :type timer: Timeout
+        """
+        if self._next_tick is None:
+            self._next_tick = self.tick_of(self.reactor.seconds())
+        self._insert(timer, self.tick_of(timer.deadline))
+        self._timers += 1
+        if self._call is None and not self._processing:
+            self._schedule()
+
+    def remove(self, timer):
+        """
+        Unschedule a timer.
+
+        :type timer: Timeout
+        """
+        if timer in self._due:
+            self._due.discard(timer)
+        else:
+            self._slots[timer.wheel_tick % len(self._slots)].discard(timer)
+        timer.wheel_tick = None
+        self._timers -= 1
+        if not self._timers and not self._processing:
+            self._stop()
+
+    def moved(self, timer):
+        """
+        Notify the wheel that a timer's deadline changed. Later deadlines are picked up lazily.
+
+        :type timer: Timeout
+        """
+        tick = self.tick_of(timer.deadline)
+        if tick < timer.wheel_tick and timer not in self._due:
+            self._slots[timer.wheel_tick % len(self._slots)].discard(timer)
+            self._insert(timer, tick)
+            if self._call is not None and self._call.getTime() > tick * self.resolution:
+                self._call.cancel()
+                self._schedule()
+
+    def _insert(self, timer, tick):
+        tick = max(tick, self._next_tick)
+        timer.wheel_tick = tick
+        self._slots[tick % len(self._slots)].add(timer)
+
+    def _schedule(self):
+        delay = self._next_tick * self.resolution - self.reactor.seconds()
+        self._call = self.reactor.callLater(max(delay, 0), self._process)
+
+    def _stop(self):
+        if self._call is not None:
+            self._call.cancel()
+            self._call = None
+        self._next_tick = None
+
+    def _process(self):
+        """Fire the timers due up to now and move those whose deadline was pushed back."""
+        self._call = None
+        self._processing = True
+        try:
+            # the last tick that has come
+            now_tick = int(math.floor(self.reactor.seconds() / float(self.resolution) + 1e-9))
+            while self._timers and self._next_tick <= now_tick:
+                tick = self._next_tick
+                self._next_tick += 1
+                slot = self._slots[tick % len(self._slots)]
+                due = []
+                for timer in [t for t in slot if t.wheel_tick <= tick]:
+                    slot.discard(timer)
+                    deadline_tick = self.tick_of(timer.deadline)
+                    if deadline_tick > tick:
+                        self._insert(timer, deadline_tick)
+                    else:
+                        due.append(timer)
+                self._due.update(due)
+                for timer in due:
+                    # an earlier callback may have stopped or reset it
+                    if timer not in self._due:
+                        continue
+                    self._due.discard(timer)
+                    if self.tick_of(timer.deadline) > tick:
+                        self._insert(timer, self.tick_of(timer.deadline))
+                    else:
+                        timer.wheel_tick = None
+                        self._timers -= 1
+                        try:
+                            timer.expire()
+                        except Exception:
+                            log.error("Error in a timeout callback.", exc_info=True)
+        finally:
+            self._processing = False
+        if self._timers:
+            self._schedule()
+        else:
+            self._stop()
+
+
 class Timeout(object):
     """
     :ivar duration: how long to wait before triggering the callback
@@ -17,39 +207,48 @@ class Timeout(object):
     :ivar callback: the function to call on timeout
 
     :ivar timed_out: whether the timeout was triggered
+
+    :ivar deadline: when the timeout will trigger, in reactor seconds
+    :type deadline: float
     """
-    def __init__(self, duration, callback, start_now=False, reactor=None):
+    def __init__(self, duration, callback, start_now=False, reactor=None, wheel=None):
         """
         Timeout is a way to create timeouts that call a function if the clock runs out.
         They can be started, stopped, and reset.
 
+        Timeouts are checked by a :class:`TimerWheel`, so they trigger up to its resolution late. Resetting only
+        records the new deadline, which makes it cheap enough to do on every message.
+
         :param duration: timeout length
         :type duration: int or float
         :param callback: function to call. Arguments to it can be provided in `start`
         :param start_now: whether to start the timeout on creation
         :type start_now: bool
         :param reactor: :class:`IReactorTime` provider, defaults to :class:`twisted.internet.reactor`
+        :param wheel: the timer wheel to use, defaults to the one shared by the reactor's timeouts
+        :type wheel: TimerWheel
         """
-        self._timer = None
-        """:type: DelayedCall"""
         self.duration = duration
         self.callback = callback
         self.timed_out = False
+        self.deadline = None
+        # tick of the wheel slot holding the timeout while active, managed by the wheel
+        self.wheel_tick = None
+        self._args = ()
+        self._kwargs = {}
         if reactor:
             self.reactor = reactor
         else:
             from twisted.internet import reactor
             self.reactor = reactor
+        self.wheel = wheel or TimerWheel.for_reactor(self.reactor)
 
         if start_now:
             self.start()
 
     @property
     def active(self):
-        if self._timer:
-            return self._timer.active()
-        else:
-            return False
+        return self.wheel_tick is not None
 
     def reset(self, duration=None):
         """
@@ -58,35 +257,56 @@ class Timeout(object):
         :param duration: optional, change the Timeout's duration
         :type duration: int or float
         """
-        if self._timer:
+        if self.wheel_tick is not None:
+            self.deadline = self.reactor.seconds() + (duration or self.duration)
             if duration:
+                # only a new duration can bring the deadline forward
                 self.duration = duration
-            self._timer.reset(self.duration)
+                self.wheel.moved(self)
         else:
             log.info("Cannot reset the timeout since it is not active")
 
     def start(self, *args, **kwargs):
         """Start the timer. `args` and `kwargs` are passed to the callback."""
         self.timed_out = False
-        if not self._timer:
-            self._timer = self.reactor.callLater(self.duration, self._trigger, *args, **kwargs)
+        if self.wheel_tick is None:
+            self._args, self._kwargs = args, kwargs
+            self.deadline = self.reactor.seconds() + self.duration
+            self.wheel.add(self)
         else:
             log.debug('Timeout started while already running')
 
+    def start_at(self, deadline):
+        """
+        Start the timer to trigger at a given time, or move it there if it is running.
+
+        :param deadline: when to trigger, in reactor seconds
+        :type deadline: float
+        """
+        self.timed_out = False
+        if self.wheel_tick is None:
+            self.deadline = deadline
+            self.wheel.add(self)
+        else:
+            earlier = deadline < self.deadline
+            self.deadline = deadline
+            if earlier:
+                self.wheel.moved(self)
+
     def stop(self):
         """Stop the timer."""
-        if self._timer:
-            try:
-                self._timer.cancel()
-            except (error.AlreadyCalled, error.AlreadyCancelled, AttributeError) as e:
-                log.debug("Issue canceling a timeout: {0}".format(e), exc_info=True)
-            self._timer = None
-            """:type: DelayedCall"""
+        if self.wheel_tick is not None:
+            self.wheel.remove(self)
         else:
             log.info("Cannot stop the timeout since it is not active")
 
+    def expire(self):
+        """Called by the wheel once the deadline has passed."""
+        args, kwargs = self._args, self._kwargs
+        self._args, self._kwargs = (), {}
+        self._trigger(*args, **kwargs)
+
     def _trigger(self, *args, **kwargs):
         """Trigger the timeout callback."""
-        self._timer = None
         self.timed_out = True
         self.callback(*args, **kwargs)
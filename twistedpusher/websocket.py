@@ -7,7 +7,8 @@ from zope.interface import implementer
 from twisted.internet import defer
 from autobahn.twisted.websocket import WebSocketClientProtocol, WebSocketClientFactory
 
-from twistedpusher.events import load_pusher_event, serialize_pusher_event
+from twistedpusher.core import decode_frame
+from twistedpusher.events import serialize_pusher_event
 from twistedpusher.interfaces import IPusherProtocol
 
 log = logging.getLogger(__name__)
@@ -15,10 +16,19 @@ log = logging.getLogger(__name__)
 
 @implementer(IPusherProtocol)
 class PusherWebsocketProtocol(WebSocketClientProtocol):
+    factory = None
+
     def __init__(self):
-        """Pusher websocket connection."""
+        """
+        Pusher websocket connection.
+
+        :ivar dropped_frames: number of frames discarded by the factory's ``channel_filter``
+        :type dropped_frames: int
+        """
         self.on_connection_lost = defer.Deferred()
         self.on_event = None
+        self.dropped_frames = 0
+        self._write_batch = None
 
     def onClose(self, wasClean, code, reason):
         """Handle Websocket connection shutdowns."""
@@ -26,11 +36,19 @@ class PusherWebsocketProtocol(WebSocketClientProtocol):
 
     def onMessage(self, payload, isBinary):
         """
-        Receive websocket messages.
+        Receive websocket messages, loaded with the factory's settings by ``twistedpusher.core.decode_frame``.
         :type isBinary: bool
         """
         if not isBinary:
-            event = load_pusher_event(payload)
+            factory = self.factory
+            if factory:
+                event = decode_frame(payload, None, factory.json_data_channels, factory.channel_filter,
+                                     factory.metrics)
+                if event is None:
+                    self.dropped_frames += 1
+                    return
+            else:
+                event = decode_frame(payload)
             if self.on_event:
                 self.on_event(event)
         else:
@@ -40,6 +58,35 @@ class PusherWebsocketProtocol(WebSocketClientProtocol):
     def send_event(self, event):
         """:type event: Event"""
         self.sendMessage(serialize_pusher_event(event))
+        self._count_sent(1)
+
+    def send_events(self, events):
+        """
+        Send events with one write to the transport, so they share TCP segments and TLS records.
+
+        :type events: list
+        """
+        self._write_batch = []
+        try:
+            for event in events:
+                self.sendMessage(serialize_pusher_event(event))
+        finally:
+            batch, self._write_batch = self._write_batch, None
+        if batch:
+            WebSocketClientProtocol.sendData(self, b''.join(batch))
+        self._count_sent(len(events))
+
+    def _count_sent(self, frames):
+        metrics = self.factory.metrics if self.factory else None
+        if metrics is not None:
+            metrics.frames_sent.inc(frames)
+
+    def sendData(self, data, sync=False, chopsize=None):
+        """Collect frame data while in ``send_events``, otherwise write it as usual."""
+        if self._write_batch is not None and not sync and not chopsize:
+            self._write_batch.append(data)
+        else:
+            WebSocketClientProtocol.sendData(self, data, sync, chopsize)
 
     def disconnect(self):
         if self.state == WebSocketClientProtocol.STATE_OPEN:
@@ -47,6 +94,23 @@ class PusherWebsocketProtocol(WebSocketClientProtocol):
 
 
 class PusherWebsocketFactory(WebSocketClientFactory):
-    """Factory for Pusher websocket connections."""
+    """
+    Factory for Pusher websocket connections.
+
+    :ivar json_data_channels: names of channels whose client event data is decoded as JSON while loading the event
+    :type json_data_channels: set
+
+    :ivar channel_filter: if set, channel events for channels not in this container are dropped before being parsed
+    :type channel_filter: set or dict or None
+
+    :ivar metrics: if set, counts the frames of the protocols built
+    :type metrics: twistedpusher.metrics.PusherMetrics or None
+    """
     protocol = PusherWebsocketProtocol
-    noisy = False
\ No newline at end of file
+    noisy = False
+
+    def __init__(self, *args, **kwargs):
+        WebSocketClientFactory.__init__(self, *args, **kwargs)
+        self.json_data_channels = set()
+        self.channel_filter = None
+        self.metrics = None
\ No newline at end of file